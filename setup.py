@@ -45,7 +45,7 @@ setup(
     package_dir={'': 'src'},
     scripts=['scripts/fl-monitor-ctl', 'scripts/fl-credential-ctl',
              'scripts/fl-run-bench', 'scripts/fl-run-test',
-             'scripts/fl-build-report',
+             'scripts/fl-build-report', 'scripts/fl-convert-results',
              'scripts/fl-install-demo',
              'scripts/fl-record'],
     classifiers=[
@@ -84,6 +84,7 @@ setup(
             'fl-run-bench = funkload.BenchRunner:main',
             'fl-run-test = funkload.TestRunner:main',
             'fl-build-report = funkload.ReportBuilder:main',
+            'fl-convert-results = funkload.binlog:main',
             'fl-install-demo = funkload.DemoInstaller:main',
             'fl-record = funkload.Recorder:main'],
         'funkload.plugins.monitor': [
@@ -25,12 +25,19 @@ $Id: BenchRunner.py 24746 2005-08-31 09:59:27Z bdelbosc $
 """
 import os
 import platform
+import select
+import signal
 import sys
 import threading
 import time
 import traceback
 import unittest
+from copy import copy
 from datetime import datetime
+from math import log
+from random import expovariate
+from Queue import Queue, Empty
+from multiprocessing import Pipe, Process
 from optparse import OptionParser, TitledHelpFormatter
 from thread import error as ThreadError
 
@@ -38,6 +45,10 @@ from FunkLoadHTTPServer import FunkLoadHTTPServer
 from utils import mmn_encode, set_recording_flag, recording, thread_sleep, \
                   trace, red_str, green_str, get_version
 from stats import StatsCollector
+from livestats import enable_live_stats, get_live_stats
+from scheduler import enable_scheduler, get_scheduler, think
+from linkextractor import get_page_cache
+from DnsCache import get_dns_cache
 
 
 USAGE = """%prog [options] file class.method
@@ -88,6 +99,14 @@ def add_cycle_result(status):
         g_failures += 1
 
 
+def add_cycle_results(success, failures, errors):
+    """Add counters computed elsewhere, by a worker process."""
+    global g_success, g_failures, g_errors
+    g_success += success
+    g_failures += failures
+    g_errors += errors
+
+
 def get_cycle_results():
     """Return counters."""
     global g_success, g_failures, g_errors
@@ -120,6 +139,35 @@ def reset_cycle_results():
     g_success = g_failures = g_errors = 0
 
 
+def receive(connection):
+    """Wait for a message on a pipe.
+
+    select is used to wait so the gevent engine can switch to other
+    greenlets meanwhile."""
+    select.select([connection], [], [])
+    return connection.recv()
+
+
+def get_ramp_offsets(start, end, ramp_time, shape='linear'):
+    """Return the times from the start of a ramp from start to end
+    virtual users at which a virtual user is added or removed.
+
+    A linear ramp changes the number of users at a constant rate, an
+    exponential ramp by a constant factor."""
+    count = abs(end - start)
+    step = end > start and 1 or -1
+    low, high = max(start, 1), max(end, 1)
+    offsets = []
+    for i in range(1, count + 1):
+        if shape == 'exponential' and low != high:
+            level = max(start + i * step, 1)
+            offsets.append(ramp_time * log(float(level) / low) /
+                           log(float(high) / low))
+        else:
+            offsets.append(ramp_time * i / float(count))
+    return offsets
+
+
 def load_unittest(test_module, test_class, test_name, options):
     """instantiate a unittest."""
     module = __import__(test_module)
@@ -157,7 +205,7 @@ class LoopTestRunner(threading.Thread):
 
     def __init__(self, test_module, test_class, test_name, options,
                  cycle, cvus, thread_id, thread_signaller, sleep_time,
-                 debug=False):
+                 debug=False, start_time=None):
         meta_method_name = mmn_encode(test_name, cycle, cvus, thread_id)
         threading.Thread.__init__(self, target=self.run, name=meta_method_name,
                                   args=())
@@ -167,53 +215,227 @@ class LoopTestRunner(threading.Thread):
         self.sleep_time = sleep_time
         self.debug = debug
         self.thread_signaller = thread_signaller
+        # the planned start time to measure the start lag
+        self.start_time = start_time
         # this makes threads endings if main stop with a KeyboardInterupt
         self.setDaemon(1)
 
     def run(self):
         """Run a test in loop."""
-        while (self.thread_signaller.running()):
-            test_result = unittest.TestResult()
-            self.test.clearContext()
-            self.test(test_result)
-            if test_result.wasSuccessful():
+        live_stats = get_live_stats()
+        if live_stats is not None and self.start_time is not None:
+            live_stats.addThreadStart(max(time.time() - self.start_time, 0))
+        # the time the test should start, its delay is recorded to correct
+        # the coordinated omission
+        intended_start = self.start_time
+        try:
+            while (self.thread_signaller.running()):
+                if intended_start is not None:
+                    self.test._start_delay = max(
+                        time.time() - intended_start, 0)
+                test_result = self.runTest()
+                if test_result.shouldStop:
+                    break
+
+                intended_start = time.time() + self.sleep_time
+                think(self.sleep_time)
+        finally:
+            self.test.closeBrowser()
+
+    def setCycle(self, cycle, cvus):
+        """Move a virtual user kept for the next cycle."""
+        self.test.cycle = cycle
+        self.test.cvus = cvus
+
+    def runTest(self):
+        """Run the test once, return the unittest result."""
+        test_result = unittest.TestResult()
+        self.test.clearContext()
+        self.test(test_result)
+        if test_result.wasSuccessful():
+            if recording():
+                add_cycle_result('success')
+                if self.color:
+                    trace(green_str('.'))
+                else:
+                    trace('.')
+        else:
+            if len(test_result.errors):
                 if recording():
-                    add_cycle_result('success')
+                    add_cycle_result('error')
                     if self.color:
-                        trace(green_str('.'))
+                        trace(red_str('E'))
                     else:
-                        trace('.')
+                        trace('E')
             else:
-                if len(test_result.errors):
-                    if recording():
-                        add_cycle_result('error')
-                        if self.color:
-                            trace(red_str('E'))
-                        else:
-                            trace('E')
-                else:
-                    if recording():
-                        add_cycle_result('failure')
-                        if self.color:
-                            trace(red_str('F'))
-                        else:
-                            trace('F')
-                if self.debug:
-                    for (test, error) in test_result.errors:
-                        trace("ERROR %s: %s" % (str(test), str(error)))
-                    for (test, error) in test_result.failures:
-                        trace("FAILURE %s: %s" % (str(test), str(error)))
+                if recording():
+                    add_cycle_result('failure')
+                    if self.color:
+                        trace(red_str('F'))
+                    else:
+                        trace('F')
+            if self.debug:
+                for (test, error) in test_result.errors:
+                    trace("ERROR %s: %s" % (str(test), str(error)))
+                for (test, error) in test_result.failures:
+                    trace("FAILURE %s: %s" % (str(test), str(error)))
+        return test_result
+
+
+class ArrivalSchedule:
+    """The scheduled test starts of an arrival rate cycle, waiting for a
+    virtual user."""
+    def __init__(self):
+        self.queue = Queue()
+        self.lock = threading.Lock()
+        self.idle = 0
+
+    def put(self, start_time):
+        self.queue.put(start_time)
+
+    def get(self):
+        """Wait for a scheduled start time, None means stop."""
+        with self.lock:
+            self.idle += 1
+        try:
+            return self.queue.get()
+        finally:
+            with self.lock:
+                self.idle -= 1
+
+    def backlog(self):
+        """Return the number of starts no virtual user is waiting for."""
+        return self.queue.qsize() - self.idle
+
+    def clear(self):
+        """Remove the starts not taken yet, return their number."""
+        count = 0
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                return count
+            count += 1
+
+    def close(self, number_of_threads):
+        """Release the virtual users waiting for a start."""
+        for i in range(number_of_threads):
+            self.queue.put(None)
+
 
-            if test_result.shouldStop:
-                break
+class RateTestRunner(LoopTestRunner):
+    """Run a test at each start time of an arrival schedule.
 
-            thread_sleep(self.sleep_time)
+    The delay between the scheduled and the actual start is recorded with
+    the results, this is the time the test waited for a virtual user."""
+
+    def __init__(self, test_module, test_class, test_name, options,
+                 cycle, cvus, thread_id, thread_signaller, schedule):
+        LoopTestRunner.__init__(self, test_module, test_class, test_name,
+                                options, cycle, cvus, thread_id,
+                                thread_signaller, 0)
+        self.schedule = schedule
+
+    def run(self):
+        """Run a test for each scheduled start."""
+        try:
+            while (self.thread_signaller.running()):
+                start_time = self.schedule.get()
+                if start_time is None or not self.thread_signaller.running():
+                    break
+                self.test._start_delay = max(time.time() - start_time, 0)
+                if self.runTest().shouldStop:
+                    break
+        finally:
+            self.test.closeBrowser()
+
+
+class BenchWorker(Process):
+    """Run a share of the virtual users of each cycle in a forked process.
+
+    The worker is driven by the parent BenchRunner through a pipe, it
+    logs its records into its own result file that is merged by the
+    parent at the end of the bench."""
+
+    def __init__(self, worker_id, commands, replies, module_file,
+                 class_name, method_name, options):
+        Process.__init__(self, name='worker-%i' % worker_id)
+        self.worker_id = worker_id
+        self.commands = commands
+        self.replies = replies
+        self.module_file = module_file
+        self.class_name = class_name
+        self.method_name = method_name
+        self.options = options
+        # don't survive the parent
+        self.daemon = True
+
+    def run(self):
+        """Wait for commands from the parent runner."""
+        # ^C is handled by the parent
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        try:
+            bench = BenchRunner(self.module_file, self.class_name,
+                                self.method_name, self.options)
+            bench.test.logger_results.start_log()
+        except Exception:
+            self.replies.send(('error', traceback.format_exc()))
+            return
+        while True:
+            command = receive(self.commands)
+            try:
+                reply = self.dispatch(bench, command)
+            except Exception:
+                self.replies.send(('error', traceback.format_exc()))
+                return
+            self.replies.send(reply)
+            if command[0] == 'exit':
+                return
+
+    def dispatch(self, bench, command):
+        """Execute a command, return the reply to send to the parent."""
+        action = command[0]
+        if action == 'start':
+            cycle, cvus, number_of_threads, first_thread_id = command[1:]
+            reset_cycle_results()
+            set_recording_flag(False)
+            bench.last_thread_id = first_thread_id - 1
+            scheduler = get_scheduler()
+            if scheduler is not None:
+                scheduler.stats.export()
+            live_stats = get_live_stats()
+            if live_stats is not None:
+                live_stats.export()
+            bench.threads = bench.createThreads(cycle, number_of_threads, cvus)
+        elif action == 'record':
+            set_recording_flag(True)
+        elif action == 'stop':
+            set_recording_flag(False)
+            bench.deleteThreads(len(bench.threads))
+            bench.threads = []
+            scheduler = get_scheduler()
+            think_times = scheduler is not None and scheduler.stats.export()
+            live_stats = get_live_stats()
+            live = live_stats is not None and live_stats.export()
+            return ('stopped',) + get_cycle_results() + (think_times, live)
+        elif action == 'live':
+            live_stats = get_live_stats()
+            return (action, live_stats is not None and live_stats.export())
+        elif action == 'exit':
+            bench.logr_close()
+            dns_cache = get_dns_cache()
+            return ((action,) + bench.getResultsBlocking() +
+                    get_page_cache().stats() +
+                    (dns_cache is not None and dns_cache.stats() or
+                     (0, 0, 0.0)))
+        return (action,)
 
 
 class BenchRunner:
     """Run a unit test in bench mode."""
 
     def __init__(self, module_file, class_name, method_name, options):
+        self.module_file = module_file
         self.module_name = os.path.basename(os.path.splitext(module_file)[0])
         self.class_name = class_name
         self.method_name = method_name
@@ -230,7 +452,28 @@ class BenchRunner:
         self.test_description = test.conf_get(self.method_name, 'description',
                                               'No test description')
         self.test_url = test.conf_get('main', 'url')
-        self.cycles = map(int, test.conf_getList('bench', 'cycles'))
+        # the arrival rates of an open model bench replace the cycles of
+        # concurrent users
+        self.rates = map(int, test.conf_getList('bench', 'rates', [],
+                                                quiet=True))
+        if self.rates:
+            self.cycles = self.rates
+        else:
+            self.cycles = map(int, test.conf_getList('bench', 'cycles'))
+        self.arrival = test.conf_get('bench', 'arrival', 'constant',
+                                     quiet=True)
+        self.max_users = test.conf_getInt('bench', 'max_users', 0,
+                                          quiet=True)
+        # ramp the virtual users between the cycles instead of stopping them
+        self.ramp_time = test.conf_getFloat('bench', 'ramp_time', 0,
+                                            quiet=True)
+        self.ramp_shape = test.conf_get('bench', 'ramp_shape', 'linear',
+                                        quiet=True)
+        # keep the virtual users from a cycle to the next, only the
+        # difference is created or stopped
+        self.reuse_threads = test.conf_getInt('bench', 'reuse_threads', 0,
+                                              quiet=True)
+        self.keep_threads = bool(self.ramp_time or self.reuse_threads)
         self.duration = test.conf_getInt('bench', 'duration')
         self.startup_delay = test.conf_getFloat('bench', 'startup_delay')
         self.cycle_time = test.conf_getFloat('bench', 'cycle_time')
@@ -240,6 +483,13 @@ class BenchRunner:
         self.threads = []  # Contains list of ThreadData objects
         self.last_thread_id = -1
         self.thread_creation_lock = threading.Lock()
+        self.workers = []  # list of (BenchWorker, commands, replies)
+        self.number_of_workers = getattr(options, 'workers', None) or 0
+        self.worker_threads = 0
+        # stats of the worker processes
+        self.results_blocking = [0, 0.0]
+        self.page_cache_stats = [0, 0]
+        self.dns_cache_stats = [0, 0, 0.0]
 
         # setup monitoring
         monitor_hosts = []                  # list of (host, port, descr)
@@ -263,6 +513,9 @@ class BenchRunner:
         trace("========\n\n")
         cycle = total_success = total_failures = total_errors = 0
 
+        if self.number_of_workers:
+            # fork before opening the log and starting the monitoring
+            self.startWorkers()
         self.logr_open()
         trace("* setUpBench hook: ...")
         self.test.setUpBench()
@@ -274,22 +527,41 @@ class BenchRunner:
             for cvus in self.cycles:
                 t_start = time.time()
                 reset_cycle_results()
-                text = "Cycle #%i with %s virtual users\n" % (cycle, cvus)
+                if self.rates:
+                    text = "Cycle #%i with %s tests/s\n" % (cycle, cvus)
+                else:
+                    text = "Cycle #%i with %s virtual users\n" % (cycle,
+                                                                 cvus)
                 trace(text)
                 trace('-' * (len(text) - 1) + "\n\n")
                 trace("* setUpCycle hook: ...")
                 self.test.setUpCycle()
                 trace(' done.\n')
-                self.startThreads(cycle, cvus)
-                self.logging()
-                #self.dumpThreads()
-                self.stopThreads()
+                live_stats = get_live_stats()
+                if live_stats is not None:
+                    live_stats.startCycle(cycle, cvus)
+                scheduler = get_scheduler()
+                if scheduler is not None:
+                    scheduler.stats.snapshot(reset=True)
+                if self.rates:
+                    self.runRateCycle(cycle, cvus)
+                elif self.keep_threads:
+                    self.runRampCycle(cycle, cvus)
+                elif self.workers:
+                    self.runWorkersCycle(cycle, cvus)
+                else:
+                    self.startThreads(cycle, cvus)
+                    self.logging()
+                    #self.dumpThreads()
+                    self.stopThreads()
                 cycle += 1
                 trace("* tearDownCycle hook: ...")
                 self.test.tearDownCycle()
                 trace(' done.\n')
                 t_stop = time.time()
                 trace("* End of cycle, %.2fs elapsed.\n" % (t_stop - t_start))
+                if scheduler is not None:
+                    self.traceThinkTimes(scheduler.stats.snapshot(reset=True))
                 success, failures, errors = get_cycle_results()
                 status, code = get_status(success, failures, errors, self.color)
                 trace("* Cycle result: **%s**, "
@@ -298,10 +570,33 @@ class BenchRunner:
                 total_success += success
                 total_failures += failures
                 total_errors += errors
+            if self.keep_threads:
+                self.rampDown(cycle - 1)
         trace("* tearDownBench hook: ...")
         self.test.tearDownBench()
         trace(' done.\n\n')
+        if self.workers:
+            self.stopWorkers()
         self.logr_close()
+        if self.test._buffered_results:
+            count, blocked = self.getResultsBlocking()
+            trace("* Buffered results: virtual users waited %i times "
+                  "for the writer, %.3fs in total.\n\n" % (
+                      count + self.results_blocking[0],
+                      blocked + self.results_blocking[1]))
+        hits, misses = [sum(stats) for stats in zip(
+            get_page_cache().stats(), self.page_cache_stats)]
+        if hits + misses:
+            trace("* Page links cache: %i hits, %i misses, %.1f%% hit "
+                  "rate.\n\n" % (hits, misses,
+                                  100. * hits / (hits + misses)))
+        dns_cache = get_dns_cache()
+        if dns_cache is not None:
+            hits, resolutions, resolve_time = [sum(stats) for stats in zip(
+                dns_cache.stats(), self.dns_cache_stats)]
+            if resolutions:
+                trace("* DNS cache: %i hits, %i resolutions in %.3fs.\n\n"
+                      % (hits, resolutions, resolve_time))
 
         # display bench result
         trace("Result\n")
@@ -313,6 +608,24 @@ class BenchRunner:
         trace("Bench status: **%s**\n" % status)
         return code
 
+    def traceThinkTimes(self, stats):
+        """Display the drift of the think times of the cycle."""
+        if not stats['count']:
+            return
+        trace("* Think times: %i sleeps, %.3fs requested on average, "
+              "drift average %.1fms, median %.1fms, p99 %.1fms, "
+              "max %.1fms.\n" % (
+                  stats['count'], stats['requested'] / stats['count'],
+                  stats['average_drift'] * 1000, stats['p50_drift'] * 1000,
+                  stats['p99_drift'] * 1000, stats['max_drift'] * 1000))
+
+    def getResultsBlocking(self):
+        """Return the number of times and the time the virtual users
+        waited for the results writer."""
+        logger = self.test.logger_results
+        return (getattr(logger, 'blocked_count', 0),
+                getattr(logger, 'blocked_time', 0.0))
+
     def createThreadId(self):
         self.last_thread_id += 1
         return self.last_thread_id
@@ -344,35 +657,198 @@ class BenchRunner:
             set_recording_flag(True)
             self.thread_creation_lock.release()
 
-    def createThreads(self, cycle, number_of_threads):
+    def createThreads(self, cycle, number_of_threads, cvus=None):
         """Creates number_of_threads threads and returns as a list.
 
+        cvus is the number of concurrent users of the cycle, it differs
+        from number_of_threads when the cycle is shared between workers.
+
         NOTE: This method is not thread safe. Thread safety must be
         handled by the caller."""
+        if cvus is None:
+            cvus = number_of_threads
         threads = []
         i = 0
+        start_time = time.time()
         for i in range(number_of_threads):
-            thread_id = self.createThreadId()
-            thread_signaller = ThreadSignaller()
-            thread = LoopTestRunner(self.module_name, self.class_name,
-                                    self.method_name, self.options,
-                                    cycle, number_of_threads,
-                                    thread_id, thread_signaller,
-                                    self.sleep_time)
-            trace(".")
-            try:
-                thread.start()
-            except ThreadError:
-                trace("\nERROR: Can not create more than %i threads, try a "
-                      "smaller stack size using: 'ulimit -s 2048' "
-                      "for example\n" % (i + 1))
-                raise
-            thread_data = ThreadData(thread, thread_id, thread_signaller)
-            threads.append(thread_data)
+            threads.append(self.createThread(
+                cycle, cvus, start_time + i * self.startup_delay, i))
             thread_sleep(self.startup_delay)
         trace(' done.\n')
         return threads
 
+    def createThread(self, cycle, cvus, start_time=None, count=0):
+        """Create and start a virtual user, count is the number of
+        threads created before it, return its ThreadData."""
+        thread_id = self.createThreadId()
+        thread_signaller = ThreadSignaller()
+        thread = LoopTestRunner(self.module_name, self.class_name,
+                                self.method_name, self.options,
+                                cycle, cvus,
+                                thread_id, thread_signaller,
+                                self.sleep_time,
+                                start_time=start_time)
+        trace(".")
+        try:
+            thread.start()
+        except ThreadError:
+            trace("\nERROR: Can not create more than %i threads, try a "
+                  "smaller stack size using: 'ulimit -s 2048' "
+                  "for example, or the gevent engine\n" % (count + 1))
+            raise
+        return ThreadData(thread, thread_id, thread_signaller)
+
+    def rampThreads(self, cycle, cvus):
+        """Add or remove virtual users until there are cvus, following
+        the ramp shape during the ramp time, or with the startup delay
+        between threads without ramp time.
+
+        The removed virtual users end their current test."""
+        start = len(self.threads)
+        ramp_start = time.time()
+        stopped = []
+        if self.ramp_time:
+            offsets = get_ramp_offsets(start, cvus, self.ramp_time,
+                                       self.ramp_shape)
+        else:
+            offsets = [i * self.startup_delay
+                       for i in range(abs(cvus - start))]
+        for offset in offsets:
+            delay = ramp_start + offset - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.thread_creation_lock.acquire()
+            try:
+                if cvus > start:
+                    self.threads.append(self.createThread(
+                        cycle, cvus, ramp_start + offset,
+                        len(self.threads)))
+                else:
+                    thread_data = self.threads.pop()
+                    thread_data.thread_signaller.set_running(False)
+                    stopped.append(thread_data)
+                    trace('.')
+            finally:
+                self.thread_creation_lock.release()
+        delay = ramp_start + self.ramp_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        for thread_data in stopped:
+            thread_data.thread.join()
+
+    def runRampCycle(self, cycle, cvus):
+        """Ramp the virtual users of the previous cycle to cvus then log
+        during the duration, the virtual users are kept for the next
+        cycle."""
+        trace("* Current time: %s\n" % datetime.now().isoformat())
+        if self.ramp_time:
+            trace("* Ramping from %i to %i threads in %ss: " % (
+                len(self.threads), cvus, self.ramp_time))
+        else:
+            trace("* Changing from %i to %i threads: " % (
+                len(self.threads), cvus))
+        set_recording_flag(False)
+        self.rampThreads(cycle, cvus)
+        for thread_data in self.threads:
+            thread_data.thread.setCycle(cycle, cvus)
+        trace(' done.\n')
+        self.logging()
+
+    def rampDown(self, cycle):
+        """Stop the virtual users kept between the cycles at the end of
+        the bench."""
+        if self.ramp_time:
+            trace("* Ramping down from %i threads in %ss: " % (
+                len(self.threads), self.ramp_time))
+            self.rampThreads(cycle, 0)
+        else:
+            trace("* Waiting end of threads: ")
+            self.thread_creation_lock.acquire()
+            try:
+                self.deleteThreads(len(self.threads))
+            finally:
+                self.thread_creation_lock.release()
+        self.last_thread_id = -1
+        trace(' done.\n\n')
+
+    def createRateThread(self, cycle, rate, schedule):
+        """Create and start a virtual user of an arrival rate cycle.
+
+        NOTE: This method is not thread safe. Thread safety must be
+        handled by the caller."""
+        thread_id = self.createThreadId()
+        thread_signaller = ThreadSignaller()
+        thread = RateTestRunner(self.module_name, self.class_name,
+                                self.method_name, self.options,
+                                cycle, rate, thread_id, thread_signaller,
+                                schedule)
+        try:
+            thread.start()
+        except ThreadError:
+            trace("\nERROR: Can not create more than %i threads, try a "
+                  "smaller stack size using: 'ulimit -s 2048' "
+                  "for example, or the gevent engine\n" % len(self.threads))
+            raise
+        thread_data = ThreadData(thread, thread_id, thread_signaller)
+        self.threads.append(thread_data)
+        return thread_data
+
+    def getArrivalInterval(self, rate):
+        """Return the time to the next test start."""
+        if self.arrival == 'poisson':
+            return expovariate(rate)
+        return 1. / rate
+
+    def runRateCycle(self, cycle, rate):
+        """Start rate tests per second during the cycle duration.
+
+        Tests are started at their scheduled time whatever the response
+        time of the server, new virtual users are created when none is
+        available, up to max_users."""
+        schedule = ArrivalSchedule()
+        max_users = self.max_users
+        # enough virtual users for tests lasting up to a second
+        number_of_threads = max_users and min(rate, max_users) or rate
+        self.thread_creation_lock.acquire()
+        try:
+            trace("* Current time: %s\n" % datetime.now().isoformat())
+            trace("* Starting threads: ")
+            set_recording_flag(False)
+            for i in range(number_of_threads):
+                self.createRateThread(cycle, rate, schedule)
+                trace(".")
+                thread_sleep(self.startup_delay)
+            trace(' done.\n')
+        finally:
+            self.thread_creation_lock.release()
+        set_recording_flag(True)
+        start_time = now = time.time()
+        end_time = start_time + self.duration
+        trace("* Starting %i tests/s (%s arrival) for %ds (until %s): " % (
+            rate, self.arrival, self.duration,
+            datetime.fromtimestamp(end_time).isoformat()))
+        while rate and start_time < end_time:
+            if start_time > now:
+                time.sleep(start_time - now)
+            schedule.put(start_time)
+            if schedule.backlog() > 0 and (
+                not max_users or len(self.threads) < max_users):
+                with self.thread_creation_lock:
+                    self.createRateThread(cycle, rate, schedule)
+            start_time += self.getArrivalInterval(rate)
+            now = time.time()
+        if end_time > now:
+            time.sleep(end_time - now)
+        set_recording_flag(False)
+        dropped = schedule.clear()
+        schedule.close(len(self.threads))
+        trace(" done.\n")
+        trace("* %i virtual users were used" % len(self.threads))
+        if dropped:
+            trace(", %i scheduled tests were not started" % dropped)
+        trace(".\n")
+        self.stopThreads()
+
     def logging(self):
         """Log activity during duration."""
         duration = self.duration
@@ -380,10 +856,18 @@ class BenchRunner:
         trace("* Logging for %ds (until %s): " % (
             duration, datetime.fromtimestamp(end_time).isoformat()))
         set_recording_flag(True)
+        live_stats = get_live_stats()
         now = time.time()
         while now < end_time:
-            # wait
-            time.sleep(max(end_time - now, 1))
+            if self.workers and live_stats is not None:
+                # the live stats are fed by the records of the workers
+                time.sleep(min(end_time - now, 1))
+                for reply in self.sendWorkers(('live',)):
+                    if reply[1]:
+                        live_stats.merge(reply[1])
+            else:
+                # wait
+                time.sleep(max(end_time - now, 1))
             now = time.time()
         set_recording_flag(False)
         trace(" done.\n")
@@ -432,7 +916,105 @@ class BenchRunner:
             trace('.')
 
     def getNumberOfThreads(self):
-        return len(self.threads)
+        return len(self.threads) + self.worker_threads
+
+    # ------------------------------------------------------------
+    # worker processes
+    #
+    def getWorkerResultPath(self, worker_id):
+        """Return the result file of a worker process."""
+        root, ext = os.path.splitext(self.result_path)
+        return '%s-worker%i%s' % (root, worker_id, ext)
+
+    def startWorkers(self):
+        """Fork the worker processes."""
+        trace("* Starting %i worker processes: " % self.number_of_workers)
+        for worker_id in range(self.number_of_workers):
+            options = copy(self.options)
+            options.workers = 0
+            options.bench_result_path = self.getWorkerResultPath(worker_id)
+            # keep the same thread startup rate than a single runner
+            options.bench_startup_delay = str(self.startup_delay *
+                                              self.number_of_workers)
+            # one way pipes, a gevent patched socketpair is non blocking
+            commands_reader, commands = Pipe(False)
+            replies, replies_writer = Pipe(False)
+            worker = BenchWorker(worker_id, commands_reader, replies_writer,
+                                 self.module_file, self.class_name,
+                                 self.method_name, options)
+            worker.start()
+            self.workers.append((worker, commands, replies))
+            trace('.')
+        trace(' done.\n')
+
+    def sendWorkers(self, command, shares=None):
+        """Send a command to all the workers and wait for their replies.
+
+        shares is an optional list of extra arguments, one per worker."""
+        for i, (worker, commands, replies) in enumerate(self.workers):
+            if shares is None:
+                commands.send(command)
+            else:
+                commands.send(command + shares[i])
+        ret = []
+        for worker, commands, replies in self.workers:
+            reply = receive(replies)
+            if reply[0] == 'error':
+                raise RuntimeError('Worker %s failed:\n%s' % (worker.name,
+                                                               reply[1]))
+            ret.append(reply)
+        return ret
+
+    def runWorkersCycle(self, cycle, cvus):
+        """Run a cycle splitting the cvus between the worker processes."""
+        trace("* Current time: %s\n" % datetime.now().isoformat())
+        trace("* Starting threads: ")
+        count, remainder = divmod(cvus, len(self.workers))
+        shares = []
+        first_thread_id = 0
+        for i in range(len(self.workers)):
+            number_of_threads = count + (i < remainder and 1 or 0)
+            shares.append((cycle, cvus, number_of_threads, first_thread_id))
+            first_thread_id += number_of_threads
+        self.sendWorkers(('start',), shares)
+        self.worker_threads = cvus
+        trace(' done.\n')
+        # all the virtual users are running, open the recording window
+        self.sendWorkers(('record',))
+        self.logging()
+        trace("* Waiting end of threads: ")
+        scheduler = get_scheduler()
+        live_stats = get_live_stats()
+        for reply in self.sendWorkers(('stop',)):
+            add_cycle_results(*reply[1:4])
+            if scheduler is not None and reply[4]:
+                scheduler.stats.merge(reply[4])
+            if live_stats is not None and reply[5]:
+                live_stats.merge(reply[5])
+        self.worker_threads = 0
+        trace(" done.\n")
+        trace("* Waiting cycle sleeptime %ds: ..." % self.cycle_time)
+        time.sleep(self.cycle_time)
+        trace(" done.\n")
+
+    def stopWorkers(self):
+        """Stop the workers and merge their records into the result file."""
+        trace("* Stopping worker processes: ")
+        for reply in self.sendWorkers(('exit',)):
+            for i, value in enumerate(reply[1:3]):
+                self.results_blocking[i] += value
+            for i, value in enumerate(reply[3:5]):
+                self.page_cache_stats[i] += value
+            for i, value in enumerate(reply[5:8]):
+                self.dns_cache_stats[i] += value
+        for worker_id, (worker, commands, replies) in enumerate(self.workers):
+            worker.join()
+            result_path = self.getWorkerResultPath(worker_id)
+            self.test.logger_results.merge(result_path)
+            os.remove(result_path)
+            trace('.')
+        self.workers = []
+        trace(' done.\n')
 
     def dumpThreads(self):
         """Display all different traceback of Threads for debugging.
@@ -483,6 +1065,14 @@ class BenchRunner:
                   'python_version': platform.python_version()}
         if self.options.label:
             config['label'] = self.options.label
+        if self.rates:
+            config['arrival'] = self.arrival
+            config['max_users'] = self.max_users
+        elif self.ramp_time:
+            config['ramp_time'] = self.ramp_time
+            config['ramp_shape'] = self.ramp_shape
+        elif self.reuse_threads:
+            config['reuse_threads'] = True
 
         for (host, port, desc) in self.monitor_hosts:
             config[host] = desc
@@ -513,7 +1103,18 @@ class BenchRunner:
         text.append("* Configuration file: %s" % self.config_path)
         text.append("* Log xml: %s" % self.result_path)
         text.append("* Server: %s" % self.test_url)
-        text.append("* Cycles: %s" % self.cycles)
+        if self.rates:
+            text.append("* Cycles of arrival rates: %s tests/s, %s "
+                        "arrival" % (self.cycles, self.arrival))
+            if self.max_users:
+                text.append("* Maximum virtual users: %s" % self.max_users)
+        else:
+            text.append("* Cycles: %s" % self.cycles)
+            if self.ramp_time:
+                text.append("* Ramp between cycles: %s in %ss" % (
+                    self.ramp_shape, self.ramp_time))
+            elif self.reuse_threads:
+                text.append("* Threads kept between cycles")
         text.append("* Cycle duration: %ss" % self.duration)
         text.append("* Sleeptime between request: from %ss to %ss" % (
             self.sleep_time_min, self.sleep_time_max))
@@ -561,6 +1162,49 @@ def main():
                       type="string",
                       dest="bench_startup_delay",
                       help="Startup delay between thread.")
+    parser.add_option("-r", "--rate",
+                      type="string",
+                      dest="bench_rates",
+                      help="Run an open model bench: start the tests at a "
+                           "target arrival rate whatever the response time "
+                           "of the server, instead of looping a fixed number "
+                           "of virtual users. This is a list of tests per "
+                           "second, one per cycle: -r 5:10:20")
+    parser.add_option("", "--arrival",
+                      type="choice",
+                      choices=('constant', 'poisson'),
+                      dest="bench_arrival",
+                      help="Arrival of the tests with --rate: 'constant' "
+                           "intervals or 'poisson' random intervals. Default "
+                           "is 'constant'.")
+    parser.add_option("", "--max-users",
+                      type="string",
+                      dest="bench_max_users",
+                      help="Maximum number of virtual users created with "
+                           "--rate, default is no limit.")
+    parser.add_option("", "--ramp-time",
+                      type="string",
+                      dest="bench_ramp_time",
+                      help="Ramp the virtual users continuously from a cycle "
+                           "to the next during RAMP_TIME seconds, the threads "
+                           "are kept between the cycles instead of being "
+                           "stopped and created again, there is no cycle "
+                           "sleep time and the bench ends with a ramp down.")
+    parser.add_option("", "--ramp-shape",
+                      type="choice",
+                      choices=('linear', 'exponential'),
+                      dest="bench_ramp_shape",
+                      help="Shape of the ramps with --ramp-time: 'linear' "
+                           "adds users at a constant rate, 'exponential' "
+                           "by a constant factor. Default is 'linear'.")
+    parser.add_option("", "--reuse-threads",
+                      action="store_const",
+                      const="1",
+                      dest="bench_reuse_threads",
+                      help="Keep the virtual users and their test case from "
+                           "a cycle to the next, only the difference of "
+                           "users is started or stopped, there is no cycle "
+                           "sleep time.")
     parser.add_option("-f", "--as-fast-as-possible",
                       action="store_true",
                       help="Remove sleep times between requests and between "
@@ -576,6 +1220,25 @@ def main():
                       dest="bench_simple_fetch",
                       help="Don't load additional links like css or images "
                            "when fetching an html page.")
+    parser.add_option("", "--no-keep-alive",
+                      action="store_const",
+                      const="0",
+                      dest="bench_keep_alive",
+                      help="Open a new connection for each request instead "
+                           "of reusing the keep alive connections of the "
+                           "virtual user.")
+    parser.add_option("", "--buffered-results",
+                      action="store_const",
+                      const="1",
+                      dest="bench_buffered_results",
+                      help="Write the result records from a dedicated "
+                           "writer thread instead of the virtual user "
+                           "threads.")
+    parser.add_option("", "--resource-concurrency",
+                      type="int",
+                      dest="bench_resource_concurrency",
+                      help="Number of css or images fetched at the same time "
+                           "from a host, like a browser does, default is 1.")
     parser.add_option("-l", "--label",
                       type="string",
                       help="Add a label to this bench run for easier "
@@ -625,6 +1288,22 @@ def main():
                       help="Additional packages to be passed to easy_install "
                            "on remote machines when being run in distributed "
                            "mode.")
+    parser.add_option("--engine",
+                      type="choice",
+                      choices=('thread', 'gevent'),
+                      default="thread",
+                      dest="engine",
+                      help="Virtual user engine: 'thread' runs each CU in an "
+                           "OS thread, 'gevent' runs CUs as greenlets on an "
+                           "event loop with non-blocking sockets which scales "
+                           "to many more mostly sleeping CUs, this requires "
+                           "the gevent package. Default is 'thread'.")
+    parser.add_option("-w", "--workers",
+                      type="int",
+                      dest="workers",
+                      help="Fork WORKERS processes on this host and split the "
+                           "virtual users of each cycle between them, to "
+                           "use more than one CPU core.")
     parser.add_option("--stop-on-failure",
                       action="store_true",
                       dest="stop_on_fail",
@@ -641,6 +1320,24 @@ def main():
     if not args[1].count('.'):
         parser.error("invalid argument; should be [class].[method]")
 
+    if options.bench_rates and (options.workers or options.distribute):
+        parser.error("--rate can not be used with --workers or --distribute")
+    if options.bench_ramp_time and (options.workers or options.bench_rates):
+        parser.error("--ramp-time can not be used with --workers or --rate")
+    if options.bench_reuse_threads and (options.workers or
+                                        options.bench_rates):
+        parser.error("--reuse-threads can not be used with --workers or "
+                     "--rate")
+
+    if options.engine == 'gevent':
+        try:
+            from gevent import monkey
+        except ImportError:
+            parser.error("the gevent engine requires the gevent package")
+        # turn threads, locks, sleeps and sockets into cooperative ones,
+        # this must be done before the bench creates any of them
+        monkey.patch_all()
+
     if options.as_fast_as_possible:
         options.bench_sleep_time_min = '0'
         options.bench_sleep_time_max = '0'
@@ -665,7 +1362,16 @@ def main():
 
         sys.exit(ret)
     else:
+        if options.debugserver == True:
+            # feed the /stats and /metrics pages of the debug server
+            enable_live_stats()
+        # park the sleeping virtual users on a single timer
+        enable_scheduler(wheel=options.engine != 'gevent')
         bench = BenchRunner(args[0], klass, method, options)
+        if bench.number_of_workers and (bench.rates or bench.keep_threads):
+            # the configuration file may enable these modes
+            parser.error("--workers can not be used with the rates, "
+                         "ramp_time or reuse_threads configuration")
 
         # Start a HTTP server optionally
         if options.debugserver == True:
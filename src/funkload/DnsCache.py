@@ -0,0 +1,169 @@
+# (C) Copyright 2005 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""A host name resolution cache shared by the virtual users of a process.
+
+The addresses of a host are kept for a ttl. An expired entry is still used
+while a background thread resolves the host again, so only the first
+connection to a host waits for the resolver. The addresses of a host are
+rotated at each use to spread the connections over the A records like a
+round robin dns.
+
+A ttl of 0 disables the cache of the resolved hosts. Hosts can be mapped
+to static addresses with the [dns] section of the configuration file:
+
+  [dns]
+  www.example.com = 10.0.0.1 10.0.0.2
+
+$Id$
+"""
+import socket
+import time
+import threading
+
+DNS_TTL = 60
+
+_dns_cache = None
+
+
+def configure_dns_cache(ttl=DNS_TTL, hosts=None):
+    """Set the DnsCache of the process, keep the current one if it has the
+    same ttl and hosts."""
+    global _dns_cache
+    hosts = hosts or {}
+    if (_dns_cache is None or _dns_cache.ttl != ttl or
+        _dns_cache.hosts != hosts):
+        _dns_cache = DnsCache(ttl, hosts)
+    return _dns_cache
+
+
+def get_dns_cache():
+    """Return the DnsCache of the process or None if not configured."""
+    return _dns_cache
+
+
+def getaddrinfo(host, port):
+    """Return the tcp addresses of host:port like socket.getaddrinfo, using
+    the DnsCache if configured."""
+    if _dns_cache is None:
+        return socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    return _dns_cache.getaddrinfo(host, port)
+
+
+class DnsCache:
+    """Resolved and static addresses by host and port."""
+    def __init__(self, ttl=DNS_TTL, hosts=None):
+        self.ttl = ttl
+        self.hosts = hosts or {}
+        # [expires, addresses, next address index] by (host, port)
+        self.entries = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.hits = self.resolutions = 0
+        self.resolve_time = 0.
+
+    def resolve(self, host, port):
+        """Return the addresses of host:port, from the static hosts or the
+        resolver."""
+        static = self.hosts.get(host)
+        start = time.time()
+        if static:
+            addresses = []
+            for address in static:
+                addresses.extend(socket.getaddrinfo(
+                    address, port, 0, socket.SOCK_STREAM))
+        else:
+            addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        self.lock.acquire()
+        try:
+            self.resolutions += 1
+            self.resolve_time += time.time() - start
+        finally:
+            self.lock.release()
+        return addresses
+
+    def getaddrinfo(self, host, port):
+        """Return the addresses of host:port starting with the next one."""
+        key = (host, port)
+        now = time.time()
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                if (entry[0] is not None and entry[0] < now and
+                    key not in self.refreshing):
+                    self.refreshing.add(key)
+                    thread = threading.Thread(target=self.refresh,
+                                              args=(host, port))
+                    thread.setDaemon(1)
+                    thread.start()
+                return self.rotate(entry)
+        finally:
+            self.lock.release()
+        addresses = self.resolve(host, port)
+        if not self.ttl and host not in self.hosts:
+            return addresses
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = [self.expires(host), addresses,
+                                             0]
+            return self.rotate(entry)
+        finally:
+            self.lock.release()
+
+    def expires(self, host):
+        """Return the expiration time of a new entry, None for the static
+        hosts that never expire."""
+        if host in self.hosts:
+            return None
+        return time.time() + self.ttl
+
+    def rotate(self, entry):
+        """Return the addresses of an entry for the next connection.
+
+        NOTE: This method is not thread safe. Thread safety must be
+        handled by the caller."""
+        addresses = entry[1]
+        index = entry[2]
+        entry[2] = (index + 1) % len(addresses)
+        return addresses[index:] + addresses[:index]
+
+    def refresh(self, host, port):
+        """Resolve again an expired entry, on errors it is kept for
+        another ttl."""
+        key = (host, port)
+        try:
+            addresses = self.resolve(host, port)
+        except socket.error:
+            addresses = None
+        self.lock.acquire()
+        try:
+            if addresses:
+                self.entries[key] = [self.expires(host), addresses, 0]
+            else:
+                self.entries[key][0] = self.expires(host)
+            self.refreshing.discard(key)
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """Return the number of hits, resolutions and the resolution
+        time."""
+        return self.hits, self.resolutions, self.resolve_time
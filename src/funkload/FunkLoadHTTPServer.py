@@ -22,6 +22,7 @@ import BaseHTTPServer
 import threading
 import urlparse
 from utils import trace
+from livestats import get_live_stats, render_json, render_prometheus
 
 class FunkLoadHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     """Handles HTTP requests from client in debug bench mode.
@@ -29,6 +30,10 @@ class FunkLoadHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     These are the requests currently supported:
     /cvu?inc=<INTEGER> :: Increments number of CVU by given value.
     /cvu?dec=<INTEGER> :: Decrements number of CVU by given value.
+                          The CVU can not be changed with --workers.
+    /getcvu :: Returns the number of CVU.
+    /stats :: Returns the live stats of the bench as json.
+    /metrics :: Returns the live stats in the Prometheus text format.
     """
     benchrunner = None
     def do_GET(self):
@@ -36,6 +41,11 @@ class FunkLoadHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
         parsed_url = urlparse.urlparse(self.path)
         if parsed_url.path == '/cvu':
+            if benchrunner.number_of_workers:
+                # the virtual users run in the worker processes
+                self.send_error(400, 'The CVU can not be changed with '
+                                '--workers')
+                return
             query_args = parsed_url.query.split('&')
             if len(query_args) > 0:
                 query_parts = query_args[0].split('=')
@@ -51,10 +61,21 @@ class FunkLoadHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                                  (old_num_threads, new_num_threads))
         elif parsed_url.path == '/getcvu':
             self.respond('CVU = %d' % benchrunner.getNumberOfThreads())
+        elif parsed_url.path in ('/stats', '/metrics'):
+            live_stats = get_live_stats()
+            if live_stats is None:
+                self.send_error(404, 'Live stats are not enabled')
+                return
+            snapshot = live_stats.snapshot(benchrunner.getNumberOfThreads())
+            if parsed_url.path == '/stats':
+                self.respond(render_json(snapshot), 'application/json')
+            else:
+                self.respond(render_prometheus(snapshot),
+                             'text/plain; version=0.0.4')
 
-    def respond(self, message):
+    def respond(self, message, content_type='text/html'):
         self.send_response(200)
-        self.send_header('Content-type', 'text/html')
+        self.send_header('Content-type', content_type)
         self.end_headers()
         self.wfile.write(message)
 
@@ -25,6 +25,7 @@ import sys
 import time
 import re
 import logging
+import threading
 from warnings import warn
 from socket import error as SocketError
 from types import DictType, ListType, TupleType
@@ -37,10 +38,16 @@ from urlparse import urljoin
 from ConfigParser import ConfigParser, NoSectionError, NoOptionError
 from contextlib import contextmanager
 from funkload.log import get_results_logger
+from funkload.livestats import get_live_stats
+from funkload.scheduler import think
+from funkload.linkextractor import get_page_cache
+from funkload.DnsCache import configure_dns_cache, DNS_TTL
 
 from webunit.webunittest import WebTestCase, HTTPError
 
 import PatchWebunit
+from PatchWebunit import ConnectionPool
+from HttpCache import HttpCache, HTTP_CACHE_BYTES, HTTP_CACHE_ENTRY_BYTES
 from utils import get_default_logger, mmn_is_bench, mmn_decode, Data
 from utils import recording, thread_sleep, is_html, get_version, trace
 from xmlrpclib import ServerProxy
@@ -51,10 +58,68 @@ RESPONSE_BY_STEP = "Request {step}.{number}: {type} - {url}"
 RESPONSE_BY_DESCRIPTION = "{type} {url}: {description}"
 PAGE = "{type} {url}: {description}"
 TEST = "Test: {name}"
+TLS_HANDSHAKE = "TLS handshake"
+ALL_REQUESTS = "All requests"
+# the phases of a request and their report section
+REQUEST_PHASES = (('dns_lookup', "DNS lookup"),
+                  ('tcp_connect', "TCP connect"),
+                  ('tls_handshake', TLS_HANDSHAKE),
+                  ('ttfb', "Time to first byte"),
+                  ('download', "Download"))
+# metadata logged as record attributes instead of sub elements
+RECORD_TIMINGS = ('tls_handshake', 'start_delay', 'bytes_received',
+                  'dns_lookup', 'tcp_connect', 'ttfb', 'download')
+
+# seconds between two checks of the configuration file modification time
+CONFIG_CHECK_INTERVAL = 1
+# the parsed configuration and resolved settings by (path, section)
+_settings_cache = {}
+_settings_lock = threading.Lock()
+
+
+def get_mtime(path):
+    """Return the modification time of a file or None if it is missing."""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
 
 # ------------------------------------------------------------
 # Classes
 #
+class TestSettings(object):
+    """The read only settings of a test case, resolved once from the
+    configuration file and the options for all the test cases of a
+    process."""
+    __slots__ = ('user_agent', 'ok_codes', 'sleep_time_min',
+                 'sleep_time_max', 'simple_fetch', 'keep_alive',
+                 'close_connections', 'resource_concurrency',
+                 'link_extractor', 'http_cache', 'http_cache_size',
+                 'http_cache_bytes', 'http_cache_entry_bytes',
+                 'returning_users', 'dns_ttl', 'dns_hosts', 'log_to',
+                 'log_path', 'result_path', 'result_format',
+                 'buffered_results', 'results_buffer_size')
+
+    def __init__(self, **kw):
+        for name in self.__slots__:
+            object.__setattr__(self, name, kw[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TestSettings are read only")
+
+
+class SettingsCacheEntry:
+    """A parsed configuration file and its resolved settings."""
+    def __init__(self, config, config_path, mtime, options, settings):
+        self.config = config
+        self.config_path = config_path
+        self.mtime = mtime
+        self.options = options
+        self.settings = settings
+        self.checked = time.time()
+
+
 class FunkLoadTestCase(unittest.TestCase):
     """Unit test with browser and configuration capabilties."""
     # ------------------------------------------------------------
@@ -75,6 +140,7 @@ class FunkLoadTestCase(unittest.TestCase):
         self.suite_name = self.__class__.__name__
         unittest.TestCase.__init__(self, methodName=self.test_name)
         self._response = None
+        self._responses_lock = threading.Lock()
         self._options = options
         self.debug_level = getattr(options, 'debug_level', 0)
         self._funkload_init()
@@ -106,39 +172,65 @@ class FunkLoadTestCase(unittest.TestCase):
             self.__exc_info = sys.exc_info
         
         self._aggregates = []
+        self._live_stats = self.in_bench_mode and get_live_stats() or None
+        # delay between the intended and the actual start of the test
+        self._start_delay = None
 
 
     def _funkload_init(self):
-        """Initialize a funkload test case using a configuration file."""
+        """Initialize a funkload test case using a configuration file.
+
+        The configuration file is parsed and the settings are resolved once
+        for all the test cases of the class with the same options, see
+        _load_settings."""
         # look into configuration file
         config_directory = os.getenv('FL_CONF_PATH', '.')
         config_path = os.path.join(config_directory,
                                    self.__class__.__name__ + '.conf')
         config_path = os.path.abspath(config_path)
-        if not os.path.exists(config_path):
-            config_path = "Missing: "+ config_path
-        config = ConfigParser()
-        config.read(config_path)
-        self._config = config
-        self._config_path = config_path
-        self.default_user_agent = self.conf_get('main', 'user_agent',
-                                                'FunkLoad/%s' % get_version(),
-                                                quiet=True)
         if self.in_bench_mode:
             section = 'bench'
         else:
             section = 'ftest'
-        self.setOkCodes( self.conf_getList(section, 'ok_codes',
-                                           [200, 301, 302, 303, 307],
-                                           quiet=True) )
-        self.sleep_time_min = self.conf_getFloat(section, 'sleep_time_min', 0)
-        self.sleep_time_max = self.conf_getFloat(section, 'sleep_time_max', 0)
-        self._simple_fetch = self.conf_getInt(section, 'simple_fetch', 0, 
-                                              quiet=True)
-        self.log_to = self.conf_get(section, 'log_to', 'console file')
-        self.log_path = self.conf_get(section, 'log_path', 'funkload.log')
-        self.result_path = os.path.abspath(
-            self.conf_get(section, 'result_path', 'funkload.xml'))
+        key = (config_path, section)
+        _settings_lock.acquire()
+        try:
+            entry = _settings_cache.get(key)
+            now = time.time()
+            if entry is not None and entry.options is self._options and (
+                now - entry.checked < CONFIG_CHECK_INTERVAL):
+                pass
+            elif entry is not None and entry.options is self._options and (
+                entry.mtime == get_mtime(config_path)):
+                entry.checked = now
+            else:
+                entry = _settings_cache[key] = self._load_settings(
+                    config_path, section)
+        finally:
+            _settings_lock.release()
+        self._config = entry.config
+        self._config_path = entry.config_path
+        settings = self._settings = entry.settings
+        self.default_user_agent = settings.user_agent
+        self.setOkCodes(settings.ok_codes)
+        self.sleep_time_min = settings.sleep_time_min
+        self.sleep_time_max = settings.sleep_time_max
+        self._simple_fetch = settings.simple_fetch
+        self._keep_alive = settings.keep_alive
+        self._close_connections = settings.close_connections
+        self._resource_concurrency = settings.resource_concurrency
+        self._link_extractor = settings.link_extractor
+        self._http_cache = settings.http_cache
+        self._http_cache_size = settings.http_cache_size
+        self._http_cache_bytes = settings.http_cache_bytes
+        self._http_cache_entry_bytes = settings.http_cache_entry_bytes
+        self._returning_users = settings.returning_users
+        self.log_to = settings.log_to
+        self.log_path = settings.log_path
+        self.result_path = settings.result_path
+        self.result_format = settings.result_format
+        self._buffered_results = settings.buffered_results
+        self._results_buffer_size = settings.results_buffer_size
 
         # init loggers
         if self.in_bench_mode:
@@ -147,7 +239,9 @@ class FunkLoadTestCase(unittest.TestCase):
             level = logging.DEBUG
         self.logger = get_default_logger(self.log_to, self.log_path,
                                          level=level)
-        self.logger_results = get_results_logger(self.result_path)
+        self.logger_results = get_results_logger(
+            self.result_path, self.result_format, self._buffered_results,
+            self._results_buffer_size)
 
         #self.logd('_funkload_init config [%s], log_to [%s],'
         #          ' log_path [%s], result [%s].' % (
@@ -160,6 +254,68 @@ class FunkLoadTestCase(unittest.TestCase):
         #self.logd('# FunkLoadTestCase._funkload_init done')
     
     
+    def _load_settings(self, config_path, section):
+        """Parse the configuration file and resolve the settings of a
+        section, return a SettingsCacheEntry."""
+        mtime = get_mtime(config_path)
+        if mtime is None:
+            config_path = "Missing: "+ config_path
+        config = ConfigParser()
+        config.read(config_path)
+        self._config = config
+        self._config_path = config_path
+        dns_hosts = {}
+        if config.has_section('dns'):
+            for host, addresses in config.items('dns'):
+                dns_hosts[host] = tuple(addresses.split())
+        settings = TestSettings(
+            user_agent=self.conf_get('main', 'user_agent',
+                                     'FunkLoad/%s' % get_version(),
+                                     quiet=True),
+            ok_codes=tuple(map(int, self.conf_getList(
+                section, 'ok_codes', [200, 301, 302, 303, 307],
+                quiet=True))),
+            sleep_time_min=self.conf_getFloat(section, 'sleep_time_min', 0),
+            sleep_time_max=self.conf_getFloat(section, 'sleep_time_max', 0),
+            simple_fetch=self.conf_getInt(section, 'simple_fetch', 0,
+                                          quiet=True),
+            keep_alive=self.conf_getInt(section, 'keep_alive', 1,
+                                        quiet=True),
+            close_connections=self.conf_getInt(section, 'close_connections',
+                                               0, quiet=True),
+            resource_concurrency=self.conf_getInt(
+                section, 'resource_concurrency', 1, quiet=True),
+            link_extractor=self.conf_get(section, 'link_extractor', 'fast',
+                                         quiet=True),
+            http_cache=self.conf_getInt(section, 'http_cache', 0,
+                                        quiet=True),
+            http_cache_size=self.conf_getInt(section, 'http_cache_size',
+                                             1000, quiet=True),
+            http_cache_bytes=self.conf_getInt(
+                section, 'http_cache_bytes', HTTP_CACHE_BYTES, quiet=True),
+            http_cache_entry_bytes=self.conf_getInt(
+                section, 'http_cache_entry_bytes', HTTP_CACHE_ENTRY_BYTES,
+                quiet=True),
+            returning_users=self.conf_getFloat(section, 'returning_users',
+                                               1.0, quiet=True),
+            dns_ttl=self.conf_getFloat(section, 'dns_ttl', DNS_TTL,
+                                       quiet=True),
+            dns_hosts=dns_hosts,
+            log_to=self.conf_get(section, 'log_to', 'console file'),
+            log_path=self.conf_get(section, 'log_path', 'funkload.log'),
+            result_path=os.path.abspath(
+                self.conf_get(section, 'result_path', 'funkload.xml')),
+            result_format=self.conf_get(section, 'result_format', None,
+                                        quiet=True),
+            buffered_results=self.conf_getInt(section, 'buffered_results',
+                                              0, quiet=True),
+            results_buffer_size=self.conf_getInt(
+                section, 'results_buffer_size', 1000, quiet=True))
+        # the host name resolutions are shared by all the test cases
+        configure_dns_cache(settings.dns_ttl, settings.dns_hosts)
+        return SettingsCacheEntry(config, config_path, mtime, self._options,
+                                  settings)
+
     def setOkCodes(self, ok_codes):
         """Set ok codes."""
         self.ok_codes = map(int, ok_codes) 
@@ -171,6 +327,26 @@ class FunkLoadTestCase(unittest.TestCase):
         self._browser.css = {}
         self._browser.history = []
         self._browser.extra_headers = []
+        # the keep alive connections are kept between the tests of the
+        # virtual user unless each test is a new user
+        connections = getattr(self._browser, 'connections', None)
+        if connections is None:
+            connections = self._browser.connections = ConnectionPool()
+        elif self._close_connections or not self._keep_alive:
+            connections.close()
+        connections.clearStats()
+        self._browser.keep_alive = self._keep_alive
+        # a returning user keeps the browser cache of its previous visit
+        http_cache = getattr(self._browser, 'http_cache', None)
+        if not self._http_cache:
+            http_cache = None
+        elif http_cache is None or random() >= self._returning_users:
+            http_cache = HttpCache(self._http_cache_size,
+                                   self._http_cache_bytes,
+                                   self._http_cache_entry_bytes)
+        else:
+            http_cache.clearStats()
+        self._browser.http_cache = http_cache
         if self.debug_level >= 3:
             self._browser.debug_headers = True
         else:
@@ -190,12 +366,22 @@ class FunkLoadTestCase(unittest.TestCase):
 
         self.logdd('FunkLoadTestCase.clearContext done')
 
+    def closeBrowser(self):
+        """Release the resources kept by the browser between the tests,
+        called when the virtual user stops."""
+        self._browser.connections.close()
+        fetch_pool = getattr(self._browser, 'fetch_pool', None)
+        if fetch_pool is not None:
+            fetch_pool.close()
+            self._browser.fetch_pool = None
+
 
 
     #------------------------------------------------------------
     # browser simulation
     #
-    def _connect(self, url, params, ok_codes, rtype, description, redirect=False):
+    def _connect(self, url, params, ok_codes, rtype, description, redirect=False,
+                 discard_body=False):
         """Handle fetching, logging, errors and history."""
         if params is None and rtype in ('post','put'):
             # enable empty put/post
@@ -205,9 +391,11 @@ class FunkLoadTestCase(unittest.TestCase):
             try:
                 response = self._browser.fetch(url, params, ok_codes=ok_codes,
                                                key_file=self._keyfile_path,
-                                               cert_file=self._certfile_path, method=rtype)
+                                               cert_file=self._certfile_path, method=rtype,
+                                               discard_body=discard_body)
                 metadata['test_status'] = 'Success'
                 metadata['response_code'] = response.code
+                self._log_connection(metadata, response)
 
                 if rtype in ('put', 'post', 'get', 'delete'):
                     # this is a valid referer for the next request
@@ -222,12 +410,28 @@ class FunkLoadTestCase(unittest.TestCase):
                     self._dump_content(exc.response)
                 raise
 
+    def _log_connection(self, metadata, response):
+        """Log how the response connection was established."""
+        metadata['connection'] = (response.connection_reused and
+                                  'reused' or 'new')
+        for name, section in REQUEST_PHASES:
+            value = getattr(response, name, None)
+            if value is not None:
+                metadata[name] = value
+        if getattr(response, 'bytes_received', None) is not None:
+            metadata['bytes_received'] = response.bytes_received
+        if getattr(response, 'checksum', None) is not None:
+            metadata['checksum'] = response.checksum
+
     def _browse(self, url_in, params_in=None,
                 description=None, ok_codes=None,
                 method='post',
                 follow_redirect=True, load_auto_links=True,
-                sleep=True):
-        """Simulate a browser handle redirects, load/cache css and images."""
+                sleep=True, discard_body=False):
+        """Simulate a browser handle redirects, load/cache css and images.
+
+        With discard_body the body of the response is not kept, only the
+        status, the size and the md5 checksum of the body are available."""
         self._response = None
         # Loop mode
         if self._loop_mode:
@@ -237,7 +441,8 @@ class FunkLoadTestCase(unittest.TestCase):
             if self._loop_recording:
                 self._loop_records.append((url_in, params_in, description,
                                            ok_codes, method, follow_redirect,
-                                           load_auto_links, False))
+                                           load_auto_links, False,
+                                           discard_body))
         # ok codes
         if ok_codes is None:
             ok_codes = self.ok_codes
@@ -276,40 +481,46 @@ class FunkLoadTestCase(unittest.TestCase):
                 self.logd('%s: %s %s\n\tPage %i: %s ...' % (
                         method.upper(), url, str(params),
                         self.steps, description or ''))
-            # Fetching
-        response = self._connect(url, params, ok_codes, method, description)
-
-        # Check redirection
-        if follow_redirect and response.code in (301, 302, 303, 307):
-            max_redirect_count = 10
-            thread_sleep()              # give a chance to other threads
-            while response.code in (301, 302, 303, 307) and max_redirect_count:
-                # Figure the location - which may be relative
-                newurl = response.headers['Location']
-                url = urljoin(url_in, newurl)
-                # Save the current url as the base for future redirects
-                url_in = url
-                self.logd(' Load redirect link: %s' % url)
-                # Use the appropriate method for redirection
-                if response.code in (302, 303):
-                    method = 'get'
-                if response.code == 303:
-                    # 303 is HTTP/1.1, make sure the connection 
-                    # is not in keep alive mode
-                    self.setHeader('Connection', 'close')
-                response = self._connect(url, None, ok_codes, rtype=method,
-                                         description=None, redirect=True)
-                max_redirect_count -= 1
-            if not max_redirect_count:
-                self.logd(' WARNING Too many redirects give up.')
-
-        # Load auto links (css and images)
-        response.is_html = is_html(response.body)
-        if load_auto_links and response.is_html and not self._simple_fetch:
-            self.logd(' Load css and images...')
-            page = response.body
-            # pageImages is patched to call self.record on all links
-            self._browser.pageImages(url, page, self)
+        # Fetching, the page record times the page with its redirects and
+        # auto links
+        with self.record({'Page': PAGE.format(type=method, url=url,
+                                              description=description)},
+                         url=url, rtype=method, description=description):
+            response = self._connect(url, params, ok_codes, method, description,
+                                     discard_body=discard_body)
+
+            # Check redirection
+            if follow_redirect and response.code in (301, 302, 303, 307):
+                max_redirect_count = 10
+                thread_sleep()              # give a chance to other threads
+                while response.code in (301, 302, 303, 307) and max_redirect_count:
+                    # Figure the location - which may be relative
+                    newurl = response.headers['Location']
+                    url = urljoin(url_in, newurl)
+                    # Save the current url as the base for future redirects
+                    url_in = url
+                    self.logd(' Load redirect link: %s' % url)
+                    # Use the appropriate method for redirection
+                    if response.code in (302, 303):
+                        method = 'get'
+                    if response.code == 303:
+                        # 303 is HTTP/1.1, make sure the connection 
+                        # is not in keep alive mode
+                        self.setHeader('Connection', 'close')
+                    response = self._connect(url, None, ok_codes, rtype=method,
+                                             description=None, redirect=True,
+                                             discard_body=discard_body)
+                    max_redirect_count -= 1
+                if not max_redirect_count:
+                    self.logd(' WARNING Too many redirects give up.')
+
+            # Load auto links (css and images)
+            response.is_html = is_html(response.body)
+            if load_auto_links and response.is_html and not self._simple_fetch:
+                self.logd(' Load css and images...')
+                page = response.body
+                # pageImages is patched to call self.record on all links
+                self._browser.pageImages(url, page, self)
         if sleep:
             self.sleep()
         self._response = response
@@ -337,37 +548,42 @@ class FunkLoadTestCase(unittest.TestCase):
 
         return response
 
-    def post(self, url, params=None, description=None, ok_codes=None, load_auto_links=True):
+    def post(self, url, params=None, description=None, ok_codes=None, load_auto_links=True,
+             discard_body=False):
         """POST method on url with params."""
         self.steps += 1
         self.page_responses = 0
         response = self._browse(url, params, description, ok_codes,
-                                method="post", load_auto_links=load_auto_links)
+                                method="post", load_auto_links=load_auto_links,
+                                discard_body=discard_body)
         return response
 
-    def get(self, url, params=None, description=None, ok_codes=None, load_auto_links=True):
+    def get(self, url, params=None, description=None, ok_codes=None, load_auto_links=True,
+            discard_body=False):
         """GET method on url adding params."""
         self.steps += 1
         self.page_responses = 0
         response = self._browse(url, params, description, ok_codes,
-                                method="get", load_auto_links=load_auto_links)
+                                method="get", load_auto_links=load_auto_links,
+                                discard_body=discard_body)
         return response
 
     def method(self, method, url, params=None, description=None,
-               ok_codes=None, load_auto_links=True):
+               ok_codes=None, load_auto_links=True, discard_body=False):
         """Generic method request can be used to submit MOVE, MKCOL or
         whatever method name request."""
         self.steps += 1
         self.page_responses = 0
         response = self._browse(url, params, description, ok_codes,
-                                method=method, load_auto_links=load_auto_links)
+                                method=method, load_auto_links=load_auto_links,
+                                discard_body=discard_body)
         return response
 
     def put(self, url, params=None, description=None, ok_codes=None,
-            load_auto_links=True):
+            load_auto_links=True, discard_body=False):
         """PUT method."""
         return self.method('put', url, params, description, ok_codes, 
-                load_auto_links=load_auto_links)
+                load_auto_links=load_auto_links, discard_body=discard_body)
 
     def delete(self, url, description=None, ok_codes=None):
         """DELETE method on url."""
@@ -520,7 +736,7 @@ class FunkLoadTestCase(unittest.TestCase):
         else:
             s_val = s_min
         # we should always sleep something
-        thread_sleep(s_val)
+        think(s_val)
 
     def setKeyAndCertificateFile(self, keyfile_path, certfile_path):
         """Set the paths to a key file and a certificate file that will be
@@ -565,14 +781,9 @@ class FunkLoadTestCase(unittest.TestCase):
         Filtering href with url pattern or link text pattern."""
         response = self._response
         ret = []
-        if response is not None:
-            a_links = response.getDOM().getByName('a')
-            if a_links:
-                for link in a_links:
-                    try:
-                        ret.append((link.getContentString(), link.href))
-                    except AttributeError:
-                        pass
+        if response is not None and response.body is not None:
+            ret = get_page_cache().get(response.url, response.body, 'hrefs',
+                                       lambda: self._extractHref(response))
             if url_pattern is not None:
                 pat = re.compile(url_pattern)
                 ret = [link for link in ret
@@ -583,13 +794,31 @@ class FunkLoadTestCase(unittest.TestCase):
                        if link[0] and (pat.search(link[0]) is not None)]
         return [link[1] for link in ret]
 
+    def _extractHref(self, response):
+        """Return the (content, href) of the anchors of a response."""
+        ret = []
+        a_links = response.getDOM().getByName('a')
+        if a_links:
+            for link in a_links:
+                try:
+                    ret.append((link.getContentString(), link.href))
+                except AttributeError:
+                    pass
+        return tuple(ret)
+
     def getLastBaseUrl(self):
         """Return the base href url."""
         response = self._response
-        if response is not None:
-            base = response.getDOM().getByName('base')
-            if base:
-                return base[0].href
+        if response is not None and response.body is not None:
+            return get_page_cache().get(response.url, response.body, 'base',
+                                        lambda: self._extractBaseUrl(response))
+        return ''
+
+    def _extractBaseUrl(self, response):
+        """Return the base href url of a response."""
+        base = response.getDOM().getByName('base')
+        if base:
+            return base[0].href
         return ''
 
 
@@ -731,7 +960,13 @@ class FunkLoadTestCase(unittest.TestCase):
             Any additional named attributes to be stored on the logged record
         """
         step = self.steps
-        number = self.page_responses
+        # the resources of a page are recorded by parallel fetches
+        self._responses_lock.acquire()
+        try:
+            number = self.page_responses
+            self.page_responses += 1
+        finally:
+            self._responses_lock.release()
         with self.record({'Response by step': RESPONSE_BY_STEP.format(
                               step=step, number=number, type=rtype, url=url),
                           'Response by description': RESPONSE_BY_DESCRIPTION.format(
@@ -739,10 +974,14 @@ class FunkLoadTestCase(unittest.TestCase):
                           url=url, rtype=rtype, description=description,
                            **attrs) as metadata:
             try:
-                self.page_responses += 1
                 yield metadata
             except HTTPError as exc:
-                metadata['body'] = exc.response.body
+                response = exc.response
+                # a discarded body is logged by its size and checksum
+                metadata['body'] = response.body or ''
+                for name in ('bytes_received', 'checksum'):
+                    if getattr(response, name, None) is not None:
+                        metadata[name] = getattr(response, name)
                 metadata['headers'] = "\n".join(": ".join(header) for header in exc.response.headers.items())
                 metadata['result'] = 'Failure'
                 metadata['response_code'] = exc.response.code
@@ -805,9 +1044,19 @@ class FunkLoadTestCase(unittest.TestCase):
         finally:
             if self.in_bench_mode and not recording():
                 info['startup'] = True
+            duration = time.time() - start_time
             info['time'] = str(start_time)
-            info['duration'] = str(time.time() - start_time)
+            info['duration'] = str(duration)
+            for key in RECORD_TIMINGS:
+                if key in metadata:
+                    info[key] = str(metadata.pop(key))
+            if self._start_delay is not None:
+                info['start_delay'] = str(self._start_delay)
             self.logger_results.record(info, metadata, aggregates)
+            if self._live_stats is not None:
+                self._live_stats.record(aggregates, start_time + duration,
+                                        duration,
+                                        metadata['result'] != 'Successful')
 
     def _dump_content(self, response):
         """Dump the html content in a file.
@@ -860,22 +1109,35 @@ class FunkLoadTestCase(unittest.TestCase):
         try:
             with self.record({'Test': methodName}) as metadata:
                 ok = False
-                if not self.in_bench_mode:
-                    self.logd('Starting -----------------------------------\n\t%s'
-                              % self.conf_get(self.meta_method_name, 'description', ''))
-                self.setUp()
                 try:
-                    testMethod()
-                    ok = True
-                except self.failureException:
-                    result.addFailure(self, self.__exc_info())
-                    metadata['result'] = 'Failure'
-                    ok = False
-
-                self.tearDown()
-
-                if ok:
-                    result.addSuccess(self)
+                    if not self.in_bench_mode:
+                        self.logd('Starting -----------------------------------\n\t%s'
+                                  % self.conf_get(self.meta_method_name, 'description', ''))
+                    self.setUp()
+                    try:
+                        testMethod()
+                        ok = True
+                    except self.failureException:
+                        result.addFailure(self, self.__exc_info())
+                        metadata['result'] = 'Failure'
+                        ok = False
+
+                    self.tearDown()
+
+                    if ok:
+                        result.addSuccess(self)
+                finally:
+                    # keep alive connection pool stats of the test
+                    connections = self._browser.connections
+                    metadata['connections_new'] = connections.new_connections
+                    metadata['connections_reused'] = \
+                        connections.reused_connections
+                    http_cache = self._browser.http_cache
+                    if http_cache is not None:
+                        metadata['cache_hits'] = http_cache.hits
+                        metadata['cache_revalidations'] = \
+                            http_cache.revalidations
+                        metadata['cache_misses'] = http_cache.misses
         except KeyboardInterrupt:
             raise
         except:
@@ -885,6 +1147,9 @@ class FunkLoadTestCase(unittest.TestCase):
                 traceback.format_exception(*sys.exc_info()))
 
         finally:
+            if not self.in_bench_mode:
+                # the bench runner closes it when the virtual user stops
+                self.closeBrowser()
             if not ok and self._stop_on_fail:
                 result.stop()
             result.stopTest(self)
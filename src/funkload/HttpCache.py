@@ -0,0 +1,209 @@
+# (C) Copyright 2005 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""A browser cache for the static resources of a virtual user.
+
+The cache follows the rules of a private cache (rfc 2616 section 13):
+Cache-Control max-age, no-cache and no-store, Expires, and a heuristic
+freshness of 10% of the Last-Modified age. Stale entries with an ETag or a
+Last-Modified validator are revalidated with a conditional request.
+
+The cache is bounded by a number of entries and by the total size of the
+cached bodies, a body larger than the entry limit is not cached.
+
+$Id$
+"""
+import time
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_tz, mktime_tz
+
+# lookup states
+FRESH = 'fresh'
+STALE = 'stale'
+
+# default limits of the cached bodies sizes of a virtual user
+HTTP_CACHE_BYTES = 8 * 1024 * 1024
+HTTP_CACHE_ENTRY_BYTES = 1024 * 1024
+
+
+def parse_http_date(value):
+    """Return the timestamp of an http date or None."""
+    if not value:
+        return None
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    try:
+        return mktime_tz(date)
+    except (OverflowError, ValueError):
+        return None
+
+
+def parse_cache_control(value):
+    """Return the Cache-Control directives as a dict."""
+    directives = {}
+    if not value:
+        return directives
+    for directive in value.split(','):
+        directive = directive.strip().lower()
+        if not directive:
+            continue
+        if '=' in directive:
+            name, arg = directive.split('=', 1)
+            directives[name.strip()] = arg.strip().strip('"')
+        else:
+            directives[directive] = None
+    return directives
+
+
+class CacheEntry:
+    """A cached response with its freshness and validators."""
+    def __init__(self, response, request_time):
+        self.response = response
+        self.bytes = len(getattr(response, 'body', None) or '')
+        self.etag = None
+        self.last_modified = None
+        self.expires = request_time
+        self.update(response.headers, request_time)
+
+    def update(self, headers, request_time):
+        """Compute the freshness from the response headers."""
+        self.etag = headers.get('etag') or self.etag
+        self.last_modified = headers.get('last-modified') or \
+            self.last_modified
+        directives = parse_cache_control(headers.get('cache-control'))
+        self.must_revalidate = 'no-cache' in directives
+        date = parse_http_date(headers.get('date')) or request_time
+        lifetime = None
+        if 'max-age' in directives:
+            try:
+                lifetime = int(directives['max-age'])
+            except ValueError:
+                lifetime = 0
+        elif headers.get('expires') is not None:
+            expires = parse_http_date(headers.get('expires'))
+            # an invalid Expires means already expired
+            lifetime = expires is not None and expires - date or 0
+        else:
+            last_modified = parse_http_date(self.last_modified)
+            if last_modified is not None and last_modified < date:
+                lifetime = (date - last_modified) / 10.
+        self.expires = request_time + max(lifetime or 0, 0)
+
+    def is_fresh(self, now):
+        return not self.must_revalidate and now < self.expires
+
+    def validators(self):
+        """Return the headers of a conditional request."""
+        headers = []
+        if self.etag:
+            headers.append(('If-None-Match', self.etag))
+        if self.last_modified:
+            headers.append(('If-Modified-Since', self.last_modified))
+        return headers
+
+
+class HttpCache:
+    """A LRU cache of GET responses, bounded to size entries and
+    max_bytes of bodies, larger bodies than max_entry_bytes are not cached.
+
+    The cache can be shared by the threads fetching the resources of a
+    page."""
+    def __init__(self, size=1000, max_bytes=HTTP_CACHE_BYTES,
+                 max_entry_bytes=HTTP_CACHE_ENTRY_BYTES):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.clearStats()
+
+    def clearStats(self):
+        """Reset the hit counters."""
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, url, now=None):
+        """Return a (state, entry) tuple, state is FRESH if the entry can be
+        used without a request, STALE if it must be revalidated, None if
+        there is no entry."""
+        if now is None:
+            now = time.time()
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(url, None)
+            if entry is None:
+                self.misses += 1
+                return None, None
+            # most recently used last
+            self.entries[url] = entry
+            if entry.is_fresh(now):
+                self.hits += 1
+                return FRESH, entry
+            if not entry.validators():
+                # nothing to revalidate
+                del self.entries[url]
+                self.bytes -= entry.bytes
+                self.misses += 1
+                return None, None
+            return STALE, entry
+        finally:
+            self.lock.release()
+
+    def store(self, url, response, request_time):
+        """Cache a 200 response if allowed."""
+        if response.code != 200:
+            return
+        headers = response.headers
+        if 'no-store' in parse_cache_control(headers.get('cache-control')):
+            return
+        if headers.get('vary', '').strip() == '*':
+            return
+        entry = CacheEntry(response, request_time)
+        if entry.bytes > self.max_entry_bytes or (
+            not entry.validators() and not entry.is_fresh(request_time)):
+            # too large or useless entry
+            entry = None
+        self.lock.acquire()
+        try:
+            previous = self.entries.pop(url, None)
+            if previous is not None:
+                self.bytes -= previous.bytes
+            if entry is None:
+                return
+            self.entries[url] = entry
+            self.bytes += entry.bytes
+            while (len(self.entries) > self.size or
+                   self.bytes > self.max_bytes):
+                self.bytes -= self.entries.popitem(last=False)[1].bytes
+        finally:
+            self.lock.release()
+
+    def refresh(self, entry, headers, request_time):
+        """Refresh an entry after a 304 Not Modified response."""
+        self.lock.acquire()
+        try:
+            self.revalidations += 1
+            entry.update(headers, request_time)
+        finally:
+            self.lock.release()
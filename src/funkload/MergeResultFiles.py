@@ -21,7 +21,11 @@ import xml.parsers.expat
 from xml.etree.ElementTree import Element, tostring
 from utils import trace
 from xml.sax.saxutils import quoteattr, escape
+import os
 import json
+from tempfile import NamedTemporaryFile
+from binlog import is_binary_file, read_results, binary_to_xml
+from binlog import FUNKLOAD, CONFIG
 
 class EndOfConfig(Exception):
     pass
@@ -44,6 +48,8 @@ class FunkLoadConfigXmlParser:
     def parse(self, xml_file):
         """Do the parsing."""
         self.current_file = xml_file
+        if is_binary_file(xml_file):
+            return self.parseBinary(xml_file)
         parser = xml.parsers.expat.ParserCreate()
         parser.StartElementHandler = self.handleStartElement
         try:
@@ -69,6 +75,21 @@ class FunkLoadConfigXmlParser:
         except EndOfConfig:
             return
 
+    def parseBinary(self, binary_file):
+        """Parse the config part of a binary results file."""
+        try:
+            for event in read_results(binary_file):
+                if event[0] == FUNKLOAD:
+                    self.handleStartElement('funkload', {'version': event[1],
+                                                         'time': event[2]})
+                elif event[0] == CONFIG:
+                    self.handleStartElement('config', {'key': event[1],
+                                                       'value': event[2]})
+                else:
+                    self.handleStartElement('record', {})
+        except EndOfConfig:
+            return
+
     def handleStartElement(self, name, attrs):
         """Called by expat parser on start element."""
         if name == 'funkload':
@@ -101,6 +122,10 @@ class FunkLoadConfigXmlParser:
             raise EndOfConfig
 
 class FunkLoadContentMergeParser:
+    """Copy the records of a result file into an output file.
+
+    The thread_id is prefixed by the node_id unless node_id is None and
+    the cvus are multiplied by the node_count."""
     def __init__(self, output, node_count):
         self.output = output
         self.skipped_elements = ('config', 'funkload')
@@ -120,7 +145,7 @@ class FunkLoadContentMergeParser:
         if name in self.skipped_elements:
             return
 
-        if 'thread_id' in attrs:
+        if self.node_id is not None and 'thread_id' in attrs:
             attrs['thread_id'] = "{node}-{thread}".format(
                 node = self.node_id,
                 thread = attrs['thread_id']
@@ -155,7 +180,12 @@ def replace_all(text, dic):
 
 
 class MergeResultFiles:
-    def __init__(self, input_files, output_file):
+    """Merge the results files of the nodes of a distributed bench.
+
+    The config of the nodes is read on init, the merged config is in the
+    config attribute and the files to merge in the files attribute. The
+    merged results file is written only if an output_file is given."""
+    def __init__(self, input_files, output_file=None):
         xml_parser = FunkLoadConfigXmlParser()
         for input_file in input_files:
             trace (".")
@@ -181,19 +211,35 @@ class MergeResultFiles:
         config = xml_parser.config.copy()
         config['cycles'] = json.dumps(cycles)
 
+        self.files = xml_parser.files
+        self.node_count = node_count
+        self.config = config
+        self.fl_version = xml_parser.fl_version
+        self.fl_time = xml_parser.fl_time
+        if output_file is not None:
+            self.write(output_file)
+
+    def write(self, output_file):
+        """Write the merged xml results file."""
         with open(output_file, 'w+') as output:
             output.write('<funkload version="{version}" time="{time}">\n'.format(
-                version=xml_parser.fl_version,
-                time=xml_parser.fl_time
+                version=self.fl_version,
+                time=self.fl_time
             ))
-            for key, value in config.iteritems():
+            for key, value in self.config.iteritems():
                 output.write(tostring(Element('config', key=key, value=value)))
                 output.write('\n')
 
-            mergeParser = FunkLoadContentMergeParser(output, node_count)
-            for i, input_file in enumerate(xml_parser.files):
-                mergeParser.parse(input_file, i)
+            mergeParser = FunkLoadContentMergeParser(output, self.node_count)
+            for i, input_file in enumerate(self.files):
+                if is_binary_file(input_file):
+                    # the merge works on xml files
+                    f = NamedTemporaryFile(prefix='fl-bin-', suffix='.xml',
+                                           delete=False)
+                    f.close()
+                    binary_to_xml(input_file, f.name)
+                    mergeParser.parse(f.name, i)
+                    os.remove(f.name)
+                else:
+                    mergeParser.parse(input_file, i)
             output.write("</funkload>\n")
-
-
-
@@ -29,16 +29,35 @@
 * patching to have application/x-www-form-urlencoded by default and only
   multipart when a file is posted
 * patch fetch postdata must be [(key, value) ...] no more dict or list value
+* patch fetch to use HTTP/1.1 keep alive connections of a per virtual user
+  pool
+* fetch css and images once the page is parsed, with an optional per host
+  concurrency and browser cache
+* patch fetch to share an SSL context per key and certificate files and to
+  time the TLS handshake
+* patch fetch to time the dns lookup, the tcp connect, the time to first
+  byte and the download of the body
 
 $Id: PatchWebunit.py 24649 2005-08-29 14:20:19Z bdelbosc $
 """
 import os
 import sys
+import time
+import socket
+import threading
 import urlparse
 from urllib import urlencode
 import httplib
 import cStringIO
+from collections import deque
+from Queue import Queue
+from hashlib import md5
 from mimetypes import guess_type
+from socket import error as SocketError
+try:
+    import ssl
+except ImportError:
+    ssl = None
 
 from webunit import cookie
 from webunit.IMGSucker import IMGSucker
@@ -48,11 +67,20 @@ from webunit.utility import Upload
 from webunit.cookie import Cookie, Error
 
 from utils import thread_sleep, Data
+from HttpCache import FRESH, STALE
+from linkextractor import extract_resources, get_page_cache
+from DnsCache import getaddrinfo
 import re
 
 valid_url = re.compile(r'^(http|https)://[a-z0-9\.\-\:]+(\/[^\ \t\<\>]*)?$',
                        re.I)
 
+# size of the reads of a discarded body
+BODY_CHUNK_SIZE = 65536
+
+# the requests that can be sent again on a new connection
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE', 'DELETE')
+
 BOUNDARY = '--------------GHSKFJDLGDS7543FJKLFHRE75642756743254'
 SEP_BOUNDARY = '--' + BOUNDARY
 END_BOUNDARY = SEP_BOUNDARY + '--'
@@ -95,11 +123,174 @@ def mimeEncode(data, sep_boundary=SEP_BOUNDARY, end_boundary=END_BOUNDARY):
     return ret.getvalue()
 
 
+class ConnectionPool:
+    """Idle keep alive connections of a virtual user.
+
+    Connections are kept by (protocol, host, port, ...) key, a connection
+    is removed from the pool while it is in use."""
+    def __init__(self):
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.new_connections = 0
+        self.reused_connections = 0
+
+    def get(self, key, factory):
+        """Return a (connection, reused) tuple, use factory to create a
+        new connection if there is no idle one."""
+        self.lock.acquire()
+        try:
+            connections = self.idle.get(key)
+            if connections:
+                self.reused_connections += 1
+                return connections.pop(), True
+            self.new_connections += 1
+        finally:
+            self.lock.release()
+        return factory(), False
+
+    def new(self, factory):
+        """Return a new connection created by factory."""
+        self.lock.acquire()
+        try:
+            self.new_connections += 1
+        finally:
+            self.lock.release()
+        return factory()
+
+    def put(self, key, connection):
+        """Release a connection that can be reused."""
+        self.lock.acquire()
+        try:
+            self.idle.setdefault(key, []).append(connection)
+        finally:
+            self.lock.release()
+
+    def clearStats(self):
+        """Reset the connection counters."""
+        self.lock.acquire()
+        try:
+            self.new_connections = 0
+            self.reused_connections = 0
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """Close all the idle connections."""
+        self.lock.acquire()
+        try:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+        finally:
+            self.lock.release()
+
+
+_ssl_contexts = {}
+_ssl_contexts_lock = threading.Lock()
+
+def get_ssl_context(key_file=None, cert_file=None):
+    """Return the SSL context shared by all the https connections using
+    the same client key and certificate files.
+
+    The files are read once per process, return None if the python ssl
+    module does not support contexts."""
+    if ssl is None or not hasattr(ssl, 'SSLContext'):
+        return None
+    key = (key_file, cert_file)
+    _ssl_contexts_lock.acquire()
+    try:
+        context = _ssl_contexts.get(key)
+        if context is None:
+            context = ssl._create_default_https_context()
+            if cert_file:
+                context.load_cert_chain(cert_file, key_file)
+            _ssl_contexts[key] = context
+    finally:
+        _ssl_contexts_lock.release()
+    return context
+
+
+def timed_connect(connection):
+    """Connect like httplib.HTTPConnection.connect, keep the durations of
+    the name resolution and of the tcp connect in the dns_lookup and
+    tcp_connect attributes of the connection."""
+    start = time.time()
+    addresses = getaddrinfo(connection.host, connection.port)
+    connection.dns_lookup = time.time() - start
+    start = time.time()
+    error = None
+    for family, socktype, proto, canonname, address in addresses:
+        sock = None
+        try:
+            sock = socket.socket(family, socktype, proto)
+            if connection.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(connection.timeout)
+            if connection.source_address:
+                sock.bind(connection.source_address)
+            sock.connect(address)
+            break
+        except SocketError, error:
+            if sock is not None:
+                sock.close()
+            sock = None
+    if sock is None:
+        raise error or SocketError("getaddrinfo returns an empty list")
+    connection.tcp_connect = time.time() - start
+    connection.sock = sock
+    if connection._tunnel_host:
+        connection._tunnel()
+
+
+class FLHTTPConnection(httplib.HTTPConnection):
+    """HTTP connection that keeps the duration of its dns lookup and tcp
+    connect."""
+    dns_lookup = tcp_connect = None
+
+    def connect(self):
+        timed_connect(self)
+
+
+class FLHTTPSConnection(httplib.HTTPSConnection):
+    """HTTPS connection that keeps the duration of its dns lookup, tcp
+    connect and TLS handshake."""
+    dns_lookup = tcp_connect = tls_handshake = None
+
+    def __init__(self, host, port=None, key_file=None, cert_file=None):
+        context = get_ssl_context(key_file, cert_file)
+        if context is None:
+            httplib.HTTPSConnection.__init__(self, host, port, key_file,
+                                             cert_file)
+        else:
+            httplib.HTTPSConnection.__init__(self, host, port,
+                                             context=context)
+
+    def connect(self):
+        """Connect then wrap the socket, timing the TLS handshake."""
+        if getattr(self, '_context', None) is None:
+            start = time.time()
+            httplib.HTTPSConnection.connect(self)
+            self.tls_handshake = time.time() - start
+            return
+        timed_connect(self)
+        start = time.time()
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=self._tunnel_host or self.host)
+        self.tls_handshake = time.time() - start
+
+
 class FKLIMGSucker(IMGSucker):
-    """Image and links loader, patched to log response stats."""
+    """Image and links loader, patched to collect the resources to fetch
+    once the page is parsed."""
     def __init__(self, url, session, ftestcase=None):
         IMGSucker.__init__(self, url, session)
         self.ftestcase = ftestcase
+        self.resources = []
+
+    def add_resource(self, rtype, url, cache):
+        """Add a resource to fetch if it is not already in the cache."""
+        if not cache.has_key(url) and (rtype, url) not in self.resources:
+            self.resources.append((rtype, url))
 
     def do_img(self, attributes):
         """Process img tag."""
@@ -113,19 +304,7 @@ class FKLIMGSucker(IMGSucker):
                     continue
                 # TODO: figure the re-write path
                 # newattributes.append((name, path))
-                if not self.session.images.has_key(url):
-                    self.ftestcase.logdd('    img: %s ...' % url)
-                    with self.ftestcase.record_response('image', url, None):
-                        try:
-                            self.session.images[url] = self.session.fetch(url)
-                            self.session.history.append(('image', url))
-                        except HTTPError as error:
-                            if self.ftestcase._accept_invalid_links:
-                                if not self.ftestcase.in_bench_mode:
-                                    self.ftestcase.logd('  ' + str(error))
-                            else:
-                                raise
-                    thread_sleep()      # give a chance to other threads
+                self.add_resource('image', url, self.session.images)
             else:
                 newattributes.append((name, value))
         # Write the img tag to file (with revised paths)
@@ -143,47 +322,206 @@ class FKLIMGSucker(IMGSucker):
                     continue
                 # TODO: figure the re-write path
                 # newattributes.append((name, path))
-                if not self.session.css.has_key(url):
-                    self.ftestcase.logdd('    link: %s ...' % url)
-                    with self.ftestcase.record_response('link', url, None):
-                        try:
-                            self.session.css[url] = self.session.fetch(url)
-                            self.session.history.append(('link', url))
-                        except HTTPError as error:
-                            if self.ftestcase._accept_invalid_links:
-                                if not self.ftestcase.in_bench_mode:
-                                    self.ftestcase.logd('  ' + str(error))
-                            else:
-                                raise
-                    thread_sleep()      # give a chance to other threads
+                self.add_resource('link', url, self.session.css)
             else:
                 newattributes.append((name, value))
         # Write the link tag to file (with revised paths)
         self.unknown_starttag('link', newattributes)
 
+
+def get_page_resources(url, page):
+    """Return the valid (rtype, url) resources of a page from the page
+    cache."""
+    return get_page_cache().get(url, page, 'resources', lambda: tuple(
+        (rtype, link) for rtype, link in extract_resources(url, page)
+        if valid_url.match(link)))
+
+
+def get_resource_cache(session, rtype):
+    """Return the cache of the session for a type of resource."""
+    if rtype == 'image':
+        return session.images
+    return session.css
+
+
+def fetch_resource(session, ftestcase, rtype, url):
+    """Fetch and record an image, a css link or a script.
+
+    The browser cache of the virtual user, if any, is used first."""
+    cache = get_resource_cache(session, rtype)
+    if rtype == 'image':
+        ftestcase.logdd('    img: %s ...' % url)
+    else:
+        ftestcase.logdd('    %s: %s ...' % (rtype, url))
+    http_cache = getattr(session, 'http_cache', None)
+    state = entry = None
+    if http_cache is not None:
+        state, entry = http_cache.lookup(url)
+        if state == FRESH:
+            # no request like a browser
+            ftestcase.logdd('    from cache: %s' % url)
+            cache[url] = entry.response
+            return
+    with ftestcase.record_response(rtype, url, None) as metadata:
+        try:
+            request_time = time.time()
+            if state == STALE:
+                # conditional request
+                response = session.fetch(
+                    url, ok_codes=list(session.expect_codes) + [304],
+                    headers=entry.validators())
+            else:
+                response = session.fetch(url)
+            ftestcase._log_connection(metadata, response)
+            if state == STALE and response.code == 304:
+                http_cache.refresh(entry, response.headers, request_time)
+                metadata['cache'] = 'revalidated'
+                response = entry.response
+            elif http_cache is not None:
+                http_cache.store(url, response, request_time)
+                metadata['cache'] = 'miss'
+            cache[url] = response
+            session.history.append((rtype, url))
+        except HTTPError as error:
+            if ftestcase._accept_invalid_links:
+                if not ftestcase.in_bench_mode:
+                    ftestcase.logd('  ' + str(error))
+            else:
+                raise
+
+
+class FetchPool:
+    """Worker threads fetching the resources of a virtual user.
+
+    The workers are started on demand and reused for all the pages of the
+    virtual user until the pool is closed."""
+    def __init__(self):
+        self.tasks = Queue()
+        self.workers = []
+
+    def map(self, function, args_list):
+        """Call function with each args of args_list in a worker, return
+        once all the calls are done.
+
+        NOTE: This method is not thread safe. Thread safety must be
+        handled by the caller."""
+        done = Queue()
+        while len(self.workers) < len(args_list):
+            worker = threading.Thread(target=self.work,
+                                      name='resource_fetcher')
+            worker.setDaemon(1)
+            worker.start()
+            self.workers.append(worker)
+        for args in args_list:
+            self.tasks.put((function, args, done))
+        for args in args_list:
+            done.get()
+
+    def work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            function, args, done = task
+            try:
+                function(*args)
+            finally:
+                done.put(None)
+
+    def close(self):
+        """Stop the workers."""
+        for worker in self.workers:
+            self.tasks.put(None)
+        self.workers = []
+
+
+def fetch_resources(session, ftestcase, resources, concurrency=1):
+    """Fetch the (rtype, url) resources of a page.
+
+    Like a browser up to concurrency resources are fetched at the same time
+    from each host, each one using its own keep alive connection. The
+    fetches run in the FetchPool of the session. The first error stops the
+    fetching and is raised once all the running fetches are done."""
+    if concurrency <= 1 or len(resources) <= 1:
+        for rtype, url in resources:
+            fetch_resource(session, ftestcase, rtype, url)
+            thread_sleep()      # give a chance to other threads
+        return
+    queues = {}
+    for rtype, url in resources:
+        host = urlparse.urlparse(url)[:2]
+        queues.setdefault(host, deque()).append((rtype, url))
+    errors = []
+
+    def fetch_queue(queue):
+        while not errors:
+            try:
+                rtype, url = queue.popleft()
+            except IndexError:
+                return
+            try:
+                fetch_resource(session, ftestcase, rtype, url)
+            except:
+                errors.append(sys.exc_info())
+
+    fetch_pool = getattr(session, 'fetch_pool', None)
+    if fetch_pool is None:
+        fetch_pool = session.fetch_pool = FetchPool()
+    fetch_pool.map(fetch_queue, [(queue,) for queue in queues.values()
+                                 for i in range(min(concurrency, len(queue)))])
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+
 # remove webunit logging
 def WTC_log(self, message, content):
     """Remove webunit logging."""
     pass
 WebTestCase.log = WTC_log
 
-# use fl img sucker
+# use the fast link extractor or the fl img sucker
 def WTC_pageImages(self, url, page, testcase=None):
     '''Given the HTML page that was loaded from url, grab all the images.
     '''
-    sucker = FKLIMGSucker(url, self, testcase)
-    sucker.feed(page)
-    sucker.close()
+    if getattr(testcase, '_link_extractor', 'fast') == 'webunit':
+        sucker = FKLIMGSucker(url, self, testcase)
+        sucker.feed(page)
+        sucker.close()
+        resources = sucker.resources
+    else:
+        resources = [(rtype, link)
+                     for rtype, link in get_page_resources(url, page)
+                     if not get_resource_cache(self, rtype).has_key(link)]
+    fetch_resources(self, testcase, resources,
+                    getattr(testcase, '_resource_concurrency', 1))
 
 WebTestCase.pageImages = WTC_pageImages
 
 
 # WebFetcher fetch
+def read_discarded_body(response):
+    """Read the body of a httplib response by chunks without keeping it,
+    return its size and its md5 checksum."""
+    digest = md5()
+    size = 0
+    while True:
+        chunk = response.read(BODY_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    return size, digest.hexdigest()
+
+
 def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
-             ok_codes=None, key_file=None, cert_file=None, method="GET"):
+             ok_codes=None, key_file=None, cert_file=None, method="GET",
+             headers=None, discard_body=False):
     '''Run a single test request to the indicated url. Use the POST data
     if supplied. Accepts key and certificate file paths for https (ssl/tls)
-    connections.
+    connections and a list of (header, value) to add to this request only.
+
+    With discard_body the body is read by chunks and dropped, the response
+    body is None and only its size and md5 checksum are kept.
 
     Raises failureException if the returned data contains any of the
     strings indicated to be Error Content.
@@ -240,9 +578,12 @@ def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
             webproxy = False
 
         if webproxy:
-            h = httplib.HTTPConnection(webproxy['host'], webproxy['port'])
+            key = (protocol, webproxy['host'], webproxy['port'])
+            factory = lambda: FLHTTPConnection(webproxy['host'],
+                                               webproxy['port'])
         else:
-            h = httplib.HTTP(server, int(port))
+            key = (protocol, server, int(port))
+            factory = lambda: FLHTTPConnection(server, int(port))
         if int(port) == 80:
             host_header = server
         else:
@@ -253,8 +594,11 @@ def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
 
         # FL Patch -------------------------
 
-        # patched to use the given key and cert file
-        h = httplib.HTTPS(server, int(port), key_file, cert_file)
+        # patched to use the given key and cert file with a shared ssl
+        # context
+        key = (protocol, server, int(port), key_file, cert_file)
+        factory = lambda: FLHTTPSConnection(server, int(port),
+                                            key_file, cert_file)
 
         # FL Patch end  -------------------------
 
@@ -265,14 +609,15 @@ def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
     else:
         raise ValueError, protocol
 
+    if webproxy:
+        selector = "http://%s%s" % (host_header, url)
+    else:
+        selector = url
+
+    request_headers = headers or []
     headers = []
     params = None
     if postdata is not None:
-        if webproxy:
-            h.putrequest(method.upper(), "http://%s%s" % (host_header, url))
-        else:
-            # Normal post
-            h.putrequest(method.upper(), url)
         if postdata:
             if isinstance(postdata, Data):
                 # User data and content_type
@@ -295,11 +640,6 @@ def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
                     params = urlencode(postdata)
                     headers.append(('Content-type', 'application/x-www-form-urlencoded'))
             headers.append(('Content-length', str(len(params))))
-    else:
-        if webproxy:
-            h.putrequest(method.upper(), "http://%s%s" % (host_header, url))
-        else:
-            h.putrequest(method.upper(), url)
 
     # Other Full Request headers
     if self.authinfo:
@@ -310,8 +650,9 @@ def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
         headers.append(('Host', host_header))
 
     # FL Patch -------------------------
-    for key, value in self.extra_headers:
-        headers.append((key, value))
+    for key_header, value in self.extra_headers:
+        headers.append((key_header, value))
+    headers.extend(request_headers)
 
     # FL Patch end ---------------------
 
@@ -352,51 +693,97 @@ def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
             "Didn't use all cookies (%s expected, %s used)"%(
             self.expect_cookies, cookies_used)
 
-
-    # write and finish the headers
-    for header in headers:
-        h.putheader(*header)
-    h.endheaders()
-
     if self.debug_headers:
         for header in headers:
             print "Putting header -- %s: %s" % header
 
-    if params is not None:
-        h.send(params)
+    # FL Patch -------------------------
 
-    # handle the reply
-    if webproxy:
-        r = h.getresponse()
-        errcode = r.status
-        errmsg = r.reason
-        headers = r.msg
-        if headers is None or headers.has_key('content-length') and headers['content-length'] == "0":
-            data = None
+    # reuse a keep alive connection of the virtual user if any
+    pool = getattr(self, 'connections', None)
+    keep_alive = pool is not None and getattr(self, 'keep_alive', False)
+    for header, value in headers:
+        if header.lower() == 'connection' and value.lower() == 'close':
+            keep_alive = False
+    # a request failing on a reused connection closed by the server is
+    # sent once again on a new connection, unless the server may have
+    # processed it
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+    retried = False
+    while True:
+        if not keep_alive:
+            h, reused = factory(), False
+            # behave like the HTTP/1.0 httplib.HTTP
+            h._http_vsn = 10
+            h._http_vsn_str = 'HTTP/1.0'
+        elif retried:
+            h, reused = pool.new(factory), False
         else:
-            data = r.read()
-        response = HTTPResponse(self.cookies, protocol, server, port, url,
-                                errcode, errmsg, headers, data,
-                                self.error_content)
-
+            h, reused = pool.get(key, factory)
+        sent = False
+        try:
+            if h.sock is None:
+                # connect first so the time to first byte is the request
+                # time alone
+                h.connect()
+            request_start = time.time()
+            # write and finish the headers
+            h.putrequest(method.upper(), selector, skip_host=not webproxy)
+            for header in headers:
+                h.putheader(*header)
+            # the headers and the body in a single write
+            h.endheaders(params)
+            sent = True
+            # handle the reply
+            r = h.getresponse(buffering=True)
+            ttfb = time.time() - request_start
+        except (httplib.BadStatusLine, SocketError):
+            h.close()
+            if reused and (idempotent or not sent):
+                retried = True
+                continue
+            raise
+        break
+
+    errcode = r.status
+    errmsg = r.reason
+    headers = r.msg
+    checksum = None
+    download_start = time.time()
+    if headers is None or headers.has_key('content-length') and headers['content-length'] == "0":
+        data = None
+        bytes_received = 0
+        # nothing to read, make the connection available
+        r.close()
+    elif discard_body:
+        data = None
+        bytes_received, checksum = read_discarded_body(r)
     else:
-        # get the body and save it
-        errcode, errmsg, headers = h.getreply()
-        if headers is None or headers.has_key('content-length') and headers['content-length'] == "0":
-            response = HTTPResponse(self.cookies, protocol, server, port, url,
-                                    errcode, errmsg, headers, None,
-                                    self.error_content)
-        else:
-            f = h.getfile()
-            g = cStringIO.StringIO()
-            d = f.read()
-            while d:
-                g.write(d)
-                d = f.read()
-            response = HTTPResponse(self.cookies, protocol, server, port, url,
-                                    errcode, errmsg, headers, g.getvalue(),
-                                    self.error_content)
-            f.close()
+        data = r.read()
+        bytes_received = len(data)
+    download = time.time() - download_start
+    if keep_alive and not r.will_close:
+        pool.put(key, h)
+    else:
+        h.close()
+    response = HTTPResponse(self.cookies, protocol, server, port, url,
+                            errcode, errmsg, headers, data,
+                            self.error_content)
+    response.connection_reused = reused
+    response.bytes_received = bytes_received
+    response.body_discarded = discard_body
+    response.checksum = checksum
+    response.ttfb = ttfb
+    response.download = download
+    # a reused connection has no lookup, connect nor handshake
+    response.dns_lookup = response.tcp_connect = None
+    response.tls_handshake = None
+    if not reused:
+        response.dns_lookup = getattr(h, 'dns_lookup', None)
+        response.tcp_connect = getattr(h, 'tcp_connect', None)
+        response.tls_handshake = getattr(h, 'tls_handshake', None)
+
+    # FL Patch end ---------------------
 
     if errcode not in ok_codes:
         if VERBOSE:
@@ -415,9 +802,8 @@ def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
                 sys.stdout.flush()
             raise
 
-    # Check errors
-    if self.error_content:
-        data = response.body
+    # Check errors, there is nothing to check in a discarded body
+    if self.error_content and data is not None:
         for content in self.error_content:
             if data.find(content) != -1:
                 msg = "Matched error: %s" % content
@@ -31,7 +31,7 @@ or
   %prog --diff REPORT_PATH1 REPORT_PATH2
 
 %prog analyze a FunkLoad bench xml result file and output a report.
-If there are more than one file the xml results are merged.
+If there are more than one file the results of the nodes are merged.
 
 See http://funkload.nuxeo.org/ for more information.
 
@@ -60,10 +60,11 @@ import os
 import xml.parsers.expat
 import re
 import json
+from time import sleep
 
 from collections import defaultdict
+from multiprocessing import Pool, cpu_count
 from optparse import OptionParser, TitledHelpFormatter
-from tempfile import NamedTemporaryFile
 from shutil import copyfile
 
 from ReportStats import StatsAccumulator, MonitorStat, ErrorStat, CycleBoundaries
@@ -73,14 +74,91 @@ from funkload.reports.diff import DiffReport
 from funkload.reports.trend import TrendReport
 from utils import trace, get_version
 from FunkLoadTestCase import RESPONSE_BY_STEP, RESPONSE_BY_DESCRIPTION, PAGE, TEST
+from FunkLoadTestCase import REQUEST_PHASES, RECORD_TIMINGS, ALL_REQUESTS
+from ReportCache import ResultsCache, has_valid_cache
+from binlog import is_binary_file, read_results
+from binlog import RECORD, CONFIG, FUNKLOAD
 from docutils.core import publish_cmdline
 
 # ------------------------------------------------------------
 # Xml parser
 #
+# a chunk of results starts with one of these top level elements
+CHUNK_START = re.compile(r'\n<(record|testResult|response|monitor|'
+                         r'monitorconfig)[ >]')
+CHUNK_MIN_SIZE = 1 << 20
+CHUNKS_PER_JOB = 4
+READ_BLOCK_SIZE = 1 << 20
+# seconds between two reads of a followed results file
+FOLLOW_INTERVAL = 1
+
+
+def find_chunk_start(xml_file, offset):
+    """Return the offset of the first top level element after offset."""
+    xml_file.seek(offset)
+    data = ''
+    while True:
+        block = xml_file.read(READ_BLOCK_SIZE)
+        if not block:
+            return None
+        # keep the end of the previous block, an element may be cut in two
+        data = data[-32:] + block
+        match = CHUNK_START.search(data)
+        if match is not None:
+            return xml_file.tell() - len(data) + match.start() + 1
+
+
+def split_results_file(xml_file, count):
+    """Return the offset of the first top level element and the (start,
+    end) offsets of count chunks of top level elements.
+
+    Return None if the file is not complete."""
+    size = os.path.getsize(xml_file)
+    with open(xml_file, 'rb') as f:
+        f.seek(max(size - 256, 0))
+        tail = f.read()
+        if '</funkload>' not in tail:
+            return None
+        end = size - len(tail) + tail.rindex('</funkload>')
+        first = find_chunk_start(f, 0)
+        if first is None:
+            return None
+        offsets = [first]
+        step = (end - first) / count
+        for i in range(1, count):
+            offset = find_chunk_start(f, max(first + i * step, offsets[-1]))
+            if offset is None or offset >= end:
+                break
+            if offset > offsets[-1]:
+                offsets.append(offset)
+    return first, zip(offsets, offsets[1:] + [end])
+
+
+def parse_results(args):
+    """Parse a results file or a chunk of a xml results file in a worker
+    process, return the stats of the parser."""
+    (path, chunk, node, config, apdex_t, measure_startup,
+     normalization_rules, sketch_error, use_cache, co_correction) = args
+    xml_parser = FunkLoadXmlParser(apdex_t, measure_startup,
+                                   normalization_rules, sketch_error,
+                                   use_cache, co_correction)
+    for key, value in config.items():
+        xml_parser.addConfig(key, value)
+    xml_parser.node = node
+    if chunk is None:
+        xml_parser.parse(path)
+    else:
+        if use_cache:
+            # the cache of the chunk is returned with the stats
+            xml_parser.cache = ResultsCache()
+        xml_parser.parseChunk(path, *chunk)
+    return xml_parser.getResults()
+
+
 class FunkLoadXmlParser:
     """Parse a funkload xml results."""
-    def __init__(self, apdex_t, measure_startup, normalization_rules=[]):
+    def __init__(self, apdex_t, measure_startup, normalization_rules=[],
+                 sketch_error=None, use_cache=False, co_correction=False):
         """
         Init setup expat handlers.
 
@@ -93,9 +171,27 @@ class FunkLoadXmlParser:
             Each aggregate found is matched in order against all normalization rules,
             first by key_pattern.match(key). If key_pattern.match(key), then value_pattern.sup(format_string, value)
             is used to set the new value, which is then used for all following value strings
+
+        sketch_error:
+            If set the percentiles are computed from quantile sketches with
+            this relative error instead of keeping all the durations in memory
+
+        use_cache:
+            If set the content of a parsed results file is cached next to
+            it and the cache is used instead of parsing the file again, see
+            :py:mod:`funkload.ReportCache`
+
+        co_correction:
+            If set the durations corrected for the coordinated omission are
+            kept to report the corrected percentiles
             """
         self.apdex_t = apdex_t
         self.measure_startup = measure_startup
+        self.sketch_error = sketch_error
+        self.use_cache = use_cache
+        self.co_correction = co_correction
+        # the ResultsCache recording the file being parsed
+        self.cache = None
         parser = xml.parsers.expat.ParserCreate()
         parser.buffer_text = True
         parser.CharacterDataHandler = self.handleCharacterData
@@ -120,17 +216,96 @@ class FunkLoadXmlParser:
                 return defaultdict(const)
 
         def make_accum():
-            return StatsAccumulator(float(self.cycle_duration), apdex_t)
+            return StatsAccumulator(float(self.cycle_duration), apdex_t,
+                                    sketch_error, co_correction)
 
         self.stats = nested_default_dict(make_accum, 3) # cycle stats
         self.monitor = {}                         # monitoring stats
         self.monitorconfig = {}                   # monitoring config
         self.config = {}
+        # (node id, node count) when parsing the file of a node
+        self.node = None
+        # the last cycle seen and the end of the results file
+        self.max_cycle = -1
+        self.finished = False
+
+    def parse(self, xml_file, pool=None, jobs=1):
+        """Do the parsing.
+
+        With a process pool, large xml files are split into chunks parsed
+        by jobs processes."""
+        if self.use_cache:
+            cache = ResultsCache.load(xml_file)
+            if cache is not None:
+                cache.replay(self)
+                return
+            self.cache = ResultsCache()
+        if is_binary_file(xml_file):
+            self.parseBinary(xml_file)
+        elif pool is None or not self.parseParallel(xml_file, pool, jobs):
+            self.parseXml(xml_file)
+        if self.cache is not None:
+            self.cache.save(xml_file)
+            self.cache = None
+
+    def follow(self, path, on_cycle, interval=FOLLOW_INTERVAL):
+        """Parse a results file written by a running bench.
+
+        on_cycle is called with the number of completed cycles when a
+        cycle ends, that is when the records of the next cycle start, and
+        at the end of the file."""
+        completed = [0]
+        def wait():
+            if self.max_cycle > completed[0]:
+                completed[0] = self.max_cycle
+                on_cycle(self.max_cycle)
+            sleep(interval)
+            return True
+        while not os.path.exists(path) or not os.path.getsize(path):
+            sleep(interval)
+        if is_binary_file(path):
+            self.parseBinary(path, wait)
+        else:
+            self.parseXml(path, wait)
+        on_cycle(self.max_cycle + 1)
+
+    def getCyclesResults(self, count):
+        """Return the config and stats of the count first cycles as
+        expected by the BenchReport."""
+        config = self.config.copy()
+        config['cycles'] = json.dumps(json.loads(config['cycles'])[:count])
+        stats = {}
+        for key, values in self.stats.items():
+            for value, cycle_stats in values.items():
+                cycle_stats = dict((cycle, accumulator)
+                                   for cycle, accumulator in cycle_stats.items()
+                                   if cycle < count)
+                if cycle_stats:
+                    stats.setdefault(key, {})[value] = cycle_stats
+        return (config, stats, self.monitor, self.monitorconfig,
+                self.cycle_boundaries)
+
+    def parseGrowingXml(self, xml_file, wait):
+        """Feed the parser with the data appended to a xml results file
+        until its end."""
+        with open(xml_file, 'rb') as f:
+            while not self.finished:
+                data = f.read(READ_BLOCK_SIZE)
+                if data:
+                    self.parser.Parse(data, False)
+                elif wait():
+                    # clear the end of file
+                    f.seek(0, os.SEEK_CUR)
+                else:
+                    break
 
-    def parse(self, xml_file):
-        """Do the parsing."""
+    def parseXml(self, xml_file, wait=None):
+        """Parse a xml results file, see read_results for wait."""
         try:
-            self.parser.ParseFile(file(xml_file))
+            if wait is None:
+                self.parser.ParseFile(file(xml_file))
+            else:
+                self.parseGrowingXml(xml_file, wait)
         except xml.parsers.expat.ExpatError, msg:
             if (self.current_element[-1]['name'] == 'funkload'
                 and str(msg).startswith('no element found')):
@@ -150,15 +325,237 @@ class FunkLoadXmlParser:
                     x['name'] for x in self.current_element]
                 raise
 
+    def parseParallel(self, xml_file, pool, jobs):
+        """Parse the chunks of a xml results file in a process pool.
+
+        Return False if the file is too small or not complete."""
+        split = self.splitFile(xml_file, jobs)
+        if split is None:
+            return False
+        first, chunks = split
+        # the header holds the config needed by the chunk parsers
+        with open(xml_file, 'rb') as f:
+            self.parser.Parse(f.read(first), False)
+        self.parseTasks([self.task(xml_file, chunk) for chunk in chunks],
+                        pool)
+        return True
+
+    def parseNodes(self, merge, pool=None, jobs=1):
+        """Parse the results files of the nodes of a distributed bench.
+
+        merge is a MergeResultFiles, the records are merged on the fly as
+        in its merged results file. With a process pool, the node files
+        and the chunks of the large xml node files are parsed in
+        parallel."""
+        self.config['version'] = merge.fl_version
+        self.config['time'] = merge.fl_time
+        for key, value in merge.config.items():
+            self.addConfig(key, value)
+        tasks = []
+        caches = []
+        for node_id, path in enumerate(merge.files):
+            node = (node_id, merge.node_count)
+            split = None
+            if pool is not None and not is_binary_file(path) and not (
+                self.use_cache and has_valid_cache(path)):
+                split = self.splitFile(path, jobs / len(merge.files) or 1)
+            if split is None:
+                tasks.append(self.task(path, None, node))
+                caches.append(None)
+                continue
+            # the first chunk parses the header of the file
+            chunks = [(0, split[1][0][1])] + split[1][1:]
+            tasks.extend(self.task(path, chunk, node) for chunk in chunks)
+            cache = ResultsCache() if self.use_cache else None
+            caches.extend([cache] * len(chunks))
+        self.parseTasks(tasks, pool, caches)
+        for task, cache in zip(tasks, caches):
+            if cache is not None and task[1][0] == 0:
+                cache.save(task[0])
+
+    def splitFile(self, xml_file, jobs):
+        """Return the split_results_file of a xml file large enough to be
+        parsed by jobs processes or None."""
+        count = min(jobs * CHUNKS_PER_JOB,
+                    os.path.getsize(xml_file) / CHUNK_MIN_SIZE)
+        if count < 2:
+            return None
+        return split_results_file(xml_file, count)
+
+    def task(self, path, chunk=None, node=None):
+        """Return the parse_results arguments for a file or a chunk."""
+        config = self.config.copy()
+        config.pop('version', None)
+        config.pop('time', None)
+        return (path, chunk, node, config, self.apdex_t,
+                self.measure_startup, self.normalization_rules,
+                self.sketch_error, self.use_cache, self.co_correction)
+
+    def parseTasks(self, tasks, pool=None, caches=None):
+        """Run the parse_results tasks and merge their stats.
+
+        The cache of a chunk is added to the cache of its task in caches,
+        by default to the cache of the parser."""
+        if pool is None:
+            results = (parse_results(task) for task in tasks)
+        else:
+            results = pool.imap(parse_results, tasks)
+        for i, stats in enumerate(results):
+            self.mergeResults(stats)
+            cache = self.cache if caches is None else caches[i]
+            if stats[-1] is not None and cache is not None:
+                cache.extend(stats[-1])
+
+    def parseChunk(self, xml_file, start, end):
+        """Parse the top level elements between the start and end offsets
+        of a xml results file, the first chunk of a file includes its
+        header."""
+        parser = self.parser
+        header = start == 0
+        if not header:
+            parser.Parse('<chunk>', False)
+        with open(xml_file, 'rb') as f:
+            f.seek(start)
+            while start < end:
+                data = f.read(min(READ_BLOCK_SIZE, end - start))
+                start += len(data)
+                parser.Parse(data, False)
+        if header:
+            parser.Parse('</funkload>', True)
+        else:
+            parser.Parse('</chunk>', True)
+
+    def getResults(self):
+        """Return the parsed stats as picklable objects."""
+        stats = dict(
+            (key, dict((value, dict(cycle_stats))
+                       for value, cycle_stats in values.items()))
+            for key, values in self.stats.items())
+        return (self.config, stats, self.cycle_boundaries, self.monitor,
+                self.monitorconfig, self.cache)
+
+    def mergeResults(self, results):
+        """Add the stats returned by the getResults of another parser."""
+        config, stats, cycle_boundaries, monitor, monitorconfig = results[:5]
+        for key, value in config.items():
+            self.addConfig(key, value)
+        for key, values in stats.items():
+            for value, cycle_stats in values.items():
+                current = self.stats[key][value]
+                for cycle, accumulator in cycle_stats.items():
+                    if cycle in current:
+                        current[cycle].merge(accumulator)
+                    else:
+                        current[cycle] = accumulator
+        self.cycle_boundaries.merge(cycle_boundaries)
+        for host, host_stats in monitor.items():
+            self.monitor.setdefault(host, []).extend(host_stats)
+        for host, config in monitorconfig.items():
+            self.monitorconfig.setdefault(host, {}).update(config)
+
+    def parseBinary(self, binary_file, wait=None):
+        """Parse a binary results file, see read_results for wait."""
+        for event in read_results(binary_file, wait):
+            if event[0] == RECORD:
+                attributes, subitems, aggregates = event[1:]
+                for name in ('result', 'traceback', 'response_code',
+                             'headers', 'body'):
+                    if name in subitems:
+                        attributes[name] = subitems[name]
+                attributes['aggregates'] = aggregates.items()
+                if self.node is not None:
+                    self.rewriteNodeAttributes(attributes)
+                self.addRecord('record', attributes)
+            elif event[0] == CONFIG:
+                self.addFileConfig(event[1], event[2])
+            elif event[0] == FUNKLOAD:
+                self.addHeader(event[1], event[2])
+
+    def addConfig(self, key, value):
+        self.config[key] = value
+        if key == 'duration':
+            self.cycle_duration = value
+
+    # the content of a results file is added with the following methods,
+    # they are recorded by the cache
+
+    def addHeader(self, version, time):
+        """Add the funkload element of a results file."""
+        if self.cache is not None:
+            self.cache.addHeader(version, time)
+        if self.node is None:
+            self.config['version'] = version
+            self.config['time'] = time
+
+    def addFileConfig(self, key, value):
+        """Add a config element of a results file."""
+        if self.cache is not None:
+            self.cache.addConfig(key, value)
+        if self.node is None:
+            # the file of a node uses the merged config
+            self.addConfig(key, value)
+
+    def addMonitor(self, attrs):
+        if self.cache is not None:
+            self.cache.addMonitor(attrs)
+        stats = self.monitor.setdefault(attrs.get('host'), [])
+        stats.append(MonitorStat(attrs))
+
+    def addMonitorConfig(self, attrs):
+        if self.cache is not None:
+            self.cache.addMonitorConfig(attrs)
+        config = self.monitorconfig.setdefault(attrs.get('host'), {})
+        config[attrs.get('key')] = attrs.get('value')
+
+    def addEntry(self, cycle, time, duration, error, aggregates,
+                 startup=False, timings={}):
+        """Add the stats of a test result.
+
+        aggregates is a list of (key, value) tuples, timings a dict with
+        the RECORD_TIMINGS of the result."""
+        if self.cache is not None:
+            self.cache.addEntry(cycle, time, duration, error, aggregates,
+                                startup, timings)
+        if cycle > self.max_cycle:
+            self.max_cycle = cycle
+        if startup and not self.measure_startup:
+            return
+        start_delay = timings.get('start_delay')
+        for key, value in aggregates:
+            value = self.normalize_entry(key, value)
+            self.cycle_boundaries.add(cycle, time, duration)
+            self.stats[key][value][cycle].add_record(time, duration, error,
+                                                     start_delay)
+            if key == 'Response by description':
+                # report the phases of the response time, the handshakes
+                # by response and the other phases for all the requests
+                for name, section in REQUEST_PHASES:
+                    if name not in timings:
+                        continue
+                    substat = value
+                    if name != 'tls_handshake':
+                        substat = ALL_REQUESTS
+                    self.stats[section][substat][cycle].add_record(
+                        time, timings[name], error)
+
+    def rewriteNodeAttributes(self, attrs):
+        """Prefix the thread_id by the node id and multiply the cvus by the
+        node count like the FunkLoadContentMergeParser."""
+        node_id, node_count = self.node
+        if 'thread_id' in attrs:
+            attrs['thread_id'] = "{node}-{thread}".format(
+                node=node_id, thread=attrs['thread_id'])
+        if 'cvus' in attrs:
+            attrs['cvus'] = str(int(attrs['cvus']) * node_count)
+
     def handleStartElement(self, name, attrs):
         """Called by expat parser on start element."""
         if name == 'funkload':
-            self.config['version'] = attrs['version']
-            self.config['time'] = attrs['time']
+            self.addHeader(attrs['version'], attrs['time'])
         elif name == 'config':
-            self.config[attrs['key']] = attrs['value']
-            if attrs['key'] == 'duration':
-                self.cycle_duration = attrs['value']
+            self.addFileConfig(attrs['key'], attrs['value'])
+        elif self.node is not None:
+            self.rewriteNodeAttributes(attrs)
         self.current_element.append({'name': name, 'attrs': attrs})
 
     # old element names: header, headers, body, testResult, response, monitor, monitorconfig
@@ -167,7 +564,6 @@ class FunkLoadXmlParser:
         """Processing element."""
         element = self.current_element.pop()
         attrs = element['attrs']
-        cycle = int(attrs.get('cycle', -1))
 
         if name == 'aggregate':
             # Add this aggregation key to the list on the parent record
@@ -177,56 +573,54 @@ class FunkLoadXmlParser:
             # set the result as an attribute of the parent record
             self.current_element[-1]['attrs'][name] = "".join(element['contents'])
         elif name == 'monitor':
-            host = attrs.get('host')
-            stats = self.monitor.setdefault(host, [])
-            stats.append(MonitorStat(attrs))
+            self.addMonitor(attrs)
         elif name == 'monitorconfig':
-            host = attrs.get('host')
-            config = self.monitorconfig.setdefault(host, {})
-            config[attrs.get('key')]=attrs.get('value')
+            self.addMonitorConfig(attrs)
         # Handle all test results
-        elif name in ('funkload', 'config'):
+        elif name in ('funkload', 'config', 'chunk'):
             # These get handled elsewhere
-            pass
+            if name == 'funkload':
+                self.finished = True
+
         else:
-            time = float(attrs.get('time', -1))
-            duration = float(attrs.get('duration', -1))
-            result = attrs.get('result')
-            successful = result == 'Successful'
-
-            if not successful:
-                error = ErrorStat(result=result,
-                    code=attrs.get('response_code'), headers=attrs.get('headers'),
-                    body=attrs.get('body'), traceback=attrs.get('traceback'))
-            else:
-                error = None
-
-            def add_record(key, value):
-                value = self.normalize_entry(key, value)
-
-                self.cycle_boundaries.add(cycle, time, duration)
-                self.stats[key][value][cycle].add_record(
-                    time,
-                    duration,
-                    error
-                )
-
-            # Handle new-style results files
-            if name == 'record':
-                if not self.measure_startup and attrs.get('startup', False) == 'True':
-                    return
-                for key, value in attrs.get('aggregates', []):
-                    add_record(key, value)
-            # Handle old-style results files
-            elif name == 'testResult':
-                add_record('Test', TEST.format(name=attrs['name']))
-            elif name == 'response':
-                if not attrs['url'].startswith('http'):
-                    attrs['url'] = self.config['server_url'] + attrs['url']
-                add_record('Response by step', RESPONSE_BY_STEP.format(**attrs))
-                add_record('Response by description', RESPONSE_BY_DESCRIPTION.format(**attrs))
-                if attrs['type'] in ('get', 'post', 'xmlrpc'):
-                    add_record('Page', PAGE.format(**attrs))
+            self.addRecord(name, attrs)
+
+    def addRecord(self, name, attrs):
+        """Add the stats of a test result element."""
+        startup = False
+        timings = {}
+        # Handle new-style results files
+        if name == 'record':
+            aggregates = attrs.get('aggregates', [])
+            startup = attrs.get('startup', False) == 'True'
+            for timing in RECORD_TIMINGS:
+                if timing in attrs:
+                    timings[timing] = float(attrs[timing])
+        # Handle old-style results files
+        elif name == 'testResult':
+            aggregates = [('Test', TEST.format(name=attrs['name']))]
+        elif name == 'response':
+            if not attrs['url'].startswith('http'):
+                attrs['url'] = self.config['server_url'] + attrs['url']
+            aggregates = [
+                ('Response by step', RESPONSE_BY_STEP.format(**attrs)),
+                ('Response by description',
+                 RESPONSE_BY_DESCRIPTION.format(**attrs))]
+            if attrs['type'] in ('get', 'post', 'xmlrpc'):
+                aggregates.append(('Page', PAGE.format(**attrs)))
+        else:
+            return
+
+        result = attrs.get('result')
+        if result != 'Successful':
+            error = ErrorStat(result=result,
+                code=attrs.get('response_code'), headers=attrs.get('headers'),
+                body=attrs.get('body'), traceback=attrs.get('traceback'))
+        else:
+            error = None
+        self.addEntry(int(attrs.get('cycle', -1)), float(attrs.get('time', -1)),
+                      float(attrs.get('duration', -1)), error, aggregates,
+                      startup, timings)
 
     def handleCharacterData(self, data):
         self.current_element[-1].setdefault('contents', []).append(data)
@@ -286,6 +680,34 @@ def create_report_dir(options, report):
         os.mkdir(report_dir, 0775)
     return report_dir
 
+def output_report(options, report):
+    """Write the report as requested by the options."""
+    stat_count = sum(
+        len(grouped_stats) for grouped_stats in report.stats.values())
+    if options.html:
+        if stat_count > options.max_stat_count:
+            print ("You attempted to build an html report with {count} different "
+                   "graphs. Either increase --max-stat-count (currently {max}), or "
+                   "provide a --normalization-rules-file to decrease the number of "
+                   "stats".format(count = stat_count, max=options.max_stat_count))
+            return 1
+
+        trace('Creating {type} ...\n'.format(type=report.__class__.__name__))
+        report_dir = create_report_dir(options, report)
+        report.store_data_files(report_dir)
+
+        image_paths = report.render_charts(report_dir)
+        with open(os.path.join(report_dir, 'index.rst'), 'w') as index_rst:
+            index_rst.write(report.render('rst', image_paths))
+        html_path = generate_html_report(report_dir)
+        trace('Wrote {output}.\n'.format(output=html_path))
+
+    elif options.org:
+        print unicode(report.render('org')).encode("utf-8")
+    else:
+        print unicode(report.render('rst')).encode("utf-8")
+
+
 # ------------------------------------------------------------
 # main
 #
@@ -338,6 +760,46 @@ def main():
                       'for matching records, as described in re.sub. These '
                       'rules will be applied in order to all entries in the results file. This '
                       'option is only meaningful for building bench reports.')
+    parser.add_option('--quantile-sketch', type='float', nargs=1,
+                      dest='sketch_error', default=None, metavar='ERROR',
+                      help='Compute the percentiles from mergeable sketches '
+                      'with a bounded memory instead of keeping every '
+                      'duration, the percentiles are within ERROR relative '
+                      'error (0.01 is 1%), use it for very large results files.')
+    parser.add_option('--co-correction', action='store_true',
+                      dest='co_correction', default=False,
+                      help='Report the percentiles corrected for the '
+                      'coordinated omission next to the measured ones: the '
+                      'start delays of the tests are added and the long '
+                      'durations are back-filled with the requests a stall '
+                      'prevented.')
+    parser.add_option('--co-interval', type='float', dest='co_interval',
+                      default=None, metavar='SECONDS',
+                      help='The expected interval between the entries used '
+                      'to back-fill the corrected durations, by default the '
+                      'median duration of the entry, 0 disables the '
+                      'back-filling. It is disabled by default for an '
+                      'arrival rate bench.')
+    parser.add_option('-j', '--jobs', type='int', dest='jobs', default=1,
+                      help='Number of processes used to parse large results '
+                      'files and to render the charts, 0 uses one process '
+                      'per cpu, default is 1.')
+    parser.add_option('--keep-merged-file', type='string',
+                      dest='merged_file', default=None, metavar='PATH',
+                      help='When building a report from the results files '
+                      'of many nodes, also write the merged xml results '
+                      'into PATH, by default the node files are parsed '
+                      'without merged file.')
+    parser.add_option('--no-cache', action='store_false', dest='use_cache',
+                      default=True,
+                      help='Do not use nor write the parsed results cache, by '
+                      'default the parsed content of a results file is '
+                      'cached in a .cache file next to it to build the next '
+                      'reports faster.')
+    parser.add_option('-f', '--follow', action='store_true', default=False,
+                      help='Follow the results file of a running bench, the '
+                      'report of the completed cycles is built again at the '
+                      'end of each cycle until the end of the bench.')
     parser.add_option('--max-stat-count', default=10,
                       help='This is the maximum number of different stats that will be allowed '
                       'when generating reports with graphs.')
@@ -354,16 +816,27 @@ def main():
     else:
         if len(args) < 1:
             parser.error("incorrect number of arguments")
+        if options.follow and len(args) > 1:
+            parser.error("--follow works with a single results file")
+        if options.jobs < 1:
+            options.jobs = cpu_count()
+        pool = None
+        if options.jobs > 1 and not options.follow:
+            pool = Pool(options.jobs)
+        merge = None
+        xml_files = args
         if len(args) > 1:
+            # the node files are parsed directly
             trace("Merging results files: ")
-            f = NamedTemporaryFile(prefix='fl-mrg-', suffix='.xml')
-            tmp_file = f.name
-            f.close()
-            MergeResultFiles(args, tmp_file)
-            trace("Results merged in tmp file: %s\n" % os.path.abspath(tmp_file))
-            args = [tmp_file]
-        options.xml_file = args[0]
-        
+            merge = MergeResultFiles(args)
+            xml_files = merge.files
+            if options.merged_file:
+                merge.write(options.merged_file)
+                trace("Results merged in: %s\n" % options.merged_file)
+                xml_files = [options.merged_file]
+        options.xml_files = xml_files
+        options.xml_file = xml_files[0]
+
         if options.normalization_rules_file:
             with open(options.normalization_rules_file) as rules:
                 normalization_rules = [
@@ -374,8 +847,27 @@ def main():
         else:
             normalization_rules = []
 
-        xml_parser = FunkLoadXmlParser(options.apdex_t, options.measure_startup, normalization_rules)
-        xml_parser.parse(options.xml_file)
+        xml_parser = FunkLoadXmlParser(options.apdex_t, options.measure_startup,
+                                       normalization_rules, options.sketch_error,
+                                       options.use_cache and not options.follow,
+                                       options.co_correction)
+        if options.follow:
+            def on_cycle(count):
+                trace("Cycle %i of %s completed.\n" % (
+                    count, options.xml_file))
+                output_report(options, BenchReport(
+                    *xml_parser.getCyclesResults(count), options=options))
+            try:
+                xml_parser.follow(options.xml_file, on_cycle)
+            except KeyboardInterrupt:
+                trace("Stop following %s.\n" % options.xml_file)
+            return
+        if merge is None:
+            xml_parser.parse(options.xml_file, pool, options.jobs)
+        else:
+            xml_parser.parseNodes(merge, pool, options.jobs)
+        if pool is not None:
+            pool.close()
         
         report = BenchReport(xml_parser.config, xml_parser.stats,
                              xml_parser.monitor,
@@ -383,31 +875,7 @@ def main():
                              xml_parser.cycle_boundaries,
                              options)
 
-    stat_count = sum(
-        len(grouped_stats) for grouped_stats in report.stats.values())
-    if options.html:
-        if stat_count > options.max_stat_count:
-            print ("You attempted to build an html report with {count} different "
-                   "graphs. Either increase --max-stat-count (currently {max}), or "
-                   "provide a --normalization-rules-file to decrease the number of "
-                   "stats".format(count = stat_count, max=options.max_stat_count))
-            return 1
-
-        trace('Creating {type} ...\n'.format(type=report.__class__.__name__))
-        report_dir = create_report_dir(options, report)
-        report.store_data_files(report_dir)
-
-
-        image_paths = report.render_charts(report_dir)
-        with open(os.path.join(report_dir, 'index.rst'), 'w') as index_rst:
-            index_rst.write(report.render('rst', image_paths))
-        html_path = generate_html_report(report_dir)
-        trace('Wrote {output}.\n'.format(output=html_path))
-
-    elif options.org:
-        print unicode(report.render('org')).encode("utf-8")
-    else:
-        print unicode(report.render('rst')).encode("utf-8")
+    return output_report(options, report)
 
 
 if __name__ == '__main__':
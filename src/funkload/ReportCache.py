@@ -0,0 +1,248 @@
+# (C) Copyright 2005 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""A cache of the parsed content of a results file.
+
+The cache is stored next to the results file, it keeps the records as
+numeric columns with interned aggregates so that a report can be built
+again, with other options, without parsing the results file.
+
+The cache is valid while the size, modification time and sampled content
+digest of the results file and the cache version do not change.
+
+$Id$
+"""
+import os
+import cPickle
+from array import array
+from hashlib import md5
+
+from utils import trace
+
+CACHE_VERSION = 3
+CACHE_EXTENSION = '.cache'
+DIGEST_SAMPLE_SIZE = 1 << 16
+NO_TIMING = float('nan')
+
+
+def get_cache_path(path):
+    """Return the cache path of a results file."""
+    return path + CACHE_EXTENSION
+
+
+def get_cache_key(path):
+    """Return the key identifying the content of a results file."""
+    stat = os.stat(path)
+    digest = md5()
+    with open(path, 'rb') as f:
+        digest.update(f.read(DIGEST_SAMPLE_SIZE))
+        f.seek(max(stat.st_size - DIGEST_SAMPLE_SIZE, 0))
+        digest.update(f.read())
+    return (CACHE_VERSION, stat.st_size, stat.st_mtime, digest.hexdigest())
+
+
+class ResultsCache(object):
+    """Record the content of a results file as seen by the report parser.
+
+    The parser feeds the events of a file with the add methods, replay
+    feeds them back to a parser."""
+    columns = (('cycles', 'i'), ('times', 'd'), ('durations', 'd'),
+               ('startups', 'b'), ('errors', 'i'), ('aggregate_ends', 'i'),
+               ('aggregate_ids', 'i'))
+
+    def __init__(self):
+        self.header = None
+        self.config = []
+        self.monitor = []
+        self.monitorconfig = []
+        for name, typecode in self.columns:
+            setattr(self, name, array(typecode))
+        self.timings = {}
+        self.aggregates = []
+        self.aggregate_index = {}
+        self.error_list = []
+        self.error_index = {}
+
+    def __len__(self):
+        return len(self.times)
+
+    def _aggregate_id(self, aggregate):
+        aid = self.aggregate_index.get(aggregate)
+        if aid is None:
+            aid = self.aggregate_index[aggregate] = len(self.aggregates)
+            self.aggregates.append(aggregate)
+        return aid
+
+    def _error_id(self, error):
+        if error is None:
+            return -1
+        eid = self.error_index.get(error)
+        if eid is None:
+            eid = self.error_index[error] = len(self.error_list)
+            self.error_list.append(error)
+        return eid
+
+    def addHeader(self, version, time):
+        self.header = (version, time)
+
+    def addConfig(self, key, value):
+        self.config.append((key, value))
+
+    def addMonitor(self, attrs):
+        self.monitor.append(attrs)
+
+    def addMonitorConfig(self, attrs):
+        self.monitorconfig.append(attrs)
+
+    def addEntry(self, cycle, time, duration, error, aggregates,
+                 startup=False, timings={}):
+        """Add a record, see FunkLoadXmlParser.addEntry."""
+        index = len(self.times)
+        self.cycles.append(cycle)
+        self.times.append(time)
+        self.durations.append(duration)
+        self.startups.append(1 if startup else 0)
+        self.errors.append(self._error_id(error))
+        self.aggregate_ids.extend(self._aggregate_id(tuple(aggregate))
+                                  for aggregate in aggregates)
+        self.aggregate_ends.append(len(self.aggregate_ids))
+        for name, value in timings.items():
+            column = self.timings.get(name)
+            if column is None:
+                column = self.timings[name] = array('d', [NO_TIMING] * index)
+            column.append(value)
+        for column in self.timings.values():
+            if len(column) == index:
+                column.append(NO_TIMING)
+
+    def extend(self, other):
+        """Append the events of the cache of the next part of a file."""
+        if other.header is not None:
+            self.header = other.header
+        self.config.extend(other.config)
+        self.monitor.extend(other.monitor)
+        self.monitorconfig.extend(other.monitorconfig)
+        index = len(self.times)
+        aggregate_ids = [self._aggregate_id(aggregate)
+                         for aggregate in other.aggregates]
+        error_ids = [self._error_id(error) for error in other.error_list]
+        self.cycles.extend(other.cycles)
+        self.times.extend(other.times)
+        self.durations.extend(other.durations)
+        self.startups.extend(other.startups)
+        self.errors.extend(error_ids[eid] if eid >= 0 else -1
+                           for eid in other.errors)
+        offset = len(self.aggregate_ids)
+        self.aggregate_ids.extend(aggregate_ids[aid]
+                                  for aid in other.aggregate_ids)
+        self.aggregate_ends.extend(end + offset
+                                   for end in other.aggregate_ends)
+        for name in set(self.timings) | set(other.timings):
+            column = self.timings.setdefault(
+                name, array('d', [NO_TIMING] * index))
+            column.extend(other.timings.get(
+                name, array('d', [NO_TIMING] * len(other))))
+
+    def replay(self, parser):
+        """Feed the events to a FunkLoadXmlParser."""
+        if self.header is not None:
+            parser.addHeader(*self.header)
+        for key, value in self.config:
+            parser.addFileConfig(key, value)
+        for attrs in self.monitorconfig:
+            parser.addMonitorConfig(attrs)
+        for attrs in self.monitor:
+            parser.addMonitor(attrs)
+        aggregates, errors = self.aggregates, self.error_list
+        aggregate_ids = self.aggregate_ids
+        timings = self.timings.items()
+        start = 0
+        for i, end in enumerate(self.aggregate_ends):
+            eid = self.errors[i]
+            entry_timings = {}
+            for name, column in timings:
+                if column[i] == column[i]:
+                    # not a nan
+                    entry_timings[name] = column[i]
+            parser.addEntry(self.cycles[i], self.times[i],
+                            self.durations[i],
+                            errors[eid] if eid >= 0 else None,
+                            [aggregates[aid]
+                             for aid in aggregate_ids[start:end]],
+                            bool(self.startups[i]), entry_timings)
+            start = end
+
+    def save(self, path):
+        """Write the cache of the results file path, return False if the
+        cache can not be written."""
+        cache_path = get_cache_path(path)
+        state = {'header': self.header, 'config': self.config,
+                 'monitor': self.monitor, 'monitorconfig': self.monitorconfig,
+                 'aggregates': self.aggregates, 'error_list': self.error_list,
+                 'timings': dict((name, column.tostring())
+                                 for name, column in self.timings.items())}
+        for name, typecode in self.columns:
+            state[name] = getattr(self, name).tostring()
+        try:
+            with open(cache_path + '.tmp', 'wb') as f:
+                cPickle.dump(get_cache_key(path), f, cPickle.HIGHEST_PROTOCOL)
+                cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(cache_path + '.tmp', cache_path)
+        except (IOError, OSError), error:
+            trace("Can not write the results cache %s: %s\n" % (
+                cache_path, error))
+            return False
+        return True
+
+    @classmethod
+    def load(cls, path):
+        """Return the cache of the results file path or None if there is no
+        valid cache."""
+        cache_path = get_cache_path(path)
+        if not has_valid_cache(path):
+            return None
+        try:
+            with open(cache_path, 'rb') as f:
+                cPickle.load(f)
+                state = cPickle.load(f)
+        except Exception, error:
+            trace("Invalid results cache %s: %s\n" % (cache_path, error))
+            return None
+        cache = cls()
+        cache.header = state['header']
+        cache.config = state['config']
+        cache.monitor = state['monitor']
+        cache.monitorconfig = state['monitorconfig']
+        cache.aggregates = state['aggregates']
+        cache.error_list = state['error_list']
+        for name, typecode in cls.columns:
+            getattr(cache, name).fromstring(state[name])
+        for name, data in state['timings'].items():
+            cache.timings[name] = array('d', data)
+        return cache
+
+
+def has_valid_cache(path):
+    """Return True if the results file path has a valid cache."""
+    cache_path = get_cache_path(path)
+    if not os.path.exists(cache_path):
+        return False
+    try:
+        with open(cache_path, 'rb') as f:
+            return cPickle.load(f) == get_cache_key(path)
+    except Exception:
+        return False
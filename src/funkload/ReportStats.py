@@ -20,6 +20,7 @@
 $Id: ReportStats.py 24737 2005-08-31 09:00:16Z bdelbosc $
 """
 from __future__ import division
+from math import ceil, log
 from heapq import heappop, heappush, heapify
 from collections import defaultdict
 
@@ -114,6 +115,12 @@ class ApdexStat:
             self.apdex_frustrating += 1
         self.count += 1
 
+    def merge(self, other):
+        self.apdex_satisfied += other.apdex_satisfied
+        self.apdex_tolerating += other.apdex_tolerating
+        self.apdex_frustrating += other.apdex_frustrating
+        self.count += other.count
+
     @property
     def raw_score(self):
         return self.apdex_satisfied + (self.apdex_tolerating/2)
@@ -126,6 +133,155 @@ class ApdexStat:
         return self.raw_score / self.count
 
 
+class QuantileSketch(object):
+    """
+    A mergeable quantile sketch with a bounded memory.
+
+    Values are counted in buckets with logarithmic boundaries so that any
+    value of a bucket is within `relative_error` of the bucket
+    representative value: a quantile returned by the sketch is at most
+    `relative_error` * 100 percent away from the exact quantile. Durations
+    from 1 microsecond to 1 day use less than 1300 buckets with the
+    default 1% error.
+
+    `relative_error`: float
+        The relative error bound of the quantiles, between 0 and 1
+
+    `min_value`: float
+        Values smaller than this are counted as 0
+    """
+
+    def __init__(self, relative_error=0.01, min_value=1e-6):
+        if not 0 < relative_error < 1:
+            raise ValueError("The relative error must be between 0 and 1")
+        self.relative_error = relative_error
+        self.gamma = (1 + relative_error) / (1 - relative_error)
+        self.log_gamma = log(self.gamma)
+        self.min_value = min_value
+        self.buckets = defaultdict(int)
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value, count=1):
+        """
+        Add a value to the sketch
+        """
+        if value < self.min_value:
+            self.zero_count += count
+        else:
+            self.buckets[int(ceil(log(value) / self.log_gamma))] += count
+        self.count += count
+
+    def merge(self, other):
+        """
+        Add the values of another sketch with the same relative error
+        """
+        if other.gamma != self.gamma:
+            raise ValueError("Can not merge sketches with different errors")
+        for index, count in other.buckets.items():
+            self.buckets[index] += count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def add_sequence(self, first, last, step, count=1):
+        """
+        Add `count` times each value of the decreasing sequence `first`,
+        `first` - `step`, ... down to `last`, with one operation per bucket
+        instead of one per value
+        """
+        terms = int((first - last) / step) + 1
+        if terms <= 0:
+            return
+        last = first - (terms - 1) * step
+        if last < self.min_value:
+            # not worth it for the values of the zero bucket
+            for term in xrange(terms):
+                self.add(first - term * step, count)
+            return
+
+        def lower_terms(bound):
+            # the number of terms lower or equal to bound
+            return terms - min(max(int(ceil((first - bound) / step)), 0),
+                               terms)
+
+        low = int(ceil(log(last) / self.log_gamma))
+        high = int(ceil(log(first) / self.log_gamma))
+        seen = 0
+        for index in xrange(low, high + 1):
+            if index == high:
+                below = terms
+            else:
+                below = lower_terms(self.gamma ** index)
+            if below > seen:
+                self.buckets[index] += (below - seen) * count
+                seen = below
+        self.count += terms * count
+
+    def _value(self, index):
+        """
+        The representative value of a bucket
+        """
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def items(self):
+        """
+        Yields (value, count) tuples in ascending order
+        """
+        if self.zero_count:
+            yield 0, self.zero_count
+        for index in sorted(self.buckets):
+            yield self._value(index), self.buckets[index]
+
+    def quantiles(self, ranks):
+        """
+        Return the values of the entries at the sorted ascending `ranks`, a
+        rank being the index of the entry in the ordered values
+        """
+        values = []
+        ranks = list(ranks)
+        seen = 0
+        for value, count in self.items():
+            seen += count
+            while ranks and ranks[0] < seen:
+                values.append(value)
+                ranks.pop(0)
+        return values
+
+
+CO_PERCENTILES = (50, 90, 95)
+CO_SKETCH_ERROR = 0.01
+# the smallest expected interval used to back-fill the corrected durations
+CO_MIN_INTERVAL = 0.001
+
+
+def backfill(sketch, interval):
+    """
+    Return a copy of a sketch of durations with the entries that were not
+    issued because of the long ones, like the HdrHistogram correction with
+    an expected interval: a duration d adds d - interval, d - 2 * interval,
+    ... down to interval
+    """
+    backfilled = QuantileSketch(sketch.relative_error)
+    backfilled.merge(sketch)
+    if interval > 0:
+        interval = max(interval, CO_MIN_INTERVAL)
+        for value, count in sketch.items():
+            if value >= 2 * interval:
+                backfilled.add_sequence(value - interval, interval, interval,
+                                        count)
+    return backfilled
+
+
+def corrected_percentiles(sketch):
+    """
+    Return the CO_PERCENTILES of a sketch of corrected durations
+    """
+    if sketch is None or not sketch.count:
+        return [0] * len(CO_PERCENTILES)
+    return sketch.quantiles(int(perc / 100.0 * sketch.count)
+                            for perc in CO_PERCENTILES)
+
+
 class StatsAccumulator(object):
     """
     Collect stats in as minimal a form as possible that will still allow the
@@ -137,10 +293,28 @@ class StatsAccumulator(object):
 
     `apdex_t`: float
         The apdex threshold in seconds used for calculating apdex score
+
+    `sketch_error`: float
+        If set the durations are kept in a :py:class:`QuantileSketch` with
+        this relative error instead of keeping all the values
+
+    `co_correction`: boolean
+        If set the durations corrected for the coordinated omission are
+        kept too, see :py:meth:`corrected_sketch`
     """
 
-    def __init__(self, duration, apdex_t=1.5):
+    def __init__(self, duration, apdex_t=1.5, sketch_error=None,
+                 co_correction=False):
         self.values = []
+        self.sketch = None
+        if sketch_error:
+            self.sketch = QuantileSketch(sketch_error)
+        self.corrected = None
+        if co_correction:
+            self.corrected = QuantileSketch(sketch_error or CO_SKETCH_ERROR)
+        # the expected interval between entries used to back-fill the
+        # corrected durations, None for the median duration, 0 to disable
+        self.co_interval = None
         self.min = float('inf')
         self.max = float('-inf')
         self.total = self.count = self.successes = self.errors = 0
@@ -150,7 +324,7 @@ class StatsAccumulator(object):
         self.per_second = {}
         self.error_details = defaultdict(int)
     
-    def add_record(self, time, value, error=None):
+    def add_record(self, time, value, error=None, start_delay=None):
         """
         Add an entry to this stats collection
 
@@ -163,8 +337,17 @@ class StatsAccumulator(object):
 
         `error`: boolean
             Whether this entry was an error or not
+
+        `start_delay`: float
+            The delay between the intended and the actual start of the
+            test of the entry, added to the corrected duration
         """
-        self.values.append(value)
+        if self.sketch is None:
+            self.values.append(value)
+        else:
+            self.sketch.add(value)
+        if self.corrected is not None:
+            self.corrected.add(value + (start_delay or 0))
         self.min = min(self.min, value)
         self.max = max(self.max, value)
         self.total += value
@@ -181,11 +364,35 @@ class StatsAccumulator(object):
 
         self._sorted = False
 
+    def merge(self, other):
+        """
+        Add the entries of another accumulator of the same period, used to
+        combine the stats of results parsed in parallel
+        """
+        if self.sketch is None:
+            self.values.extend(other.values)
+        else:
+            self.sketch.merge(other.sketch)
+        if self.corrected is not None and other.corrected is not None:
+            self.corrected.merge(other.corrected)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.total += other.total
+        self.count += other.count
+        self.successes += other.successes
+        self.errors += other.errors
+        for second, count in other.per_second.items():
+            self.per_second[second] = self.per_second.get(second, 0) + count
+        self.apdex.merge(other.apdex)
+        for error, count in other.error_details.items():
+            self.error_details[error] += count
+        self._sorted = False
+
     def __len__(self):
         """
         Return the number of entries recorded
         """
-        return len(self.values)
+        return self.count
 
     def sort(self):
         """
@@ -225,6 +432,12 @@ class StatsAccumulator(object):
         Yields all of the recorded durations stored in this collection of stats,
         in ascending order
         """
+        if self.sketch is not None:
+            for value, count in self.sketch.items():
+                for i in xrange(count):
+                    yield value
+            return
+
         self.sort()
 
         for v in self.values:
@@ -254,14 +467,37 @@ class StatsAccumulator(object):
         if int(step) != step:
             raise ValueError("Can only compute integer percentiles")
 
-        self.sort()
-
         entry_count = len(self)
-        for perc in range(0, 100, step):
-            index = int(perc / 100.0 * entry_count)
-            value = self.values[index]
+        percentiles = range(0, 100, step)
+        indexes = [int(perc / 100.0 * entry_count) for perc in percentiles]
+        if self.sketch is not None:
+            values = [min(max(value, self.min), self.max)
+                      for value in self.sketch.quantiles(indexes)]
+        else:
+            self.sort()
+            values = [self.values[index] for index in indexes]
+        for perc, value in zip(percentiles, values):
             setattr(self, "perc%d" % perc, value)
 
+    def corrected_sketch(self):
+        """
+        Return the sketch of the durations corrected for the coordinated
+        omission, or None if they are not kept
+
+        The start delays of the entries are included and the durations are
+        back-filled with the `co_interval`, by default the median duration
+        """
+        if self.corrected is None:
+            return None
+        interval = self.co_interval
+        if interval is None and len(self):
+            if self.sketch is not None:
+                interval = self.sketch.quantiles([len(self) // 2])[0]
+            else:
+                self.sort()
+                interval = self.values[len(self) // 2]
+        return backfill(self.corrected, interval or 0)
+
     def stats_list(self):
         """
         Returns a list of stats for this collection. The list contains the
@@ -281,13 +517,19 @@ class StatsAccumulator(object):
         Median entry duration
         90th Percentile entry duration
         95th Percentile entry duration
+
+        followed by the corrected median, 90th and 95th percentile durations
+        when the corrected durations are kept
         """
         self.compute_percentiles(5)
         apdex_score = self.apdex_score
-        return [apdex_score, get_apdex_label(apdex_score),
-                self.avg_per_second, self.max_per_second, len(self),
-                self.successes, self.errors, self.min, self.average, self.max,
-                self.perc10, self.perc50, self.perc90, self.perc95]
+        stats = [apdex_score, get_apdex_label(apdex_score),
+                 self.avg_per_second, self.max_per_second, len(self),
+                 self.successes, self.errors, self.min, self.average, self.max,
+                 self.perc10, self.perc50, self.perc90, self.perc95]
+        if self.corrected is not None:
+            stats.extend(corrected_percentiles(self.corrected_sketch()))
+        return stats
 
 
 class StatsAggregator(object):
@@ -296,10 +538,14 @@ class StatsAggregator(object):
 
     `substats`:
         A list of StatsAccumulator or StatsAggregator objects to aggregate over
+
+    `co_correction`: boolean
+        If set the corrected percentiles of the substats are reported too
     """
 
-    def __init__(self, substats):
+    def __init__(self, substats, co_correction=False):
         self.substats = substats
+        self.co_correction = co_correction
 
     @property
     def max(self):
@@ -417,6 +663,33 @@ class StatsAggregator(object):
 
         return sum(s.apdex.raw_score for s in self.substats) / len(self)
 
+    @property
+    def sketch(self):
+        """
+        The merged sketch of the substats, None if a substat keeps all its
+        values
+        """
+        sketches = [s.sketch for s in self.substats]
+        if not sketches or None in sketches:
+            return None
+        sketch = QuantileSketch(sketches[0].relative_error)
+        for substat_sketch in sketches:
+            sketch.merge(substat_sketch)
+        return sketch
+
+    def corrected_sketch(self):
+        """
+        The merged corrected durations of the substats, None if a substat
+        does not keep them
+        """
+        sketches = [s.corrected_sketch() for s in self.substats]
+        if not sketches or None in sketches:
+            return None
+        sketch = QuantileSketch(sketches[0].relative_error)
+        for substat_sketch in sketches:
+            sketch.merge(substat_sketch)
+        return sketch
+
     @property
     def ordered_values(self):
         """
@@ -456,6 +729,16 @@ class StatsAggregator(object):
             for perc in range(0, 100, step):
                 setattr(self, "perc%d" % perc, 0)
 
+        sketch = self.sketch
+        if sketch is not None:
+            percentiles = range(0, 100, step)
+            values = sketch.quantiles(int(perc / 100.0 * len(self))
+                                      for perc in percentiles)
+            low, high = self.min, self.max
+            for perc, value in zip(percentiles, values):
+                setattr(self, "perc%d" % perc, min(max(value, low), high))
+            return
+
         percentile_names = defaultdict(list)
         entry_count = len(self)
         for perc in range(0, 100, step):
@@ -486,16 +769,24 @@ class StatsAggregator(object):
         Median entry duration
         90th Percentile entry duration
         95th Percentile entry duration
+
+        followed by the corrected median, 90th and 95th percentile durations
+        with `co_correction`
         """
         self.compute_percentiles(5)
         apdex_score = self.apdex_score
-        return [apdex_score, get_apdex_label(apdex_score),
-                self.avg_per_second, self.max_per_second, len(self),
-                self.successes, self.errors, self.min, self.average, self.max,
-                self.perc10, self.perc50, self.perc90, self.perc95]
+        stats = [apdex_score, get_apdex_label(apdex_score),
+                 self.avg_per_second, self.max_per_second, len(self),
+                 self.successes, self.errors, self.min, self.average, self.max,
+                 self.perc10, self.perc50, self.perc90, self.perc95]
+        if self.co_correction:
+            stats.extend(corrected_percentiles(self.corrected_sketch()))
+        return stats
 
 STATS_COLUMNS = ['CUs', 'Apdex*', 'Rating', 'PS', 'maxPS', 'TOTAL', 'SUCCESS',
     'ERROR', 'MIN', 'AVG', 'MAX', 'P10', 'MED', 'P90', 'P95']
+# the corrected percentiles columns
+CO_STATS_COLUMNS = ['cMED', 'cP90', 'cP95']
 
 
 def get_apdex_label(score):
@@ -531,6 +822,21 @@ class CycleBoundaries(object):
         cur_start, cur_end = self.cycles[cycle]
         self.cycles[cycle] = (min(cur_start, time), max(cur_end, time+duration))
 
+    def merge(self, other):
+        """
+        Add the observations of another CycleBoundaries
+        """
+        for cycle, (start, end) in other.cycles.items():
+            cur_start, cur_end = self.cycles[cycle]
+            self.cycles[cycle] = (min(cur_start, start), max(cur_end, end))
+
+    def __getstate__(self):
+        return dict(self.cycles)
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.cycles.update(state)
+
     def containing_cycles(self, time):
         """
         Return a list of all cycles that had active tests at this point in time
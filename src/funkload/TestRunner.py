@@ -410,6 +410,14 @@ Examples
                           dest="ftest_simple_fetch",
                           help="Don't load additional links like css "
                           "or images when fetching an html page.")
+        parser.add_option("--no-keep-alive", action="store_const",
+                          const="0", dest="ftest_keep_alive",
+                          help="Open a new connection for each request "
+                          "instead of reusing keep alive connections.")
+        parser.add_option("--resource-concurrency", type="int",
+                          dest="ftest_resource_concurrency",
+                          help="Number of css or images fetched at the same "
+                          "time from a host, default is 1.")
         parser.add_option("--stop-on-fail", action="store_true",
                           help="Stop tests on first failure or error.")
         parser.add_option("-e", "--regex", type="string", default=None,
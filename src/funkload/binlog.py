@@ -0,0 +1,372 @@
+# (C) Copyright 2005 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""Compact binary results log, an alternative to the xml results file.
+
+The file starts with a magic string followed by append only chunks, each
+chunk starts with a type byte:
+
+* S: a string of the string table, its id is its position in the table
+* F: the funkload version and time
+* C: a config key and value
+* R: a record, a fixed width part (time, duration, cycle, cvus, thread
+  id, suite, test and result string ids, flags and item counts) followed
+  by the aggregate, numeric attribute and text item pairs
+* E: the end of the log
+
+Strings are referenced by their id, short strings like aggregate keys or
+urls are written once.
+
+$Id$
+"""
+import os
+import sys
+import time
+import struct
+import threading
+import xml.parsers.expat
+from datetime import datetime
+from optparse import OptionParser, TitledHelpFormatter
+
+from utils import get_version, trace
+
+MAGIC = 'FLBIN001'
+BINARY_EXTENSION = '.flb'
+
+STRING, FUNKLOAD, CONFIG, RECORD, END = 'S', 'F', 'C', 'R', 'E'
+
+LENGTH = struct.Struct('<I')
+PAIR = struct.Struct('<II')
+NUMBER = struct.Struct('<Id')
+RECORD_HEAD = struct.Struct('<ddiiiIIIBBBB')
+STARTUP_FLAG = 1
+
+# longer strings are not kept in the writer string table
+INTERN_MAX_SIZE = 256
+
+# record attributes stored in the fixed width part
+RECORD_ATTRIBUTES = ('time', 'duration', 'cycle', 'cvus', 'thread_id',
+                     'suite_name', 'test_name', 'startup')
+
+load_time = int(time.time())
+
+
+def is_binary_path(path):
+    """Return True if path has the binary results file extension."""
+    return os.path.splitext(path)[1] == BINARY_EXTENSION
+
+
+def is_binary_file(path):
+    """Return True if path is a binary results file."""
+    with open(path, 'rb') as result_file:
+        return result_file.read(len(MAGIC)) == MAGIC
+
+
+def encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+class BinaryResultsLogger(object):
+    """Write records in the binary format, same api as the ResultsLogger."""
+    def __init__(self, path, buffering=-1):
+        if os.access(path, os.F_OK):
+            os.rename(path, path + '.bak-' + str(load_time))
+        self.output = open(path, 'wb', buffering)
+        self.strings = {}
+        self.string_count = 0
+        self.lock = threading.RLock()
+
+    def _string_id(self, value):
+        """Return the id of a string, add it to the table if needed."""
+        value = encode(value)
+        sid = self.strings.get(value)
+        if sid is None:
+            sid = self.string_count
+            self.string_count += 1
+            self.output.write(STRING + LENGTH.pack(len(value)) + value)
+            if len(value) <= INTERN_MAX_SIZE:
+                self.strings[value] = sid
+        return sid
+
+    def start_log(self, version=None, start_time=None):
+        with self.lock:
+            self.output.write(MAGIC)
+            version = self._string_id(version or get_version())
+            start_time = self._string_id(start_time or
+                                         datetime.now().isoformat())
+            self.output.write(FUNKLOAD + PAIR.pack(version, start_time))
+
+    def config(self, key, value, ns=None):
+        if ns is not None:
+            key = ':'.join((ns, key))
+        with self.lock:
+            chunk = PAIR.pack(self._string_id(key), self._string_id(value))
+            self.output.write(CONFIG + chunk)
+
+    def record(self, attributes, subitems, aggregates):
+        with self.lock:
+            sid = self._string_id
+            numbers = []
+            texts = [PAIR.pack(sid(key), sid(value))
+                     for key, value in subitems.items() if key != 'result']
+            for key, value in attributes.items():
+                if key in RECORD_ATTRIBUTES:
+                    continue
+                try:
+                    numbers.append(NUMBER.pack(sid(key), float(value)))
+                except ValueError:
+                    texts.append(PAIR.pack(sid(key), sid(value)))
+            aggregates = [PAIR.pack(sid(key), sid(value))
+                          for key, value in aggregates.items()]
+            flags = 0
+            if str(attributes.get('startup')) == 'True':
+                flags |= STARTUP_FLAG
+            head = RECORD_HEAD.pack(
+                float(attributes['time']), float(attributes['duration']),
+                int(attributes['cycle']), int(attributes['cvus']),
+                int(attributes['thread_id']),
+                sid(attributes['suite_name']), sid(attributes['test_name']),
+                sid(subitems.get('result', 'Successful')), flags,
+                len(aggregates), len(numbers), len(texts))
+            self.output.write(''.join([RECORD, head] + aggregates + numbers +
+                                      texts))
+
+    def merge(self, path):
+        """Append the records of another binary result file."""
+        with self.lock:
+            for event in read_results(path):
+                if event[0] == RECORD:
+                    self.record(*event[1:])
+
+    def end_log(self):
+        with self.lock:
+            self.output.write(END)
+            self.output.flush()
+
+
+class TruncatedFile(Exception):
+    """The binary file ends in the middle of a chunk."""
+
+
+class BufferedReader(object):
+    """Read a binary file by blocks.
+
+    The reader can go back to a marked position, to read again a chunk
+    that was not completely written."""
+    block_size = 1 << 20
+
+    def __init__(self, input_file):
+        self.input = input_file
+        self.buffer = ''
+        self.position = 0
+        self.marked = 0
+
+    def mark(self):
+        self.marked = self.position
+
+    def reset(self):
+        """Go back to the marked position, the next reads get the data
+        appended to the file."""
+        self.position = self.marked
+        # clear the end of file of the input
+        self.input.seek(0, os.SEEK_CUR)
+
+    def read(self, size):
+        end = self.position + size
+        if end > len(self.buffer):
+            self.buffer = self.buffer[self.marked:] + self.input.read(
+                max(size, self.block_size))
+            self.position -= self.marked
+            self.marked = 0
+            end = self.position + size
+            if end > len(self.buffer):
+                if self.buffer:
+                    raise TruncatedFile()
+                raise EOFError()
+        data = self.buffer[self.position:end]
+        self.position = end
+        return data
+
+    def unpack(self, structure):
+        return structure.unpack(self.read(structure.size))
+
+
+def read_results(path, wait=None):
+    """Iterate over the chunks of a binary results file.
+
+    Yield (FUNKLOAD, version, time), (CONFIG, key, value) and
+    (RECORD, attributes, subitems, aggregates) tuples, the record tuple
+    matches the arguments of the logger record method.
+
+    To read a file that is being written, wait is called at the end of the
+    available data, the reading goes on while it returns True."""
+    with open(path, 'rb') as input_file:
+        if input_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a FunkLoad binary results file: %s' % path)
+        reader = BufferedReader(input_file)
+        read, unpack = reader.read, reader.unpack
+        strings = []
+        while True:
+            try:
+                reader.mark()
+                chunk = read(1)
+                if chunk == RECORD:
+                    (start, duration, cycle, cvus, thread_id, suite, test,
+                     result, flags, aggregate_count, number_count,
+                     text_count) = unpack(RECORD_HEAD)
+                    attributes = {'time': start, 'duration': duration,
+                                  'cycle': cycle, 'cvus': cvus,
+                                  'thread_id': thread_id,
+                                  'suite_name': strings[suite],
+                                  'test_name': strings[test]}
+                    if flags & STARTUP_FLAG:
+                        attributes['startup'] = 'True'
+                    aggregates = {}
+                    for i in xrange(aggregate_count):
+                        key, value = unpack(PAIR)
+                        aggregates[strings[key]] = strings[value]
+                    for i in xrange(number_count):
+                        key, value = unpack(NUMBER)
+                        attributes[strings[key]] = value
+                    subitems = {'result': strings[result]}
+                    for i in xrange(text_count):
+                        key, value = unpack(PAIR)
+                        subitems[strings[key]] = strings[value]
+                    yield RECORD, attributes, subitems, aggregates
+                elif chunk == STRING:
+                    strings.append(read(unpack(LENGTH)[0]))
+                elif chunk == CONFIG:
+                    key, value = unpack(PAIR)
+                    yield CONFIG, strings[key], strings[value]
+                elif chunk == FUNKLOAD:
+                    version, start_time = unpack(PAIR)
+                    yield FUNKLOAD, strings[version], strings[start_time]
+                elif chunk == END:
+                    return
+                else:
+                    raise ValueError('Invalid chunk %r in %s' % (chunk, path))
+            except (EOFError, TruncatedFile), error:
+                if wait is not None and wait():
+                    reader.reset()
+                    continue
+                if isinstance(error, EOFError):
+                    trace('Missing end of binary results file %s.\n' % path)
+                else:
+                    trace('Truncated binary results file %s.\n' % path)
+                return
+
+
+# ------------------------------------------------------------
+# conversion
+#
+class XmlRecordParser:
+    """Read the records of a funkload xml results file."""
+    def __init__(self, logger):
+        self.logger = logger
+        self.record = None
+        self.element = None
+
+    def parse(self, xml_file):
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self.handleStartElement
+        parser.EndElementHandler = self.handleEndElement
+        parser.CharacterDataHandler = self.handleCharacterData
+        with open(xml_file) as input_file:
+            parser.ParseFile(input_file)
+
+    def handleStartElement(self, name, attrs):
+        if name == 'funkload':
+            self.logger.start_log(attrs['version'], attrs['time'])
+        elif name == 'config':
+            self.logger.config(attrs['key'], attrs['value'])
+        elif name == 'record':
+            self.record = (attrs, {}, {})
+        elif self.record is not None:
+            self.element = [name, attrs.get('name'), []]
+
+    def handleEndElement(self, name):
+        if self.record is None:
+            return
+        if name == 'record':
+            self.logger.record(*self.record)
+            self.record = None
+        elif name == 'aggregate':
+            self.record[2][self.element[1]] = ''.join(self.element[2])
+        else:
+            self.record[1][name] = ''.join(self.element[2])
+
+    def handleCharacterData(self, data):
+        if self.record is not None and self.element is not None:
+            self.element[2].append(data)
+
+
+def binary_to_xml(binary_path, xml_path):
+    """Convert a binary results file into an xml one."""
+    from log import ResultsLogger
+    logger = ResultsLogger(xml_path)
+    for event in read_results(binary_path):
+        if event[0] == RECORD:
+            logger.record(*event[1:])
+        elif event[0] == CONFIG:
+            logger.config(event[1], event[2])
+        elif event[0] == FUNKLOAD:
+            logger.xml_logger.start_log('funkload', {'version': event[1],
+                                                     'time': event[2]})
+    logger.end_log()
+
+
+def xml_to_binary(xml_path, binary_path):
+    """Convert an xml results file into a binary one."""
+    logger = BinaryResultsLogger(binary_path)
+    XmlRecordParser(logger).parse(xml_path)
+    logger.end_log()
+
+
+USAGE = """%prog [options] input_file output_file
+
+%prog converts a FunkLoad results file between the xml and the binary
+formats, the output file with a """ + BINARY_EXTENSION + """ extension is a
+binary file.
+
+Examples
+========
+  %prog funkload.xml funkload.flb
+  %prog funkload.flb funkload.xml
+"""
+
+def main():
+    """Results file converter main."""
+    parser = OptionParser(USAGE, formatter=TitledHelpFormatter(),
+                          version="FunkLoad %s" % get_version())
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("incorrect number of arguments")
+    input_path, output_path = args
+    if is_binary_file(input_path):
+        binary_to_xml(input_path, output_path)
+    elif is_binary_path(output_path):
+        xml_to_binary(input_path, output_path)
+    else:
+        parser.error("one of the files must be a binary results file")
+    trace("Wrote %s.\n" % output_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+set output "${image_path}"
+set terminal png size ${chart_size[0]},${chart_size[1]}
+set title "Average time per request"
+set ylabel "Duration (s)"
+set xlabel "Concurrent Users"
+set grid back
+set key outside top
+set style data histograms
+set style histogram rowstacked
+set style fill solid .7 border -1
+set boxwidth .75
+
+plot \
+% for i, phase in enumerate(phases):
+"${data_path}" u ${i + 2}${':xticlabels(1)' if i == 0 else ''} t "${phase}"${', \\' if i < len(phases) - 1 else ''}
+% endfor
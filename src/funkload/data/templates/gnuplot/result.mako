@@ -42,6 +42,10 @@ plot "${data_path}" u ${g.columns('CUs', 'MED', 'MED', 'P95', 'P90')} \
     t "med/p90/p95" w candlesticks lt 1 lw 1 whiskerbars 0.5, \
 "" u ${g.columns('CUs', 'P10', 'MIN', 'MED', 'MED')} \
     w candlesticks lt 2 lw 1 t "min/p10/med" whiskerbars 0.5, \
+% if co_correction:
+"" u ${g.columns('CUs', 'cMED')} t "corrected med" w linespoints lt 4 lw 1, \
+"" u ${g.columns('CUs', 'cP95')} t "corrected p95" w linespoints lt 5 lw 1, \
+% endif
 "" u ${g.columns('CUs', 'AVG')} t "avg" w lines lt 3 lw 2
 
 set boxwidth .9
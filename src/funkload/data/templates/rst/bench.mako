@@ -139,7 +139,16 @@ ${error.body}
 * Label: ${config['label']}
 % endif
 * Target server: ${config['server_url']}
+% if config.get('arrival'):
+* Cycles of arrival rates: ${config['cycles']} tests/s, ${config['arrival']} arrival
+% else:
 * Cycles of concurrent users: ${config['cycles']}
+% endif
+% if config.get('ramp_time'):
+* Ramp between cycles: ${config['ramp_shape']} in ${config['ramp_time']}s
+% elif config.get('reuse_threads') == 'True':
+* Threads kept between cycles
+% endif
 * Cycle duration: ${config['duration']}s
 * Sleeptime between request: from ${config['sleep_time_min']}s to ${config['sleep_time_max']}s
 * Sleeptime between test case: ${config['sleep_time']}s
@@ -163,6 +172,34 @@ Bench metadata:
 ${render_aggregate_stats(aggregate, aggregate_stats[aggregate], stats)}
 % endfor
 
+% if request_phases:
+<%rst:title>Request phases</%rst:title>
+% if 'request_phases' in image_paths:
+.. image:: ${image_paths['request_phases']}
+% endif
+<%
+rows = [[str(row[0])] + ["%.3f" % value for value in row[1:]]
+        for row in request_phases]
+column_names = ['CUs'] + phase_names
+column_widths = [max(len(value) for value in column)
+                 for column in zip(*([column_names] + rows))]
+%>
+${' '.join('=' * width for width in column_widths)}
+% for column, width in zip(column_names, column_widths):
+${column.center(width)} \
+% endfor
+
+${' '.join('=' * width for width in column_widths)}
+% for row in rows:
+% for value, width in zip(row, column_widths):
+${value.center(width)} \
+% endfor
+
+% endfor
+${' '.join('=' * width for width in column_widths)}
+
+% endif
+
 % if monitor_hosts:
 <%rst:title>Monitored hosts</%rst:title>
 <%block name="monitors">
@@ -186,6 +223,9 @@ ${error_details()}
 <%block name="definitions">
 <%rst:title>Definitions</%rst:title>
 * CUs: Concurrent users or number of concurrent threads executing tests.
+% if config.get('arrival'):
+* CUs in an arrival rate bench: Number of tests started per second.
+% endif
 * Request: a single GET/POST/redirect/xmlrpc request.
 * Page: a request with redirects and resource links (image, css, js) for an html page.
 * STPS: Successful tests per second.
@@ -200,6 +240,10 @@ ${error_details()}
 * MED: Median or 50th percentile, response time where half of pages or requests are delivered.
 * P90: 90th percentile, response time where 90 percent of pages or requests are delivered.
 * P95: 95th percentile, response time where 95 percent of pages or requests are delivered.
+* Request phases: Average time per request spent to look up the host name, to connect, in the TLS handshake, until the first byte of the response and to download the body. A reused connection has no lookup, connect nor handshake.
+% if 'cMED' in stats_columns:
+* cMED, cP90, cP95: Median, 90th and 95th percentiles corrected for the coordinated omission, the start delays of the tests are added and the long response times are back-filled with the requests they prevented.
+% endif
 * Apdex T: Application Performance Index, 
   this is a numerical measure of user satisfaction, it is based
   on three zones of application responsiveness:
@@ -0,0 +1,192 @@
+# (C) Copyright 2005 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""Extract the resources of a html page.
+
+A single regular expression scans the page for the tags that load a
+resource: img src, link href, script src and the css url() of the style
+elements and attributes. The comments are skipped and the base href is
+used to resolve the urls. Unlike the webunit IMGSucker nothing else of
+the page is parsed or rewritten.
+
+The same pages are loaded again and again during a bench, the links
+extracted from a page are kept in a LRU cache shared by the virtual users.
+
+$Id$
+"""
+import re
+import threading
+import urlparse
+from collections import OrderedDict
+
+# a comment, a style element or a tag that may load a resource
+TAG_RE = re.compile(r'<!--.*?-->'
+                    r'|<style\b[^>]*>(?P<style>.*?)</style\s*>'
+                    r'|<(?P<tag>img|link|script|base)\b(?P<attrs>[^>]*)>'
+                    r'|<[a-z][^>]*\sstyle\s*=[^>]*>',
+                    re.I | re.S)
+ATTR_RE = re.compile(r'''([a-z_:][-\w:.]*)\s*=\s*'''
+                     r'''(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''', re.I)
+CSS_URL_RE = re.compile(r'''url\(\s*(?:"([^"]*)"|'([^']*)'|([^)\s]*))\s*\)''',
+                        re.I)
+ENTITY_RE = re.compile(r'&(#?\w+);')
+ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+
+# the link relations loaded by a browser, a link without rel is loaded like
+# with the webunit parser
+LINK_RELS = ('stylesheet', 'icon', 'preload', 'apple-touch-icon')
+
+# number of pages in the links cache
+PAGE_CACHE_SIZE = 1000
+
+_page_cache = None
+
+
+def get_page_cache():
+    """Return the PageCache of the process."""
+    global _page_cache
+    if _page_cache is None:
+        _page_cache = PageCache()
+    return _page_cache
+
+
+def unescape_entity(match):
+    name = match.group(1)
+    if name.startswith('#'):
+        try:
+            code = int(name[1:])
+        except ValueError:
+            return match.group(0)
+        if code < 256:
+            return chr(code)
+        return match.group(0)
+    return ENTITIES.get(name.lower(), match.group(0))
+
+
+def get_attributes(text):
+    """Return the attributes of a tag as a dict with lower case names."""
+    attributes = {}
+    for match in ATTR_RE.finditer(text):
+        name, value = match.group(1).lower(), match.group(2)
+        if value is None:
+            value = match.group(3)
+            if value is None:
+                value = match.group(4)
+        if '&' in value:
+            value = ENTITY_RE.sub(unescape_entity, value)
+        attributes.setdefault(name, value)
+    return attributes
+
+
+def get_css_urls(text):
+    """Return the url() of a css text."""
+    urls = []
+    for match in CSS_URL_RE.finditer(text):
+        url = match.group(1) or match.group(2) or match.group(3)
+        if url and not url.startswith('data:'):
+            urls.append(url)
+    return urls
+
+
+def extract_resources(url, page):
+    """Return the (rtype, url) resources of a page in document order.
+
+    rtype is 'image' for the images and the css url(), 'link' for the
+    links and 'script' for the scripts. The urls are resolved with the
+    page url or the base href."""
+    base = None
+    found = []
+    for match in TAG_RE.finditer(page):
+        tag = match.group('tag')
+        if tag is None:
+            style = match.group('style')
+            if style is None:
+                text = match.group(0)
+                if text.startswith('<!--'):
+                    continue
+                style = get_attributes(text).get('style', '')
+            for link in get_css_urls(style):
+                found.append(('image', link))
+            continue
+        attributes = get_attributes(match.group('attrs'))
+        tag = tag.lower()
+        if tag == 'img':
+            if 'src' in attributes:
+                found.append(('image', attributes['src']))
+        elif tag == 'link':
+            rel = attributes.get('rel', '').lower()
+            if 'href' in attributes and (
+                not rel or [name for name in LINK_RELS if name in rel]):
+                found.append(('link', attributes['href']))
+        elif tag == 'script':
+            if 'src' in attributes:
+                found.append(('script', attributes['src']))
+        elif 'href' in attributes and base is None:
+            # the first base applies to all the links of the page
+            base = attributes['href']
+        if 'style' in attributes:
+            for link in get_css_urls(attributes['style']):
+                found.append(('image', link))
+    if base is None:
+        base = url
+    else:
+        base = urlparse.urljoin(url, base)
+    resources = []
+    seen = set()
+    for rtype, link in found:
+        resource = (rtype, urlparse.urljoin(base, link.strip()))
+        if resource not in seen:
+            seen.add(resource)
+            resources.append(resource)
+    return resources
+
+
+class PageCache(object):
+    """A bounded LRU cache of the links extracted from the pages.
+
+    A page is identified by its url and the size and hash of its body, the
+    links of each kind are extracted on the first request."""
+    def __init__(self, size=PAGE_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, url, page, kind, extract):
+        """Return the kind of links of a page, extract() is called to get
+        them when they are not in the cache."""
+        key = (url, len(page), hash(page))
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                entry = {}
+                if len(self.entries) >= self.size:
+                    self.entries.popitem(last=False)
+            self.entries[key] = entry
+            if kind in entry:
+                self.hits += 1
+                return entry[kind]
+            self.misses += 1
+        finally:
+            self.lock.release()
+        links = entry[kind] = extract()
+        return links
+
+    def stats(self):
+        """Return the number of hits and misses."""
+        return self.hits, self.misses
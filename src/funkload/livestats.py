@@ -0,0 +1,294 @@
+# (C) Copyright 2005 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""Live stats of a running bench.
+
+The records of the virtual users are counted in a rolling window of one
+second slots, each slot keeps a quantile sketch of the durations. The
+stats are served as json or in the Prometheus text format by the debug
+server of the bench runner. The worker processes of a bench export their
+live stats to the parent runner that merges them.
+
+$Id$
+"""
+import json
+import time
+import threading
+
+from ReportStats import QuantileSketch
+
+LIVE_WINDOW = 10
+SKETCH_ERROR = 0.02
+PERCENTILES = (50, 90, 99)
+
+# record kinds by aggregate key
+KINDS = (('requests', 'Response by description'), ('pages', 'Page'),
+         ('tests', 'Test'))
+
+_live_stats = None
+
+
+def enable_live_stats(window=LIVE_WINDOW):
+    """Start collecting the live stats of the process."""
+    global _live_stats
+    if _live_stats is None:
+        _live_stats = LiveStats(window)
+    return _live_stats
+
+
+def get_live_stats():
+    """Return the LiveStats of the process or None if not enabled."""
+    return _live_stats
+
+
+class RollingStats(object):
+    """Count records and their durations over the last window seconds."""
+    def __init__(self, window=LIVE_WINDOW):
+        self.window = window
+        # [second, count, errors, sketch]
+        self.slots = [None] * window
+        self.count = self.errors = 0
+        self.cycle_count = self.cycle_errors = 0
+        self.lock = threading.Lock()
+
+    def add(self, end_time, duration, error):
+        second = int(end_time)
+        index = second % self.window
+        self.lock.acquire()
+        try:
+            slot = self.slots[index]
+            if slot is None or slot[0] != second:
+                slot = self.slots[index] = [second, 0, 0,
+                                            QuantileSketch(SKETCH_ERROR)]
+            slot[1] += 1
+            slot[3].add(duration)
+            self.count += 1
+            self.cycle_count += 1
+            if error:
+                slot[2] += 1
+                self.errors += 1
+                self.cycle_errors += 1
+        finally:
+            self.lock.release()
+
+    def startCycle(self):
+        self.lock.acquire()
+        try:
+            self.cycle_count = self.cycle_errors = 0
+        finally:
+            self.lock.release()
+
+    def export(self):
+        """Return the slots and the counters added since the last export
+        and reset them."""
+        self.lock.acquire()
+        try:
+            state = ([slot for slot in self.slots if slot is not None],
+                     self.count, self.errors)
+            self.slots = [None] * self.window
+            self.count = self.errors = 0
+            self.cycle_count = self.cycle_errors = 0
+        finally:
+            self.lock.release()
+        return state
+
+    def merge(self, state):
+        """Add the slots and the counters exported by another process."""
+        slots, count, errors = state
+        self.lock.acquire()
+        try:
+            for second, slot_count, slot_errors, sketch in slots:
+                index = second % self.window
+                slot = self.slots[index]
+                if slot is None or slot[0] < second:
+                    slot = self.slots[index] = [second, 0, 0,
+                                                QuantileSketch(SKETCH_ERROR)]
+                elif slot[0] > second:
+                    # out of the window
+                    continue
+                slot[1] += slot_count
+                slot[2] += slot_errors
+                slot[3].merge(sketch)
+            self.count += count
+            self.cycle_count += count
+            self.errors += errors
+            self.cycle_errors += errors
+        finally:
+            self.lock.release()
+
+    def snapshot(self, now):
+        """Return the counters and the stats of the window as a dict."""
+        second = int(now)
+        sketch = QuantileSketch(SKETCH_ERROR)
+        count = errors = 0
+        self.lock.acquire()
+        try:
+            for slot in self.slots:
+                if (slot is not None and
+                    second - self.window < slot[0] <= second):
+                    count += slot[1]
+                    errors += slot[2]
+                    sketch.merge(slot[3])
+            stats = {'total': self.count, 'errors': self.errors,
+                     'cycle_total': self.cycle_count,
+                     'cycle_errors': self.cycle_errors}
+        finally:
+            self.lock.release()
+        stats['per_second'] = count / float(self.window)
+        stats['error_rate'] = count and errors / float(count) or 0.
+        ranks = [min(int(count * percentile / 100.), count - 1)
+                 for percentile in PERCENTILES]
+        values = sketch.quantiles(ranks) if count else [0.] * len(ranks)
+        for percentile, value in zip(PERCENTILES, values):
+            stats['p%i' % percentile] = value
+        return stats
+
+
+class LiveStats(object):
+    """The live stats of the records, the cycle and the thread starts."""
+    def __init__(self, window=LIVE_WINDOW):
+        self.window = window
+        self.kinds = [(name, key, RollingStats(window))
+                      for name, key in KINDS]
+        self.cycle = None
+        self.cvus = 0
+        self.lock = threading.Lock()
+        self.lag_count = 0
+        self.lag_total = self.lag_max = 0.
+
+    def record(self, aggregates, end_time, duration, error):
+        """Add a record of FunkLoadTestCase.record."""
+        for name, key, stats in self.kinds:
+            if key in aggregates:
+                stats.add(end_time, duration, error)
+                return
+
+    def startCycle(self, cycle, cvus):
+        self.lock.acquire()
+        try:
+            self.cycle = cycle
+            self.cvus = cvus
+            self.lag_count = 0
+            self.lag_total = self.lag_max = 0.
+        finally:
+            self.lock.release()
+        for name, key, stats in self.kinds:
+            stats.startCycle()
+
+    def addThreadStart(self, lag):
+        """Add the delay between the planned and the actual start of a
+        virtual user."""
+        self.lock.acquire()
+        try:
+            self.lag_count += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+        finally:
+            self.lock.release()
+
+    def export(self):
+        """Return the records and the thread starts since the last export
+        and reset them, to merge them in the LiveStats of another
+        process."""
+        self.lock.acquire()
+        try:
+            lag = (self.lag_count, self.lag_total, self.lag_max)
+            self.lag_count = 0
+            self.lag_total = self.lag_max = 0.
+        finally:
+            self.lock.release()
+        return lag, [stats.export() for name, key, stats in self.kinds]
+
+    def merge(self, state):
+        """Add the live stats exported by another process."""
+        (lag_count, lag_total, lag_max), kinds = state
+        self.lock.acquire()
+        try:
+            self.lag_count += lag_count
+            self.lag_total += lag_total
+            self.lag_max = max(self.lag_max, lag_max)
+        finally:
+            self.lock.release()
+        for (name, key, stats), kind in zip(self.kinds, kinds):
+            stats.merge(kind)
+
+    def snapshot(self, active_cus, now=None):
+        """Return all the live stats as a dict."""
+        if now is None:
+            now = time.time()
+        snapshot = {'time': now, 'window': self.window, 'cycle': self.cycle,
+                    'cvus': self.cvus, 'active_cus': active_cus,
+                    'thread_start_lag': {
+                        'count': self.lag_count, 'max': self.lag_max,
+                        'average': self.lag_count and (
+                            self.lag_total / self.lag_count) or 0.}}
+        for name, key, stats in self.kinds:
+            snapshot[name] = stats.snapshot(now)
+        return snapshot
+
+
+def render_json(snapshot):
+    return json.dumps(snapshot, sort_keys=True, indent=2)
+
+
+def render_prometheus(snapshot):
+    """Return a snapshot in the Prometheus text exposition format."""
+    lines = []
+    def metric(name, kind, help, samples):
+        lines.append('# HELP funkload_%s %s' % (name, help))
+        lines.append('# TYPE funkload_%s %s' % (name, kind))
+        for labels, value in samples:
+            labels = ','.join('%s="%s"' % label for label in labels)
+            lines.append('funkload_%s%s %r' % (
+                name, labels and '{%s}' % labels or '', float(value)))
+    names = [name for name, key in KINDS]
+    metric('cycle', 'gauge', 'Current cycle.',
+           [((), snapshot['cycle'] is None and -1 or snapshot['cycle'])])
+    metric('cycle_cvus', 'gauge', 'Concurrent users of the current cycle.',
+           [((), snapshot['cvus'])])
+    metric('active_cus', 'gauge', 'Running virtual users.',
+           [((), snapshot['active_cus'])])
+    metric('records_total', 'counter', 'Records since the bench start.',
+           [((('kind', name),), snapshot[name]['total']) for name in names])
+    metric('errors_total', 'counter', 'Failed records since the bench start.',
+           [((('kind', name),), snapshot[name]['errors']) for name in names])
+    metric('cycle_records', 'gauge', 'Records of the current cycle.',
+           [((('kind', name),), snapshot[name]['cycle_total'])
+            for name in names])
+    metric('cycle_errors', 'gauge', 'Failed records of the current cycle.',
+           [((('kind', name),), snapshot[name]['cycle_errors'])
+            for name in names])
+    metric('records_per_second', 'gauge',
+           'Records per second over the last %is.' % snapshot['window'],
+           [((('kind', name),), snapshot[name]['per_second'])
+            for name in names])
+    metric('error_ratio', 'gauge',
+           'Failed records ratio over the last %is.' % snapshot['window'],
+           [((('kind', name),), snapshot[name]['error_rate'])
+            for name in names])
+    metric('duration_seconds', 'gauge',
+           'Record duration percentiles over the last %is.' %
+           snapshot['window'],
+           [((('kind', name), ('quantile', str(percentile / 100.))),
+             snapshot[name]['p%i' % percentile])
+            for name in names for percentile in PERCENTILES])
+    lag = snapshot['thread_start_lag']
+    metric('thread_start_lag_seconds', 'gauge',
+           'Delay of the virtual user starts of the current cycle.',
+           [((('stat', 'average'),), lag['average']),
+            ((('stat', 'max'),), lag['max'])])
+    return '\n'.join(lines) + '\n'
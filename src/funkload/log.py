@@ -1,19 +1,38 @@
 import os
 import time
+from collections import deque
 from contextlib import contextmanager
 from xml.sax.saxutils import XMLGenerator
 from funkload.utils import get_version
+from funkload.binlog import BinaryResultsLogger, is_binary_path
 from datetime import datetime
-from threading import RLock
+import threading
 
 loggers = {}
 
-def get_results_logger(path):
+def get_results_logger(path, result_format=None, buffered=False,
+                       buffer_size=1000):
+    """Return the results logger of path, result_format is xml or binary,
+    by default binary is used for a .flb file.
+
+    A buffered logger writes the records from a writer thread, buffer_size
+    is the maximum number of pending records per thread."""
     global loggers
     if path in loggers:
         return loggers[path]
+    if result_format is None:
+        result_format = is_binary_path(path) and 'binary' or 'xml'
+    # large writes when buffered
+    buffering = buffered and WRITER_FILE_BUFFER or -1
+    if result_format == 'binary':
+        logger = BinaryResultsLogger(path, buffering)
+    elif result_format == 'xml':
+        logger = ResultsLogger(path, buffering)
     else:
-        return loggers.setdefault(path, ResultsLogger(path))
+        raise ValueError('Unknown result format: %s' % result_format)
+    if buffered:
+        logger = BufferedResultsLogger(logger, buffer_size)
+    return loggers.setdefault(path, logger)
 
 def get_stats_logger(path):
     global loggers
@@ -24,15 +43,17 @@ def get_stats_logger(path):
 
 load_time = int(time.time())
 
+WRITER_FILE_BUFFER = 1 << 20
+
 
 class XmlLogger(object):
     
-    def __init__(self, path):
+    def __init__(self, path, buffering=-1):
         if os.access(path, os.F_OK):
             os.rename(path, path + '.bak-' + str(load_time))
-        self.output = open(path, 'w')
+        self.output = open(path, 'w', buffering)
         self.xml_gen = XMLGenerator(self.output, 'utf-8')
-        self.lock = RLock()
+        self.lock = threading.RLock()
 
     def start_log(self, tag, attributes):
         self.doc_tag = tag
@@ -44,6 +65,7 @@ class XmlLogger(object):
         with self.lock:
             self.xml_gen.endElement(self.doc_tag)
             self.xml_gen.endDocument()
+            self.output.flush()
 
     @contextmanager
     def element(self, name, attrs={}):
@@ -58,9 +80,15 @@ class XmlLogger(object):
         with self.lock:
             self.xml_gen.characters(str(text))
 
+    def merge(self, path):
+        """Copy the elements of another log file into this log."""
+        from funkload.MergeResultFiles import FunkLoadContentMergeParser
+        with self.lock:
+            FunkLoadContentMergeParser(self.output, 1).parse(path, None)
+
 class ResultsLogger(object):
-    def __init__(self, path):
-        self.xml_logger = XmlLogger(path)
+    def __init__(self, path, buffering=-1):
+        self.xml_logger = XmlLogger(path, buffering)
 
     def start_log(self):
         self.xml_logger.start_log('funkload', {
@@ -85,10 +113,133 @@ class ResultsLogger(object):
                 with self.xml_logger.element('aggregate', {'name': key}):
                     self.xml_logger.text(value)
 
+    def merge(self, path):
+        """Append the records of another result file."""
+        self.xml_logger.merge(path)
+
     def end_log(self):
         self.xml_logger.end_log()
 
 
+class ResultsWriterThread(threading.Thread):
+    """Drain the record buffers of a BufferedResultsLogger."""
+
+    def __init__(self, buffered_logger, interval=0.2):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.buffered_logger = buffered_logger
+        self.interval = interval
+        self.wakeup_event = threading.Event()
+        self.shutdown_event = threading.Event()
+
+    def wakeup(self):
+        self.wakeup_event.set()
+
+    def shutdown(self):
+        self.shutdown_event.set()
+        self.wakeup_event.set()
+
+    def run(self):
+        while not self.shutdown_event.isSet():
+            self.wakeup_event.wait(self.interval)
+            self.wakeup_event.clear()
+            self.buffered_logger.drain()
+        self.buffered_logger.drain()
+
+
+class BufferedResultsLogger(object):
+    """A results logger that does not write from the virtual user threads.
+
+    Each thread appends its records to its own buffer without lock, the
+    writer thread drains the buffers in batches into the wrapped logger.
+    A thread with buffer_size pending records waits for the writer, the
+    number of waits and the time spent are kept in blocked_count and
+    blocked_time. The buffer of a finished thread is dropped once it is
+    drained."""
+
+    def __init__(self, logger, buffer_size=1000):
+        self.logger = logger
+        self.buffer_size = buffer_size
+        self.buffers = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.records = 0
+        self.blocked_count = 0
+        self.blocked_time = 0.0
+        self.writer = None
+
+    def start_log(self):
+        self.logger.start_log()
+        self.writer = ResultsWriterThread(self)
+        self.writer.start()
+
+    def config(self, key, value, ns=None):
+        self.logger.config(key, value, ns)
+
+    def _buffer(self):
+        """Return the buffer of the current thread."""
+        buf = getattr(self.local, 'buffer', None)
+        if buf is None:
+            buf = self.local.buffer = deque()
+            with self.lock:
+                self.buffers.append((threading.currentThread(), buf))
+        return buf
+
+    def record(self, attributes, subitems, aggregates):
+        buf = self._buffer()
+        if len(buf) >= self.buffer_size and self.writer is not None:
+            # back pressure
+            start = time.time()
+            while len(buf) >= self.buffer_size and self.writer is not None:
+                self.writer.wakeup()
+                time.sleep(.001)
+            with self.lock:
+                self.blocked_count += 1
+                self.blocked_time += time.time() - start
+        buf.append((attributes, dict(subitems), aggregates))
+
+    def drain(self):
+        """Write all the pending records, called by the writer thread."""
+        with self.lock:
+            buffers = list(self.buffers)
+        record = self.logger.record
+        count = 0
+        finished = set()
+        for thread, buf in buffers:
+            # a finished thread does not append records anymore
+            alive = thread.isAlive()
+            while True:
+                try:
+                    args = buf.popleft()
+                except IndexError:
+                    break
+                record(*args)
+                count += 1
+            if not alive:
+                finished.add(id(buf))
+        if finished:
+            with self.lock:
+                self.buffers = [(thread, buf) for thread, buf in self.buffers
+                                if id(buf) not in finished]
+        self.records += count
+
+    def flush(self):
+        """Stop the writer thread once all the records are written."""
+        if self.writer is not None:
+            self.writer.shutdown()
+            self.writer.join()
+            self.writer = None
+        self.drain()
+
+    def merge(self, path):
+        self.flush()
+        self.logger.merge(path)
+
+    def end_log(self):
+        self.flush()
+        self.logger.end_log()
+
+
 class StatsLogger(object):
     def __init__(self, path):
         self.xml_logger = XmlLogger(path)
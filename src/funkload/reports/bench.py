@@ -21,7 +21,8 @@
 $Id$
 """
 
-from funkload.ReportStats import StatsAggregator, STATS_COLUMNS
+from funkload.ReportStats import StatsAggregator, STATS_COLUMNS, \
+    CO_STATS_COLUMNS
 import json
 import os
 import hashlib
@@ -29,8 +30,11 @@ from datetime import datetime
 from funkload.MonitorPlugins import MonitorPlugins
 from funkload.MonitorPluginsDefault import MonitorCPU, MonitorMemFree, MonitorNetwork, MonitorCUs
 from funkload.utils import render_template
+from funkload.FunkLoadTestCase import REQUEST_PHASES
+from funkload.binlog import is_binary_file, BINARY_EXTENSION
 from funkload.gnuplot import gnuplot, gnuplot_scriptpath, strictly_monotonic
 from shutil import copyfile
+from multiprocessing.pool import ThreadPool
 
 class BenchReport(object):
     """
@@ -64,16 +68,31 @@ class BenchReport(object):
         self.options = options
         self.rst = []
         self.image_paths = {}
+        self.gnuplot_scripts = None
 
         self.cycles = json.loads(config['cycles'])
 
+        self.co_correction = getattr(options, 'co_correction', False)
+        self.stats_columns = STATS_COLUMNS
+        if self.co_correction:
+            self.stats_columns = STATS_COLUMNS + CO_STATS_COLUMNS
+            co_interval = getattr(options, 'co_interval', None)
+            if co_interval is None and config.get('arrival'):
+                # the start delays of an open model bench are the
+                # correction
+                co_interval = 0
+            for aggr_stats in self.stats.values():
+                for cycle_stats in aggr_stats.values():
+                    for accumulator in cycle_stats.values():
+                        accumulator.co_interval = co_interval
+
         self.aggr_stats = {}
         for aggr_key, aggr_stats in self.stats.items():
 
             for cycle_idx in range(len(self.cycles)):
                 self.aggr_stats.setdefault(aggr_key, {})[cycle_idx] = StatsAggregator([
                     cycle_stats[cycle_idx] for cycle_stats in aggr_stats.values() if cycle_idx in cycle_stats
-                ])
+                ], self.co_correction)
 
         if options.html:
             self.with_chart = True
@@ -81,6 +100,32 @@ class BenchReport(object):
             self.with_chart = False
 
         self.date = config['time'][:19].replace('T', ' ')
+        self.request_phases = self.getRequestPhases()
+
+    def getRequestPhases(self):
+        """Return the average time per request spent in each phase as a
+        list of [cvus, phase...] rows by cycle, None without phases.
+
+        The requests without a phase, like the lookup and the connect of a
+        reused connection, count for 0."""
+        # every response has a time to first byte
+        ttfb = self.aggr_stats.get(dict(REQUEST_PHASES)['ttfb'])
+        if not ttfb:
+            return None
+        rows = []
+        for cycle, cvus in enumerate(self.cycles):
+            count = len(ttfb[cycle])
+            if not count:
+                continue
+            row = [cvus]
+            for name, section in REQUEST_PHASES:
+                stats = self.aggr_stats.get(section, {}).get(cycle)
+                if stats is not None and len(stats):
+                    row.append(stats.total / count)
+                else:
+                    row.append(0.)
+            rows.append(row)
+        return rows or None
 
     def generate_report_dir_name(self):
         """Generate a directory name for a report."""
@@ -97,8 +142,18 @@ class BenchReport(object):
         """
         Copy all data files needed to recreate this report to the report_dir
         """
-        xml_dest_path = os.path.join(report_dir, 'funkload.xml')
-        copyfile(self.options.xml_file, xml_dest_path)
+        xml_files = getattr(self.options, 'xml_files',
+                            [self.options.xml_file])
+        for i, xml_file in enumerate(xml_files):
+            # one file per node when building a report without merged file
+            dest_name = 'funkload'
+            if len(xml_files) > 1:
+                dest_name += '-%i' % i
+            if is_binary_file(xml_file):
+                dest_name += BINARY_EXTENSION
+            else:
+                dest_name += '.xml'
+            copyfile(xml_file, os.path.join(report_dir, dest_name))
 
     def render(self, output_format, image_paths={}):
         """
@@ -113,7 +168,7 @@ class BenchReport(object):
         return render_template(
             '{output_format}/bench.mako'.format(output_format=output_format),
             cycles = self.cycles,
-            stats_columns=STATS_COLUMNS,
+            stats_columns=self.stats_columns,
             allstats=self.stats,
             aggregate_stats=self.aggr_stats,
             image_paths=image_paths,
@@ -121,6 +176,8 @@ class BenchReport(object):
             date=self.date,
             apdex_t="%.1f" % self.options.apdex_t,
             monitor_hosts=self.monitor,
+            request_phases=self.request_phases,
+            phase_names=[section for name, section in REQUEST_PHASES],
         )
 
     def getMonitorConfig(self, host):
@@ -132,6 +189,14 @@ class BenchReport(object):
                  'MonitorNetwork': MonitorNetwork(None).getConfig(),
                  'MonitorCUs': MonitorCUs().getConfig() }
 
+    def plot(self, gplot_path):
+        """Run a gnuplot script now or when rendering the charts with more
+        than one job."""
+        if self.gnuplot_scripts is None:
+            gnuplot(gplot_path)
+        else:
+            self.gnuplot_scripts.append(gplot_path)
+
     def createResultChart(self, key, stats, report_dir):
         """
         Create a single result chart using a specified key and report directory
@@ -154,7 +219,7 @@ class BenchReport(object):
         data_path = gnuplot_scriptpath(report_dir, output_name + '.data')
 
         # data
-        labels = STATS_COLUMNS + ["E", "G", "F", "P", "U"]
+        labels = self.stats_columns + ["E", "G", "F", "P", "U"]
         data = []
         has_error = False
         apdex_t = self.options.apdex_t
@@ -195,14 +260,38 @@ class BenchReport(object):
                 use_xticlabels=not strictly_monotonic(self.cycles),
                 data_path=data_path,
                 has_error=has_error,
+                co_correction=self.co_correction,
                 apdex_t="%0.1f" % apdex_t,
                 column_names=labels,
                 shared={}
             ))
-        gnuplot(gplot_path)
+        self.plot(gplot_path)
 
         return image_name
 
+    def createPhasesChart(self, report_dir):
+        """Create the stacked chart of the request phases, returns the
+        relative path of the image."""
+        image_name = 'request_phases.png'
+        image_path = gnuplot_scriptpath(report_dir, image_name)
+        gplot_path = str(os.path.join(report_dir, 'request_phases.gplot'))
+        data_path = gnuplot_scriptpath(report_dir, 'request_phases.data')
+        labels = ['CUs'] + [name.upper() for name, section in REQUEST_PHASES]
+        with open(data_path, 'w') as data_file:
+            data_file.write(render_template('gnuplot/data.mako',
+                labels=labels,
+                data=self.request_phases
+            ))
+        with open(gplot_path, 'w') as gplot_file:
+            gplot_file.write(render_template('gnuplot/phases.mako',
+                image_path=image_path,
+                chart_size=[800, 400],
+                data_path=data_path,
+                phases=[section for name, section in REQUEST_PHASES]
+            ))
+        self.plot(gplot_path)
+        return image_name
+
     def createMonitorChart(self, host, report_dir):
         """Create monitrored server charts."""
         stats = self.monitor[host]
@@ -228,7 +317,7 @@ class BenchReport(object):
             results = plugin.gnuplot(times, host, image_prefix, data_prefix, gplot_path, [640, 540], stats)
 
             if results != None:
-                gnuplot(gplot_path)
+                self.plot(gplot_path)
                 charts.extend(
                     (name, path.replace(report_dir, '.'))
                     for (name, path) in results
@@ -244,6 +333,11 @@ class BenchReport(object):
         """
 
         charts={}
+        jobs = getattr(self.options, 'jobs', 1)
+        if jobs > 1:
+            # gnuplot processes are run in parallel once all the scripts
+            # are written
+            self.gnuplot_scripts = []
 
         # Create all monitored server charts
         for host in self.monitor.keys():
@@ -257,5 +351,13 @@ class BenchReport(object):
         
         for group_name, aggregate_stats in self.aggr_stats.items():
             charts[group_name] = self.createResultChart(group_name, aggregate_stats, report_dir)
-        
+
+        if self.request_phases:
+            charts['request_phases'] = self.createPhasesChart(report_dir)
+
+        if self.gnuplot_scripts is not None:
+            pool = ThreadPool(jobs)
+            pool.map(gnuplot, self.gnuplot_scripts)
+            pool.close()
+            self.gnuplot_scripts = None
         return charts
@@ -0,0 +1,236 @@
+# (C) Copyright 2005 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""Think time scheduler of a bench.
+
+The sleeping virtual users park on an event and a single scheduler thread
+wakes them up. The pending sleeps are kept in a hashed timer wheel of tick
+slots so adding or expiring a sleep costs the same whatever the number of
+virtual users. A virtual user is woken up at the beginning of the tick of
+its deadline and sleeps the rest of the tick by itself.
+
+The difference between the requested and the actual sleep is measured so
+the drift of the think times can be reported for each cycle. The gevent
+hub is already a single timer for the greenlets, with the gevent engine
+the sleeps are only measured.
+
+$Id$
+"""
+import os
+import time
+import threading
+
+from ReportStats import QuantileSketch
+from utils import thread_sleep
+
+SCHEDULER_TICK = 0.005
+WHEEL_SIZE = 1024
+DRIFT_SKETCH_ERROR = 0.01
+
+_scheduler = None
+
+
+def enable_scheduler(tick=SCHEDULER_TICK, wheel=True):
+    """Make the think times of the process use a Scheduler, without
+    wheel the sleeps are only measured."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler(tick, wheel=wheel)
+    return _scheduler
+
+
+def get_scheduler():
+    """Return the Scheduler of the process or None if not enabled."""
+    return _scheduler
+
+
+def think(seconds):
+    """Sleep a think time, using the scheduler if enabled."""
+    if _scheduler is None:
+        thread_sleep(seconds)
+    else:
+        _scheduler.sleep(seconds)
+
+
+class SleepStats(object):
+    """Count the requested and the actual sleeps."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.requested = self.actual = 0.
+        self.max_drift = 0.
+        self.drifts = QuantileSketch(DRIFT_SKETCH_ERROR)
+
+    def add(self, requested, actual):
+        drift = actual - requested
+        self.lock.acquire()
+        try:
+            self.count += 1
+            self.requested += requested
+            self.actual += actual
+            self.max_drift = max(self.max_drift, drift)
+            self.drifts.add(drift)
+        finally:
+            self.lock.release()
+
+    def export(self):
+        """Return the raw stats for a merge in another process and reset
+        them."""
+        self.lock.acquire()
+        try:
+            state = (self.count, self.requested, self.actual,
+                     self.max_drift, self.drifts)
+            self.reset()
+        finally:
+            self.lock.release()
+        return state
+
+    def merge(self, state):
+        """Add the raw stats exported by another process."""
+        count, requested, actual, max_drift, drifts = state
+        self.lock.acquire()
+        try:
+            self.count += count
+            self.requested += requested
+            self.actual += actual
+            self.max_drift = max(self.max_drift, max_drift)
+            self.drifts.merge(drifts)
+        finally:
+            self.lock.release()
+
+    def snapshot(self, reset=False):
+        """Return the stats as a dict, reset them if asked."""
+        self.lock.acquire()
+        try:
+            count = self.count
+            stats = {'count': count, 'requested': self.requested,
+                     'actual': self.actual, 'max_drift': self.max_drift}
+            if count:
+                stats['p50_drift'], stats['p99_drift'] = \
+                    self.drifts.quantiles([int(count * .5),
+                                           min(int(count * .99), count - 1)])
+            else:
+                stats['p50_drift'] = stats['p99_drift'] = 0.
+            if reset:
+                self.reset()
+        finally:
+            self.lock.release()
+        stats['average_drift'] = count and (
+            (stats['actual'] - stats['requested']) / count) or 0.
+        return stats
+
+
+class Scheduler(object):
+    """Wake up the sleeping virtual users from a timer wheel."""
+    def __init__(self, tick=SCHEDULER_TICK, size=WHEEL_SIZE, wheel=True):
+        self.tick = tick
+        self.wheel = wheel
+        self.size = size
+        # [tick number, event] by tick number modulo the size
+        self.slots = [[] for i in range(size)]
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.local = threading.local()
+        self.stats = SleepStats()
+        self.thread = None
+        self.pid = None
+        # the last processed tick number
+        self.current = int(time.time() / tick)
+
+    def start(self):
+        """Start the scheduler thread, again in a forked worker.
+
+        NOTE: This method is not thread safe. Thread safety must be
+        handled by the caller."""
+        self.pid = os.getpid()
+        # the sleeps of the parent process threads are lost in a fork
+        self.slots = [[] for i in range(self.size)]
+        self.pending = 0
+        self.current = int(time.time() / self.tick)
+        self.thread = threading.Thread(target=self.run,
+                                       name='think_time_scheduler')
+        self.thread.setDaemon(1)
+        self.thread.start()
+
+    def sleep(self, seconds):
+        """Park the calling virtual user during seconds."""
+        if not seconds:
+            return
+        start = time.time()
+        if not self.wheel:
+            time.sleep(seconds)
+            self.stats.add(seconds, time.time() - start)
+            return
+        deadline = start + seconds
+        number = int(deadline / self.tick)
+        event = getattr(self.local, 'event', None)
+        if event is None:
+            event = self.local.event = threading.Event()
+        event.clear()
+        self.lock.acquire()
+        try:
+            if self.pid != os.getpid():
+                self.start()
+            if number <= self.current:
+                # too late to be parked
+                event.set()
+            else:
+                self.slots[number % self.size].append((number, event))
+                self.pending += 1
+                self.wakeup.set()
+        finally:
+            self.lock.release()
+        event.wait()
+        remaining = deadline - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        self.stats.add(seconds, time.time() - start)
+
+    def run(self):
+        """Expire the slots of the elapsed ticks."""
+        tick = self.tick
+        while True:
+            self.wakeup.wait()
+            now = time.time()
+            number = int(now / tick)
+            self.lock.acquire()
+            try:
+                # a revolution expires all the slots
+                first = max(self.current + 1, number - self.size + 1)
+                for current in range(first, number + 1):
+                    slot = self.slots[current % self.size]
+                    if not slot:
+                        continue
+                    kept = []
+                    for entry in slot:
+                        if entry[0] <= number:
+                            entry[1].set()
+                        else:
+                            kept.append(entry)
+                    self.pending -= len(slot) - len(kept)
+                    slot[:] = kept
+                self.current = number
+                if not self.pending:
+                    self.wakeup.clear()
+            finally:
+                self.lock.release()
+            # until the beginning of the next tick
+            time.sleep(max((number + 1) * tick - time.time(), 0))
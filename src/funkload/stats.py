@@ -8,14 +8,12 @@ from socket import error as SocketError
 from funkload.log import get_stats_logger
 
 
-stats_queue = Queue()
-
-
 class StatsWriterThread(threading.Thread):
 
-    def __init__(self, output_filename, config={}):
+    def __init__(self, output_filename, stats_queue, config={}):
         threading.Thread.__init__(self)
         self.logger = get_stats_logger(output_filename)
+        self.stats_queue = stats_queue
         self.shutdown_event = threading.Event()
         self._config = config
 
@@ -33,7 +31,7 @@ class StatsWriterThread(threading.Thread):
 
             # Get the record from the queue...
             try:
-                fn, args, kwargs = stats_queue.get(timeout=2.0)
+                fn, args, kwargs = self.stats_queue.get(timeout=2.0)
             except Empty:
                 continue
 
@@ -41,16 +39,17 @@ class StatsWriterThread(threading.Thread):
             getattr(self.logger, fn)(*args, **kwargs)
 
             # Its always important to let the queue know we finished a task!
-            stats_queue.task_done()
+            self.stats_queue.task_done()
 
         self.logger.end_log()
 
 
 class StatsCollectionThread(threading.Thread):
 
-    def __init__(self, host, port, interval):
+    def __init__(self, host, port, interval, stats_queue):
         threading.Thread.__init__(self)
         self.interval = interval
+        self.stats_queue = stats_queue
         self.server = ServerProxy("http://%s:%s" % (host, port))
         self.shutdown_event = threading.Event()
         self.host = host
@@ -61,7 +60,8 @@ class StatsCollectionThread(threading.Thread):
             config = self.server.getMonitorsConfig()
 
             for key, value in config.items():
-                stats_queue.put(('monitor_config', [self.host, key, value], {}))
+                self.stats_queue.put(
+                    ('monitor_config', [self.host, key, value], {}))
         except Fault:
             trace(' not supported.\n')
         except SocketError:
@@ -82,7 +82,7 @@ class StatsCollectionThread(threading.Thread):
             record = self.server.getRecord()
 
             # The deque is threadsafe, so append away
-            stats_queue.put(('monitor', [], record))
+            self.stats_queue.put(('monitor', [], record))
 
             # Use the sleep event to wait on an interval
             self.shutdown_event.wait(self.interval)
@@ -91,16 +91,21 @@ class StatsCollectionThread(threading.Thread):
 class StatsCollector(object):
 
     def __init__(self, monitor_hosts, output_dir=".", config={}, interval=0.5):
+        # created here and not at import time so the queue uses the gevent
+        # patched locks with the gevent engine
+        self.stats_queue = Queue()
         self.monitor_threads = []
         for (host, port, desc) in monitor_hosts:
             try:
                 self.monitor_threads.append(
-                    StatsCollectionThread(host, port, interval))
+                    StatsCollectionThread(host, port, interval,
+                                          self.stats_queue))
             except SocketError:
                 pass
 
         output_file_path = os.path.join(output_dir, "stats.xml")
-        self.stats_writer_thread = StatsWriterThread(output_file_path, config)
+        self.stats_writer_thread = StatsWriterThread(output_file_path,
+                                                     self.stats_queue, config)
 
     def __enter__(self):
         # First, get the writer started
@@ -118,7 +123,7 @@ class StatsCollector(object):
 
         # For the output, we'll first wait for the stats_queue to finish up.
         # This is because we want to make sure all recorded stats get written!
-        stats_queue.join()
+        self.stats_queue.join()
 
         # Then, shut down the Writer thread
         self.stats_writer_thread.shutdown()
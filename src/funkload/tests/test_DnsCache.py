@@ -0,0 +1,38 @@
+import unittest
+from funkload.DnsCache import DnsCache
+
+
+def ips(addresses):
+    return [address[4][0] for address in addresses]
+
+
+class TestDnsCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = DnsCache(60, {'www.example.test': ('10.0.0.1',
+                                                       '10.0.0.2')})
+
+    def test_static_round_robin(self):
+        cache = self.cache
+        self.assertEquals(['10.0.0.1', '10.0.0.2'],
+                          ips(cache.getaddrinfo('www.example.test', 80)))
+        self.assertEquals(['10.0.0.2', '10.0.0.1'],
+                          ips(cache.getaddrinfo('www.example.test', 80)))
+        self.assertEquals(['10.0.0.1', '10.0.0.2'],
+                          ips(cache.getaddrinfo('www.example.test', 80)))
+        hits, resolutions, resolve_time = cache.stats()
+        self.assertEquals((2, 1), (hits, resolutions))
+
+    def test_ttl(self):
+        cache = self.cache
+        cache.getaddrinfo('www.example.test', 80)
+        cache.getaddrinfo('127.0.0.1', 80)
+        # the static hosts never expire
+        self.assertEquals(None, cache.entries[('www.example.test', 80)][0])
+        self.assert_(cache.entries[('127.0.0.1', 80)][0] is not None)
+        cache.ttl = 0
+        cache.getaddrinfo('127.0.0.2', 80)
+        self.assertFalse(('127.0.0.2', 80) in cache.entries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import threading
+import unittest
+from funkload.PatchWebunit import FetchPool
+
+
+class TestFetchPool(unittest.TestCase):
+    def test_reuse_workers(self):
+        pool = FetchPool()
+        names = []
+        lock = threading.Lock()
+        def fetch(number):
+            with lock:
+                names.append((number, threading.currentThread()))
+        for page in range(10):
+            pool.map(fetch, [(page * 3 + i,) for i in range(3)])
+        self.assertEquals(range(30),
+                          sorted(number for number, thread in names))
+        # the workers of the first page fetch all the pages
+        self.assert_(len(set(thread for number, thread in names)) <= 3)
+        self.assertEquals(3, len(pool.workers))
+        workers = pool.workers
+        pool.close()
+        for worker in workers:
+            worker.join(1)
+            self.assert_(not worker.isAlive())
+        self.assertEquals([], pool.workers)
+
+
+if __name__ == '__main__':
+    unittest.main()
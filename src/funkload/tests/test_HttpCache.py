@@ -0,0 +1,92 @@
+import unittest
+from funkload.HttpCache import HttpCache, FRESH, STALE
+
+
+class Response(object):
+    def __init__(self, headers, code=200, body=''):
+        self.headers = headers
+        self.code = code
+        self.body = body
+
+NOW = 1000000000.0
+DATE = 'Sun, 09 Sep 2001 01:46:40 GMT'   # NOW as an http date
+
+
+class TestHttpCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = HttpCache(2)
+
+    def test_miss(self):
+        self.assertEquals((None, None), self.cache.lookup('/a', NOW))
+        self.assertEquals(1, self.cache.misses)
+
+    def test_max_age(self):
+        self.cache.store('/a', Response({'cache-control': 'max-age=60',
+                                         'date': DATE}), NOW)
+        self.assertEquals(FRESH, self.cache.lookup('/a', NOW + 59)[0])
+        # expired without validator
+        self.assertEquals(None, self.cache.lookup('/a', NOW + 61)[0])
+        self.assertEquals(1, self.cache.hits)
+
+    def test_expires(self):
+        self.cache.store('/a', Response({
+            'date': DATE, 'etag': '"1"',
+            'expires': 'Sun, 09 Sep 2001 01:47:40 GMT'}), NOW)
+        self.assertEquals(FRESH, self.cache.lookup('/a', NOW + 30)[0])
+        state, entry = self.cache.lookup('/a', NOW + 90)
+        self.assertEquals(STALE, state)
+        self.assertEquals([('If-None-Match', '"1"')], entry.validators())
+        self.cache.refresh(entry, {'cache-control': 'max-age=60'}, NOW + 90)
+        self.assertEquals(FRESH, self.cache.lookup('/a', NOW + 100)[0])
+        self.assertEquals(1, self.cache.revalidations)
+
+    def test_no_cache_and_no_store(self):
+        self.cache.store('/a', Response({'cache-control': 'no-store',
+                                         'etag': '"1"'}), NOW)
+        self.assertEquals(0, len(self.cache))
+        self.cache.store('/a', Response({'cache-control': 'no-cache',
+                                         'etag': '"1"'}), NOW)
+        self.assertEquals(STALE, self.cache.lookup('/a', NOW)[0])
+
+    def test_heuristic(self):
+        self.cache.store('/a', Response({
+            'date': DATE,
+            'last-modified': 'Sun, 09 Sep 2001 01:30:00 GMT'}), NOW)
+        # 10% of 1000s
+        self.assertEquals(FRESH, self.cache.lookup('/a', NOW + 99)[0])
+        state, entry = self.cache.lookup('/a', NOW + 101)
+        self.assertEquals(STALE, state)
+        self.assertEquals('If-Modified-Since', entry.validators()[0][0])
+
+    def test_lru(self):
+        for url in ('/a', '/b'):
+            self.cache.store(url, Response({'cache-control': 'max-age=60'}),
+                             NOW)
+        self.cache.lookup('/a', NOW)
+        self.cache.store('/c', Response({'cache-control': 'max-age=60'}),
+                         NOW)
+        self.assertEquals(2, len(self.cache))
+        self.assertEquals(None, self.cache.lookup('/b', NOW)[0])
+        self.assertEquals(FRESH, self.cache.lookup('/a', NOW)[0])
+
+    def test_bytes(self):
+        cache = HttpCache(10, max_bytes=250, max_entry_bytes=200)
+        headers = {'cache-control': 'max-age=60'}
+        for url in ('/a', '/b'):
+            cache.store(url, Response(headers, body='x' * 100), NOW)
+        cache.store('/c', Response(headers, body='x' * 100), NOW)
+        # the least recently used body is evicted
+        self.assertEquals(['/b', '/c'], cache.entries.keys())
+        self.assertEquals(200, cache.bytes)
+        cache.store('/c', Response(headers, body='x' * 300), NOW)
+        self.assertEquals(['/b'], cache.entries.keys())
+        self.assertEquals(100, cache.bytes)
+
+    def test_not_ok(self):
+        self.cache.store('/a', Response({'cache-control': 'max-age=60'}, 404),
+                         NOW)
+        self.assertEquals(0, len(self.cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
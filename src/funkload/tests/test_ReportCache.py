@@ -0,0 +1,84 @@
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+from funkload.ReportCache import ResultsCache, has_valid_cache
+from funkload.ReportStats import ErrorStat
+
+ERROR = ErrorStat('Failure', '500', 'traceback')
+PAGE = ('Page', 'get /a')
+TEST = ('Test', 'test_simple')
+
+
+class Recorder(object):
+    """Record the events replayed by a cache."""
+    def __init__(self):
+        self.events = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.events.append((name,) + args)
+
+
+def fill(cache, count, offset=0):
+    for i in range(offset, offset + count):
+        cache.addEntry(i % 2, 1000.0 + i, i / 10., i % 3 and ERROR or None,
+                       [PAGE, TEST], i == 0,
+                       i % 2 and {'tls_handshake': 0.5} or {})
+
+
+class TestResultsCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = mkdtemp('funkload')
+        self.path = os.path.join(self.tmp_dir, 'funkload.xml')
+        with open(self.path, 'w') as f:
+            f.write('<funkload/>')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def replay(self, cache):
+        recorder = Recorder()
+        cache.replay(recorder)
+        return recorder.events
+
+    def test_save_and_load(self):
+        cache = ResultsCache()
+        cache.addHeader('1.17.0', '2011-10-26T10:00:00')
+        cache.addConfig('duration', '10')
+        cache.addMonitor({'host': 'node', 'time': '1000.0'})
+        fill(cache, 10)
+        self.assert_(cache.save(self.path))
+        self.assert_(has_valid_cache(self.path))
+        events = self.replay(ResultsCache.load(self.path))
+        self.assertEquals(self.replay(cache), events)
+        self.assertEquals(('addHeader', '1.17.0', '2011-10-26T10:00:00'),
+                          events[0])
+        self.assertEquals(('addEntry', 1, 1001.0, 0.1, ERROR, [PAGE, TEST],
+                           False, {'tls_handshake': 0.5}), events[4])
+        self.assertEquals(None, events[6][4])
+
+    def test_invalidation(self):
+        cache = ResultsCache()
+        fill(cache, 2)
+        cache.save(self.path)
+        with open(self.path, 'a') as f:
+            f.write('\n')
+        self.assertFalse(has_valid_cache(self.path))
+        self.assertEquals(None, ResultsCache.load(self.path))
+
+    def test_extend(self):
+        cache = ResultsCache()
+        fill(cache, 10)
+        first, second = ResultsCache(), ResultsCache()
+        fill(first, 4)
+        second.addEntry(4, 1.0, 1.0, None, [('Test', 'other')])
+        fill(second, 6, 4)
+        first.extend(second)
+        events = self.replay(first)
+        self.assertEquals(11, len(events))
+        del events[4]
+        self.assertEquals(self.replay(cache), events)
+
+
+if __name__ == '__main__':
+    unittest.main()
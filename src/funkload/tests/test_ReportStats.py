@@ -1,5 +1,7 @@
+import random
 import unittest
 from funkload.ReportStats import StatsAccumulator, StatsAggregator
+from funkload.ReportStats import QuantileSketch, backfill
 
 class TestStatsAccumulator(unittest.TestCase):
     def setUp(self):
@@ -56,6 +58,20 @@ class TestStatsAccumulator(unittest.TestCase):
     def test_min_per_second(self):
         self.assertEquals(0, self.accum.min_per_second)
 
+    def test_merge(self):
+        merged = StatsAccumulator(10, 1.5)
+        other = StatsAccumulator(10, 1.5)
+        for t, i in [(7.1, 4), (7.2, 2), (1.2, 3)]:
+            merged.add_record(t, i, i % 2 == 0)
+        for t, i in [(2.1, 1), (3.1, 0)]:
+            other.add_record(t, i, i % 2 == 0)
+        merged.merge(other)
+        for name in ('min', 'max', 'total', 'count', 'successes', 'errors',
+                     'per_second', 'error_details', 'apdex_score'):
+            self.assertEquals(getattr(self.accum, name),
+                              getattr(merged, name))
+        self.assertEquals([0,1,2,3,4], list(merged.ordered_values))
+
     def test_max_per_second(self):
         self.assertEquals(2, self.accum.max_per_second)
 
@@ -118,3 +134,101 @@ class TestStatsAggregator(unittest.TestCase):
 
     def test_max_per_second(self):
         self.assertEquals(4, self.aggr.max_per_second)
+
+class TestQuantileSketch(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(42)
+        self.values = [rand.lognormvariate(-2, 1) for i in range(5000)]
+        self.sketches = [QuantileSketch(0.01), QuantileSketch(0.01)]
+        for i, value in enumerate(self.values):
+            self.sketches[i % 2].add(value)
+        self.values.sort()
+
+    def test_error_bound(self):
+        sketch = self.sketches[0]
+        sketch.merge(self.sketches[1])
+        self.assertEquals(5000, sketch.count)
+        ranks = range(0, 5000, 50)
+        for rank, value in zip(ranks, sketch.quantiles(ranks)):
+            exact = self.values[rank]
+            self.assert_(abs(value - exact) <= 0.01 * exact,
+                         (rank, value, exact))
+
+    def test_bounded_memory(self):
+        sketch = QuantileSketch(0.01)
+        value = 1e-6
+        while value < 86400:
+            sketch.add(value)
+            value *= 1.001
+        self.assert_(len(sketch.buckets) < 1300)
+
+    def test_zero(self):
+        sketch = QuantileSketch(0.01)
+        sketch.add(0)
+        sketch.add(1)
+        self.assertEquals([0], sketch.quantiles([0]))
+
+    def test_accumulator_and_aggregator(self):
+        accums = [StatsAccumulator(10, 1.5, 0.01),
+                  StatsAccumulator(10, 1.5, 0.01)]
+        for i, value in enumerate(self.values):
+            accums[i % 2].add_record(i / 500, value)
+        self.assertEquals([], accums[0].values)
+        self.assertEquals(2500, len(accums[0]))
+        aggr = StatsAggregator(accums)
+        aggr.compute_percentiles(10)
+        for perc in range(0, 100, 10):
+            exact = self.values[int(perc / 100.0 * 5000)]
+            value = getattr(aggr, 'perc%d' % perc)
+            self.assert_(abs(value - exact) <= 0.01 * exact, (perc, value, exact))
+        self.assertEquals(5000, len(list(aggr.ordered_values)))
+
+    def test_add_sequence(self):
+        sketch, expected = QuantileSketch(0.01), QuantileSketch(0.01)
+        sketch.add_sequence(9.9, 0.1, 0.1, 2)
+        for i in range(99):
+            expected.add(9.9 - i * 0.1, 2)
+        self.assertEquals(expected.count, sketch.count)
+        ranks = range(0, 198, 7)
+        for value, exact in zip(sketch.quantiles(ranks),
+                                expected.quantiles(ranks)):
+            self.assert_(abs(value - exact) <= 0.021 * exact, (value, exact))
+
+
+class TestCoordinatedOmission(unittest.TestCase):
+    def setUp(self):
+        # 99 fast tests and a stall of 10s
+        self.accum = StatsAccumulator(10, 1.5, co_correction=True)
+        for i in range(99):
+            self.accum.add_record(i / 10., 0.1)
+        self.accum.add_record(10, 10)
+
+    def test_backfill(self):
+        sketch = self.accum.corrected_sketch()
+        # the stall prevented 99 tests, from 9.9s down to 0.2s
+        self.assertEquals(199, sketch.count)
+        self.assertEquals(100, backfill(self.accum.corrected, 0).count)
+        stats = self.accum.stats_list()
+        self.assertEquals(17, len(stats))
+        raw_p95, corrected_p95 = stats[13], stats[16]
+        self.assertAlmostEquals(0.1, raw_p95)
+        self.assert_(9 < corrected_p95 < 10, corrected_p95)
+
+    def test_start_delay(self):
+        accum = StatsAccumulator(10, 1.5, co_correction=True)
+        accum.co_interval = 0
+        for i in range(100):
+            accum.add_record(i / 10., 0.1, start_delay=i < 10 and 1 or 0)
+        # the 10 late tests are above the 90th percentile
+        med, p90, p95 = accum.stats_list()[-3:]
+        self.assertAlmostEquals(0.1, med, delta=0.002)
+        self.assertAlmostEquals(1.1, p95, delta=0.02)
+
+    def test_aggregator(self):
+        aggr = StatsAggregator([self.accum], co_correction=True)
+        self.assertEquals(self.accum.stats_list()[-3:],
+                          aggr.stats_list()[-3:])
+        self.assertEquals([0, 0, 0],
+                          StatsAggregator([], True).stats_list()[-3:])
+        self.assertEquals(14, len(StatsAggregator([self.accum]).stats_list()))
+
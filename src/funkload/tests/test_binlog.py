@@ -0,0 +1,83 @@
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+from funkload.binlog import BinaryResultsLogger, read_results
+from funkload.binlog import binary_to_xml, xml_to_binary
+from funkload.binlog import FUNKLOAD, CONFIG, RECORD
+
+ATTRIBUTES = {'cycle': 1, 'cvus': 10, 'thread_id': 3,
+              'suite_name': 'Simple', 'test_name': 'test_simple',
+              'time': 1300000000.25, 'duration': 0.5,
+              'tls_handshake': 0.125}
+
+
+class TestBinaryResults(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = mkdtemp('funkload')
+        self.path = os.path.join(self.tmp_dir, 'result.flb')
+        logger = BinaryResultsLogger(self.path)
+        logger.start_log('1.16.1', '2011-10-26T10:00:00')
+        logger.config('cycles', '[10]')
+        logger.record(ATTRIBUTES, {'result': 'Successful', 'url': '/a'},
+                      {'Page': 'get /a'})
+        attributes = ATTRIBUTES.copy()
+        attributes['startup'] = True
+        del attributes['tls_handshake']
+        logger.record(attributes, {'result': 'Error', 'body': 'x' * 1000},
+                      {'Page': 'get /a'})
+        logger.end_log()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_events(self, path, wait=None):
+        events = list(read_results(path, wait))
+        self.assertEquals((FUNKLOAD, '1.16.1', '2011-10-26T10:00:00'),
+                          events[0])
+        self.assertEquals((CONFIG, 'cycles', '[10]'), events[1])
+        record, attributes, subitems, aggregates = events[2]
+        self.assertEquals(RECORD, record)
+        self.assertEquals(ATTRIBUTES, attributes)
+        self.assertEquals({'result': 'Successful', 'url': '/a'}, subitems)
+        self.assertEquals({'Page': 'get /a'}, aggregates)
+        attributes, subitems = events[3][1:3]
+        self.assertEquals('True', attributes['startup'])
+        self.assertEquals('x' * 1000, subitems['body'])
+        self.assertEquals(4, len(events))
+
+    def test_read(self):
+        self.check_events(self.path)
+
+    def test_xml_conversion(self):
+        xml_path = os.path.join(self.tmp_dir, 'result.xml')
+        binary_to_xml(self.path, xml_path)
+        binary_path = os.path.join(self.tmp_dir, 'converted.flb')
+        xml_to_binary(xml_path, binary_path)
+        self.check_events(binary_path)
+
+    def test_truncated(self):
+        with open(self.path, 'rb') as result_file:
+            data = result_file.read()
+        with open(self.path, 'wb') as result_file:
+            result_file.write(data[:-20])
+        self.assertEquals(3, len(list(read_results(self.path))))
+
+    def test_follow(self):
+        with open(self.path, 'rb') as result_file:
+            data = result_file.read()
+        with open(self.path, 'wb') as result_file:
+            result_file.write(data[:-20])
+        calls = []
+        def wait():
+            # the end of the record is written while reading
+            calls.append(1)
+            with open(self.path, 'ab') as result_file:
+                result_file.write(data[-20:])
+            return len(calls) == 1
+        self.check_events(self.path, wait)
+        self.assertEquals(1, len(calls))
+
+
+if __name__ == '__main__':
+    unittest.main()
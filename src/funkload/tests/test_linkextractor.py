@@ -0,0 +1,57 @@
+import unittest
+from funkload.linkextractor import extract_resources, PageCache
+
+PAGE = """<html><head>
+<base href="/sub/">
+<link rel="stylesheet" href="a.css?x=1&amp;y=2">
+<link rel="canonical" href="/canonical">
+<link href='/no_rel.css'>
+<script src=js/app.js></script>
+<style>body { background: url("bg.png") } .a { background: url(data:x) }</style>
+</head>
+<!-- <img src="hidden.png"> -->
+<body>
+<IMG SRC="i.gif" alt=x>
+<div style="background-image: url('d.png')"></div>
+<img src="i.gif">
+<script>var x = 1;</script>
+</body></html>"""
+
+
+class TestLinkExtractor(unittest.TestCase):
+    def test_extract_resources(self):
+        self.assertEquals(
+            [('link', 'http://host/sub/a.css?x=1&y=2'),
+             ('link', 'http://host/no_rel.css'),
+             ('script', 'http://host/sub/js/app.js'),
+             ('image', 'http://host/sub/bg.png'),
+             ('image', 'http://host/sub/i.gif'),
+             ('image', 'http://host/sub/d.png')],
+            extract_resources('http://host/page/index.html', PAGE))
+
+    def test_no_base(self):
+        self.assertEquals(
+            [('image', 'http://host/page/a.png')],
+            extract_resources('http://host/page/index.html',
+                              '<p><img src="a.png"></p>'))
+
+
+class TestPageCache(unittest.TestCase):
+    def test_lru(self):
+        cache = PageCache(size=2)
+        calls = []
+        def extract(page):
+            calls.append(page)
+            return page.upper()
+        for page in ('a', 'b', 'a', 'c', 'a', 'b'):
+            self.assertEquals(page.upper(), cache.get(
+                'http://host/', page, 'links', lambda: extract(page)))
+        # b was evicted by c
+        self.assertEquals(['a', 'b', 'c', 'b'], calls)
+        self.assertEquals((2, 4), cache.stats())
+        cache.get('http://host/', 'a', 'base', lambda: extract('a'))
+        self.assertEquals((2, 5), cache.stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import pickle
+import unittest
+from funkload.livestats import LiveStats, render_prometheus
+
+
+class TestLiveStats(unittest.TestCase):
+    def setUp(self):
+        self.stats = LiveStats(window=10)
+        self.stats.startCycle(0, 2)
+        for i in range(100):
+            self.stats.record({'Page': 'get /a'}, 1000.0 + i / 10., 0.1,
+                              i % 10 == 0)
+        self.stats.record({'Test': 'test_simple'}, 1009.5, 1.0, False)
+        self.stats.addThreadStart(0.5)
+        self.stats.addThreadStart(0.1)
+
+    def test_snapshot(self):
+        snapshot = self.stats.snapshot(2, now=1009.9)
+        pages = snapshot['pages']
+        self.assertEquals(100, pages['total'])
+        self.assertEquals(10, pages['errors'])
+        self.assertEquals(10., pages['per_second'])
+        self.assertEquals(0.1, pages['error_rate'])
+        self.assertAlmostEquals(0.1, pages['p99'], delta=0.002)
+        self.assertEquals(1, snapshot['tests']['total'])
+        self.assertEquals(0, snapshot['requests']['total'])
+        self.assertEquals(0.5, snapshot['thread_start_lag']['max'])
+        self.assertAlmostEquals(0.3, snapshot['thread_start_lag']['average'])
+
+    def test_window(self):
+        # the first five seconds are out of the window
+        pages = self.stats.snapshot(2, now=1014.9)['pages']
+        self.assertEquals(100, pages['total'])
+        self.assertEquals(5., pages['per_second'])
+        self.stats.startCycle(1, 4)
+        snapshot = self.stats.snapshot(4, now=1030.)
+        self.assertEquals(0, snapshot['pages']['cycle_total'])
+        self.assertEquals(0., snapshot['pages']['per_second'])
+        self.assertEquals(0, snapshot['thread_start_lag']['count'])
+
+    def test_merge(self):
+        # the parent runner merges the live stats of its worker processes
+        parent = LiveStats(window=10)
+        parent.startCycle(0, 4)
+        parent.merge(pickle.loads(pickle.dumps(self.stats.export())))
+        worker = LiveStats(window=10)
+        worker.record({'Page': 'get /a'}, 1009.5, 0.2, True)
+        worker.record({'Response by description': 'get /a'}, 1009.5, 0.1,
+                      False)
+        worker.addThreadStart(0.7)
+        parent.merge(pickle.loads(pickle.dumps(worker.export())))
+        snapshot = parent.snapshot(4, now=1009.9)
+        pages = snapshot['pages']
+        self.assertEquals(101, pages['total'])
+        self.assertEquals(101, pages['cycle_total'])
+        self.assertEquals(11, pages['errors'])
+        self.assertEquals(10.1, pages['per_second'])
+        self.assertEquals(1, snapshot['requests']['total'])
+        self.assertEquals(1, snapshot['tests']['total'])
+        self.assertEquals(3, snapshot['thread_start_lag']['count'])
+        self.assertEquals(0.7, snapshot['thread_start_lag']['max'])
+        # the exported records are not exported again
+        self.assertEquals(0, self.stats.snapshot(2, now=1009.9)[
+            'pages']['total'])
+        parent.merge(self.stats.export())
+        self.assertEquals(101, parent.snapshot(4, now=1009.9)[
+            'pages']['total'])
+
+    def test_prometheus(self):
+        text = render_prometheus(self.stats.snapshot(2, now=1009.9))
+        self.assert_('funkload_cycle 0.0\n' in text)
+        self.assert_('funkload_records_total{kind="pages"} 100.0\n' in text)
+        self.assert_('# TYPE funkload_errors_total counter\n' in text)
+        self.assert_('funkload_duration_seconds{kind="tests",quantile="0.5"}'
+                     in text)
+
+
+if __name__ == '__main__':
+    unittest.main()
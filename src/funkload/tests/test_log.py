@@ -0,0 +1,45 @@
+import threading
+import unittest
+from funkload.log import BufferedResultsLogger
+
+
+class ListLogger(object):
+    def __init__(self):
+        self.records = []
+
+    def record(self, attributes, subitems, aggregates):
+        self.records.append((attributes, subitems, aggregates))
+
+
+class TestBufferedResultsLogger(unittest.TestCase):
+    def test_short_lived_threads(self):
+        logger = ListLogger()
+        buffered = BufferedResultsLogger(logger)
+        def run(number):
+            buffered.record({'number': number}, {}, {'Page': 'get /'})
+        for batch in range(10):
+            threads = [threading.Thread(target=run, args=(batch * 10 + i,))
+                       for i in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            buffered.drain()
+            self.assertEquals(0, len(buffered.buffers))
+        self.assertEquals(100, len(logger.records))
+        self.assertEquals(100, buffered.records)
+
+    def test_alive_thread(self):
+        logger = ListLogger()
+        buffered = BufferedResultsLogger(logger)
+        buffered.record({'number': 1}, {}, {'Page': 'get /'})
+        buffered.drain()
+        # the buffer of the running thread is kept
+        self.assertEquals(1, len(buffered.buffers))
+        buffered.record({'number': 2}, {}, {'Page': 'get /'})
+        buffered.drain()
+        self.assertEquals(2, len(logger.records))
+
+
+if __name__ == '__main__':
+    unittest.main()
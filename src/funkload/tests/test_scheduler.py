@@ -0,0 +1,56 @@
+import pickle
+import threading
+import time
+import unittest
+from funkload.scheduler import Scheduler, SleepStats
+
+
+class TestSleepStats(unittest.TestCase):
+    def test_snapshot(self):
+        stats = SleepStats()
+        for i in range(100):
+            stats.add(1., 1. + i / 1000.)
+        snapshot = stats.snapshot(reset=True)
+        self.assertEquals(100, snapshot['count'])
+        self.assertAlmostEquals(0.0495, snapshot['average_drift'])
+        self.assertAlmostEquals(0.05, snapshot['p50_drift'], delta=0.001)
+        self.assertAlmostEquals(0.099, snapshot['p99_drift'], delta=0.001)
+        self.assertAlmostEquals(0.099, snapshot['max_drift'])
+        self.assertEquals(0, stats.snapshot()['count'])
+
+    def test_merge(self):
+        # the stats of the worker processes
+        workers = [SleepStats(), SleepStats()]
+        for i in range(100):
+            workers[i % 2].add(1., 1. + i / 1000.)
+        stats = SleepStats()
+        for worker in workers:
+            stats.merge(pickle.loads(pickle.dumps(worker.export())))
+            self.assertEquals(0, worker.snapshot()['count'])
+        snapshot = stats.snapshot()
+        self.assertEquals(100, snapshot['count'])
+        self.assertAlmostEquals(0.0495, snapshot['average_drift'])
+        self.assertAlmostEquals(0.05, snapshot['p50_drift'], delta=0.001)
+        self.assertAlmostEquals(0.099, snapshot['max_drift'])
+
+
+class TestScheduler(unittest.TestCase):
+    def test_sleep(self):
+        scheduler = Scheduler(tick=0.005)
+        threads = [threading.Thread(target=scheduler.sleep,
+                                    args=(0.01 + i * 0.003,))
+                   for i in range(20)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(time.time() - start >= 0.067)
+        snapshot = scheduler.stats.snapshot()
+        self.assertEquals(20, snapshot['count'])
+        self.assertTrue(snapshot['average_drift'] >= 0)
+        self.assertEquals(0, scheduler.pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
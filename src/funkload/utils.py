@@ -41,7 +41,8 @@ def thread_sleep(seconds=0):
     # looks like python >= 2.5 does not need a minimal sleep to let thread
     # working properly
     if seconds:
-        sleep(seconds)
+        # not the imported sleep to use the gevent patched one
+        time.sleep(seconds)
 
 # ------------------------------------------------------------
 # semaphores